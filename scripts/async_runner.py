@@ -0,0 +1,357 @@
+import os
+import time
+import shutil
+import asyncio
+import argparse
+import logging
+from urllib.parse import urlsplit
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from db import add_db_arguments, load_db_config
+from repositories import (build_clone_options, get_repositories_to_clone, log_clone_summary, repo_name,
+                          unique_repo_urls, write_heads_report, SPARSE_CHECKOUT_PATTERNS)
+from scanner import scan_repository_task, write_to_json
+from scan_cache import ScanCache
+from scan_results import write_ndjson_record, is_ndjson
+from discovery import load_scan_config, DEFAULT_SCAN_CONFIG
+from metrics import METRICS, reset_metrics, add_profile_arguments, profile_run
+
+class GitError(Exception):
+    """
+    A git command exited with an error or timed out.
+    """
+
+class HostLimiter:
+    """
+    Per-host limits for git operations: a maximum number of operations in flight against
+    each host and, optionally, a maximum rate at which new ones are started.
+    """
+
+    def __init__(self, per_host=8, rate=None):
+        """
+        Create a limiter with no operation in flight.
+        
+        :param per_host: Maximum number of operations running against the same host.
+        :param rate: Maximum number of operations started per second against the same host, or None.
+        """
+        self.per_host = per_host
+        self.interval = 1.0 / rate if rate else 0.0
+        self.semaphores = {}
+        self.next_start = {}
+
+    async def acquire(self, host):
+        """
+        Wait until a new operation can start against a host.
+        
+        :param host: Host name.
+        """
+        semaphore = self.semaphores.setdefault(host, asyncio.Semaphore(self.per_host))
+        await semaphore.acquire()
+        if self.interval:
+            # Reserve the next start slot of the host; the event loop is single-threaded, so no lock is needed
+            now = time.monotonic()
+            start = max(now, self.next_start.get(host, now))
+            self.next_start[host] = start + self.interval
+            if start > now:
+                await asyncio.sleep(start - now)
+
+    def release(self, host):
+        """
+        Signal that an operation against a host has finished.
+        
+        :param host: Host name.
+        """
+        self.semaphores[host].release()
+
+def url_host(repo_url):
+    """
+    Get the host a repository URL points to, used to apply the per-host limits.
+    
+    :param repo_url: URL of the repository, including scp-like URLs such as git@github.com:org/repo.git.
+    :return: Host name, or 'local' for local paths and file:// URLs.
+    """
+    host = urlsplit(repo_url).hostname
+    if host is None and '://' not in repo_url and ':' in repo_url.split('/')[0]:
+        host = repo_url.split(':')[0].split('@')[-1]
+    return host or 'local'
+
+async def run_git(args, cwd=None, timeout=None):
+    """
+    Run a git command as an asynchronous subprocess.
+    
+    :param args: Arguments of the git command.
+    :param cwd: Working directory of the command, or None.
+    :param timeout: Seconds after which the command is killed, or None to wait forever.
+    :return: Standard output of the command, stripped.
+    """
+    process = await asyncio.create_subprocess_exec('git', *args, cwd=cwd, stdin=asyncio.subprocess.DEVNULL,
+                                                   stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise GitError(f"git {args[0]} timed out after {timeout}s")
+    if process.returncode != 0:
+        raise GitError(f"git {' '.join(args)} failed with exit code {process.returncode}: "
+                       f"{stderr.decode('utf-8', errors='replace').strip()}")
+    return stdout.decode('utf-8', errors='replace').strip()
+
+async def clone_repo(repo_url, clone_path, depth=None, blob_filter=None, sparse=False, timeout=None, no_checkout=False):
+    """
+    Clone a repository with git subprocesses.
+    
+    :param repo_url: URL of the repository to clone.
+    :param clone_path: Path where the repository will be cloned.
+    :param depth: Number of commits to fetch, or None for the full history.
+    :param blob_filter: Partial clone filter passed to git (e.g. 'blob:none'), or None.
+    :param sparse: Whether to check out only the files read by the scanner.
+    :param timeout: Seconds after which each git command is killed, or None to wait forever.
+    :param no_checkout: Whether to skip the working tree entirely.
+    """
+    logging.info(f"Cloning repository: {repo_url} into {clone_path}")
+    options = build_clone_options(depth, blob_filter, sparse, no_checkout)
+    await run_git(['clone', *options, '--', repo_url, clone_path], timeout=timeout)
+    if sparse and not no_checkout:
+        await run_git(['sparse-checkout', 'set', '--no-cone', *SPARSE_CHECKOUT_PATTERNS], clone_path, timeout)
+
+async def update_repo(clone_path, depth=None, timeout=None, no_checkout=False):
+    """
+    Fetch the latest commit of the checked out branch and reset the clone to it.
+    
+    :param clone_path: Path of the existing clone.
+    :param depth: Number of commits to fetch, or None for the full history.
+    :param timeout: Seconds after which each git command is killed, or None to wait forever.
+    :param no_checkout: Whether to only move the branch (soft reset), leaving the working tree empty.
+    """
+    logging.info(f"Updating repository at {clone_path}")
+    try:
+        refspec = await run_git(['symbolic-ref', '--short', '-q', 'HEAD'], clone_path, timeout)
+    except GitError:
+        # Detached HEAD
+        refspec = 'HEAD'
+    options = [f'--depth={depth}'] if depth else []
+    await run_git(['fetch', *options, 'origin', refspec], clone_path, timeout)
+    await run_git(['reset', '--soft' if no_checkout else '--hard', 'FETCH_HEAD'], clone_path, timeout)
+
+async def get_head(clone_path):
+    """
+    Get the commit the HEAD of a clone points to.
+    
+    :param clone_path: Path of the clone.
+    :return: Commit SHA as a string, or None if it cannot be read.
+    """
+    try:
+        return await run_git(['rev-parse', 'HEAD'], clone_path)
+    except (GitError, OSError):
+        return None
+
+async def sync_repo(repo_url, clone_path, limiter, semaphore, update=False, retries=2, retry_delay=5, **clone_options):
+    """
+    Clone a repository, or update it if it already exists and updates are enabled, retrying
+    on failure. Each attempt waits for the per-host limits of the repository's host and then
+    for a global slot, and gives both back before waiting to retry.
+    
+    :param repo_url: URL of the repository.
+    :param clone_path: Path where the repository is cloned.
+    :param limiter: HostLimiter shared by every operation.
+    :param semaphore: asyncio.Semaphore capping the git operations in flight.
+    :param update: Whether to fetch and reset existing clones instead of skipping them.
+    :param retries: Number of retries after the first failed attempt.
+    :param retry_delay: Base delay in seconds between attempts, multiplied by the attempt number.
+    :param clone_options: Extra options passed to clone_repo.
+    :return: Dictionary with the url, status, old_head and new_head of the repository (see clone_repos.sync_repo).
+    """
+    result = {'url': repo_url, 'old_head': None, 'new_head': None}
+    exists = os.path.exists(clone_path)
+    if exists and not update:
+        logging.info(f"Repository already exists at {clone_path}")
+        async with semaphore:
+            result['old_head'] = result['new_head'] = await get_head(clone_path)
+        result['status'] = 'skipped'
+        return result
+    if exists:
+        async with semaphore:
+            result['old_head'] = await get_head(clone_path)
+
+    host = url_host(repo_url)
+    result['status'] = 'failed'
+    for attempt in range(1, retries + 2):
+        # The host limits are waited for first, so repositories queued behind a busy host
+        # hold no global slot and repositories of other hosts keep cloning
+        await limiter.acquire(host)
+        try:
+            async with semaphore:
+                with METRICS.timer('git.update' if exists else 'git.clone', 'slowest_git_operations', repo_url):
+                    if exists:
+                        await update_repo(clone_path, clone_options.get('depth'), clone_options.get('timeout'),
+                                          clone_options.get('no_checkout', False))
+                    else:
+                        await clone_repo(repo_url, clone_path, **clone_options)
+            result['status'] = 'updated' if exists else 'cloned'
+            break
+        except (GitError, OSError) as e:
+            logging.error(f"Error processing {repo_url} (attempt {attempt}/{retries + 1}): {e}")
+            if not exists and os.path.exists(clone_path):
+                await asyncio.to_thread(shutil.rmtree, clone_path, ignore_errors=True)
+        finally:
+            limiter.release(host)
+        # Backing off holds no slot, so other repositories keep cloning meanwhile
+        if attempt <= retries:
+            await asyncio.sleep(retry_delay * attempt)
+
+    async with semaphore:
+        result['new_head'] = await get_head(clone_path)
+    if result['status'] == 'updated' and result['old_head'] == result['new_head']:
+        result['status'] = 'unchanged'
+    METRICS.count(f"repositories.{result['status']}")
+    return result
+
+async def iter_clone_and_scan(repo_urls, clone_path, concurrency=64, per_host=8, host_rate=None, scan_workers=None,
+                              cache_path=None, scan_config=None, update=False, retries=2, **clone_options):
+    """
+    Clone and scan repositories from a single event loop.
+    
+    Git operations run as asynchronous subprocesses, so hundreds of them can be in flight
+    without a thread each; concurrency is capped overall and per host. Each finished
+    checkout is handed off to a pool of worker processes for parsing, while the event loop
+    keeps cloning. Results are yielded in completion order.
+    
+    :param repo_urls: List of repository URLs.
+    :param clone_path: Path where the repositories are cloned.
+    :param concurrency: Maximum number of git operations in flight.
+    :param per_host: Maximum number of git operations in flight against the same host.
+    :param host_rate: Maximum number of git operations started per second against the same host, or None.
+    :param scan_workers: Number of scanner worker processes, or None for one per CPU.
+    :param cache_path: Path to the scan cache used for incremental scans, or None.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :param update: Whether to fetch and reset existing clones instead of skipping them.
+    :param retries: Number of retries for each git operation.
+    :param clone_options: Extra options passed to clone_repo.
+    :return: Asynchronous generator of (repo, sync result, repo_data or None) tuples.
+    """
+    scan_config = scan_config or DEFAULT_SCAN_CONFIG
+    # Clones without a working tree are scanned from the object store
+    ref = 'HEAD' if clone_options.get('no_checkout') else None
+    limiter = HostLimiter(per_host, host_rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    cache = ScanCache(cache_path) if cache_path else None
+    loop = asyncio.get_running_loop()
+    repo_urls = unique_repo_urls(repo_urls)
+
+    async def process(repo_url, executor):
+        repo = repo_name(repo_url)
+        repo_path = os.path.join(clone_path, repo)
+        result = await sync_repo(repo_url, repo_path, limiter, semaphore, update, retries, **clone_options)
+        if result['status'] == 'failed':
+            logging.error(f"Not scanning repository {repo}: {repo_url} could not be cloned")
+            return repo, result, None
+        # The cache is only used from the event loop thread
+        previous = (cache.get(repo) or {}) if cache is not None else None
+        try:
+            _, repo_data, state, _, _, worker_metrics = await loop.run_in_executor(
+                executor, scan_repository_task, repo, repo_path, previous, scan_config, ref, True)
+            METRICS.merge(worker_metrics)
+        except Exception:
+            logging.exception(f"Error scanning repository {repo}")
+            return repo, result, None
+        if cache is not None and state is not None:
+            state.pop('stats')
+            cache.put(repo, state)
+        return repo, result, repo_data
+
+    logging.info(f"Cloning and scanning {len(repo_urls)} repositories "
+                 f"({concurrency} git operations, {per_host} per host)")
+    try:
+        # Scan workers are started while the event loop and its to_thread workers are running, so
+        # they are spawned rather than forked, which could copy a lock held by another thread
+        with ProcessPoolExecutor(max_workers=scan_workers, initializer=reset_metrics,
+                                 mp_context=get_context('spawn')) as executor:
+            tasks = [asyncio.create_task(process(repo_url, executor)) for repo_url in repo_urls]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    yield await task
+            finally:
+                for task in tasks:
+                    task.cancel()
+    finally:
+        if cache is not None:
+            cache.close()
+
+async def clone_and_scan(repo_urls, json_output_path, clone_path, heads_output_path=None, **options):
+    """
+    Clone and scan repositories (see iter_clone_and_scan) and write the results.
+    
+    :param repo_urls: List of repository URLs.
+    :param json_output_path: Path to the output JSON file; a .ndjson/.jsonl extension streams
+                             the results as JSON Lines as soon as each repository is scanned.
+    :param clone_path: Path where the repositories are cloned.
+    :param heads_output_path: Path to a JSON file where the old and new HEAD of every repository is written, or None.
+    :param options: Options passed to iter_clone_and_scan.
+    """
+    start = time.perf_counter()
+    results = {}
+    data = {}
+    file = open(json_output_path, 'w') if is_ndjson(json_output_path) else None
+    try:
+        async for repo, result, repo_data in iter_clone_and_scan(repo_urls, clone_path, **options):
+            results[repo] = result
+            if repo_data is None:
+                continue
+            if file is not None:
+                write_ndjson_record(file, repo, repo_data)
+            else:
+                data[repo] = repo_data
+    finally:
+        if file is not None:
+            file.close()
+    if file is None:
+        write_to_json(dict(sorted(data.items())), json_output_path)
+
+    log_clone_summary(results)
+    logging.info(f"Cloned and scanned {len(results)} repositories in {time.perf_counter() - start:.2f}s")
+    if heads_output_path:
+        write_heads_report(results, heads_output_path)
+
+def main():
+    """
+    Main function to clone and scan the repositories of the database with asyncio.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Clone and scan repositories with asynchronous git subprocesses.')
+    add_db_arguments(parser)
+    parser.add_argument('--clone_path', type=str, required=True, help='Path where repositories will be cloned.')
+    parser.add_argument('--json_output_path', type=str, required=True, help='Path to the output JSON file (a .ndjson/.jsonl extension selects the JSON Lines format).')
+    parser.add_argument('--concurrency', type=int, default=64, help='Maximum number of git operations in flight.')
+    parser.add_argument('--per_host', type=int, default=8, help='Maximum number of git operations in flight against the same host.')
+    parser.add_argument('--host_rate', type=float, help='Maximum number of git operations started per second against the same host.')
+    parser.add_argument('--scan_workers', type=int, help='Number of worker processes used to scan repositories. Defaults to one per CPU.')
+    parser.add_argument('--cache_path', type=str, help='Path to the SQLite scan cache. Enables incremental scans when given.')
+    parser.add_argument('--config_path', type=str, help="Path to the configuration file with the 'scanner' settings.")
+    parser.add_argument('--heads_output_path', type=str, help='Path to a JSON file where the old and new HEAD of every repository is written.')
+    parser.add_argument('--depth', type=int, help='Create shallow clones with the given number of commits (e.g. 1).')
+    parser.add_argument('--filter', type=str, help="Partial clone filter, e.g. 'blob:none' for blobless clones.")
+    parser.add_argument('--sparse', action='store_true', help='Only check out the files read by the scanner.')
+    parser.add_argument('--no_checkout', action='store_true', help='Clone without a working tree and scan HEAD from the object store.')
+    parser.add_argument('--retries', type=int, default=2, help='Number of retries for each repository.')
+    parser.add_argument('--timeout', type=int, help='Seconds after which a git command is killed.')
+    parser.add_argument('--update', action='store_true', help='Fetch and reset existing clones instead of skipping them.')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    repo_urls = get_repositories_to_clone(load_db_config(args))
+    if not repo_urls:
+        logging.error("No repositories found to clone.")
+        return
+
+    with profile_run(args.profile, args.metrics_path):
+        asyncio.run(clone_and_scan(repo_urls, args.json_output_path, args.clone_path, args.heads_output_path,
+                                   concurrency=args.concurrency, per_host=args.per_host, host_rate=args.host_rate,
+                                   scan_workers=args.scan_workers, cache_path=args.cache_path,
+                                   scan_config=load_scan_config(args.config_path), update=args.update,
+                                   retries=args.retries, depth=args.depth, blob_filter=args.filter, sparse=args.sparse,
+                                   timeout=args.timeout, no_checkout=args.no_checkout))
+
+if __name__ == "__main__":
+    main()
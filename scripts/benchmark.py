@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import logging
+import tempfile
+import subprocess
+from datetime import datetime
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory is not reported
+    resource = None
+
+from db import add_db_arguments, load_db_config, connection
+from discovery import discover_files, load_scan_config
+from scanner import MANIFEST_PARSERS, iter_scan_repositories, list_repositories
+from scan_results import write_ndjson_record
+from export_to_db import export_batch
+from dependency_index import build_index
+from synthetic_corpus import add_corpus_arguments, corpus_config, generate_corpus
+
+BENCHMARKS = ('discovery', 'yaml', 'pom', 'requirements', 'scan', 'index', 'export')
+
+def peak_rss_kb():
+    """
+    Get the peak resident memory of the current process and of its finished children.
+    
+    :return: Peak resident set size in KB, or None where it cannot be measured.
+    """
+    if resource is None:
+        return None
+    scale = 1024 if sys.platform == 'darwin' else 1  # ru_maxrss is in bytes on macOS
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) // scale
+
+def discover_corpus(corpus_path, scan_config):
+    """
+    Discover the manifest files of every repository of a corpus.
+    
+    :param corpus_path: Directory containing the repositories.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :return: List of (repo_path, discovered files) tuples (see discovery.discover_files).
+    """
+    return [(repo_path, list(discover_files(repo_path, scan_config)))
+            for _, repo_path in list_repositories(corpus_path)]
+
+def parse_files(corpus, kind, scan_config):
+    """
+    Parse every manifest of one kind with its scanner parser.
+    
+    :param corpus: Discovered files (see discover_corpus).
+    :param kind: 'yaml', 'pom' or 'requirements'.
+    :param scan_config: Scanner settings.
+    :return: Number of files parsed.
+    """
+    parser = MANIFEST_PARSERS[kind]
+    options = dict(scan_config.get('parser_options', {}).get(kind) or {})
+    count = 0
+    for _, discovered in corpus:
+        if kind == 'pom':
+            options['repo_poms'] = [file_path for file_kind, _, file_path, _ in discovered if file_kind == 'pom']
+        for file_kind, _, file_path, _ in discovered:
+            if file_kind == kind:
+                parser(file_path, **options)
+                count += 1
+    return count
+
+def count_rows(results):
+    """
+    Count the database rows the scan results of several repositories are exported to.
+    
+    :param results: List of (repo, ScanResult) tuples.
+    :return: Number of yaml_files, dependencies and requirements rows.
+    """
+    return sum(len(repo_data.yaml_configs) + len(repo_data.dependencies) + len(repo_data.requirements or ())
+               for _, repo_data in results)
+
+def export_benchmark(results, db_config, batch_size):
+    """
+    Export scan results to the database, on repositories created for the benchmark and removed afterwards.
+    
+    :param results: List of (repo, repo_data) tuples.
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :param batch_size: Number of repositories per batch and rows per INSERT statement.
+    :return: Seconds spent exporting.
+    """
+    names = [repo for repo, _ in results]
+    with connection(db_config) as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO my_schema.organizations (initiative, contact, name, scan)
+            VALUES ('benchmark', 'benchmark', 'benchmark', FALSE)
+            ON CONFLICT (name) DO UPDATE SET scan = FALSE
+            RETURNING id
+        """)
+        org_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO my_schema.repositories (organization_id, name, link, scan)
+            SELECT %s, name, 'benchmark', FALSE FROM unnest(%s::text[]) AS name
+            ON CONFLICT (organization_id, name) DO NOTHING
+        """, (org_id, names))
+    try:
+        start = time.perf_counter()
+        with connection(db_config) as conn, conn.cursor() as cursor:
+            execution_date = datetime.now()
+            for index in range(0, len(results), batch_size):
+                export_batch(cursor, results[index:index + batch_size], execution_date, batch_size)
+        return time.perf_counter() - start
+    finally:
+        with connection(db_config) as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM my_schema.repositories WHERE organization_id = %s", (org_id,))
+            ids = [row[0] for row in cursor.fetchall()]
+            for table in ('yaml_files', 'dependencies', 'requirements'):
+                cursor.execute(f"DELETE FROM my_schema.{table} WHERE repository_id = ANY(%s)", (ids,))
+            cursor.execute("DELETE FROM my_schema.repositories WHERE organization_id = %s", (org_id,))
+            cursor.execute("DELETE FROM my_schema.organizations WHERE id = %s", (org_id,))
+
+def run_benchmark(name, corpus_path, options):
+    """
+    Run one benchmark. Called in a fresh process so its peak memory is measured in isolation.
+    
+    Setup work (discovery before parsing, scanning before indexing or exporting) is not timed.
+    
+    :param name: Name of the benchmark (see BENCHMARKS).
+    :param corpus_path: Directory containing the repositories.
+    :param options: Dictionary with the scan_config, workers, db_config and batch_size.
+    :return: Dictionary with the seconds taken, the items processed and their unit, and the peak RSS.
+    """
+    logging.basicConfig(level=options['log_level'])
+    scan_config = options['scan_config']
+    if name == 'discovery':
+        start = time.perf_counter()
+        items = sum(len(discovered) for _, discovered in discover_corpus(corpus_path, scan_config))
+        seconds, unit = time.perf_counter() - start, 'files'
+    elif name in MANIFEST_PARSERS:
+        corpus = discover_corpus(corpus_path, scan_config)
+        start = time.perf_counter()
+        items = parse_files(corpus, name, scan_config)
+        seconds, unit = time.perf_counter() - start, 'files'
+    elif name == 'scan':
+        start = time.perf_counter()
+        items = sum(1 for _ in iter_scan_repositories(corpus_path, options['workers'], scan_config=scan_config))
+        seconds, unit = time.perf_counter() - start, 'repos'
+    else:
+        results = list(iter_scan_repositories(corpus_path, options['workers'], scan_config=scan_config))
+        items, unit = count_rows(results), 'rows'
+        if name == 'index':
+            # SQLite stand-in for the database: the inverted index of dependency_index.py
+            with tempfile.TemporaryDirectory(prefix='benchmark_') as tmp:
+                results_path = os.path.join(tmp, 'results.ndjson')
+                with open(results_path, 'w') as file:
+                    for repo, repo_data in results:
+                        write_ndjson_record(file, repo, repo_data)
+                start = time.perf_counter()
+                build_index(results_path, os.path.join(tmp, 'index.db'))
+                seconds = time.perf_counter() - start
+        else:
+            seconds = export_benchmark(results, options['db_config'], options['batch_size'])
+    return {'seconds': seconds, 'items': items, 'unit': unit,
+            'rate': items / seconds if seconds else None, 'peak_rss_kb': peak_rss_kb()}
+
+def run_isolated(name, corpus_path, options, repeat=1):
+    """
+    Run a benchmark several times, each in a new process, and keep the fastest run.
+    
+    :param name: Name of the benchmark.
+    :param corpus_path: Directory containing the repositories.
+    :param options: Benchmark options (see run_benchmark).
+    :param repeat: Number of runs.
+    :return: Result of the fastest run, with the highest peak RSS of all runs.
+    """
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            runs.append(executor.submit(run_benchmark, name, corpus_path, options).result())
+    best = min(runs, key=lambda run: run['seconds'])
+    peaks = [run['peak_rss_kb'] for run in runs if run['peak_rss_kb'] is not None]
+    return dict(best, runs=len(runs), peak_rss_kb=max(peaks) if peaks else None)
+
+def git_commit():
+    """
+    Get the commit of the code being benchmarked.
+    
+    :return: Commit SHA of the repository containing this script, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(report, baseline):
+    """
+    Log the throughput of each benchmark relative to a previous report.
+    
+    :param report: Current benchmark report.
+    :param baseline: Previous benchmark report, e.g. from another commit.
+    """
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get('rate') or not result.get('rate'):
+            continue
+        change = (result['rate'] / previous['rate'] - 1) * 100
+        logging.info(f"{name}: {result['rate']:.1f} {result['unit']}/s vs {previous['rate']:.1f} "
+                     f"({change:+.1f}%) against {(baseline.get('commit') or 'baseline')[:12]}")
+
+def run_benchmarks(corpus_path, names, options, repeat=1):
+    """
+    Run a list of benchmarks on a corpus.
+    
+    :param corpus_path: Directory containing the repositories.
+    :param names: Names of the benchmarks to run.
+    :param options: Benchmark options (see run_benchmark).
+    :param repeat: Number of runs of each benchmark.
+    :return: Dictionary mapping benchmark names to their results.
+    """
+    results = {}
+    for name in names:
+        result = run_isolated(name, corpus_path, options, repeat)
+        logging.info(f"{name}: {result['items']} {result['unit']} in {result['seconds']:.3f}s "
+                     f"({result['rate'] or 0:.1f} {result['unit']}/s, peak RSS {result['peak_rss_kb']} KB)")
+        results[name] = result
+    return results
+
+def main():
+    """
+    Main function to benchmark the scanner and the exports on a synthetic or existing corpus
+    and write the results to a JSON file.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the scanner and exports on a synthetic corpus.')
+    parser.add_argument('--output_path', type=str, required=True, help='Path to the JSON file with the results.')
+    parser.add_argument('--corpus_path', type=str, help='Existing corpus to benchmark. A synthetic corpus is generated in a temporary directory otherwise.')
+    parser.add_argument('--benchmarks', type=str, default='discovery,yaml,pom,requirements,scan,index',
+                        help=f"Comma-separated benchmarks to run, among: {', '.join(BENCHMARKS)}. 'export' needs a database.")
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes of the scan benchmarks.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each benchmark; the fastest is kept.')
+    parser.add_argument('--batch_size', type=int, default=1000, help='Batch size of the export benchmark.')
+    parser.add_argument('--config_path', type=str, help="Path to the configuration file with the 'scanner' settings.")
+    parser.add_argument('--compare_path', type=str, help='Previous results file to compare the throughput against.')
+    parser.add_argument('--log_level', type=str, default='WARNING', help='Log level of the benchmarked code.')
+    add_corpus_arguments(parser)
+    # The database is only needed by the export benchmark
+    add_db_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    names = [name.strip() for name in args.benchmarks.split(',') if name.strip()]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+    options = {'scan_config': load_scan_config(args.config_path), 'workers': args.workers,
+               'db_config': load_db_config(args) if 'export' in names else None,
+               'batch_size': args.batch_size, 'log_level': args.log_level}
+
+    tmp_path = None
+    corpus_path = args.corpus_path
+    corpus = None
+    if corpus_path is None:
+        tmp_path = tempfile.mkdtemp(prefix='benchmark_corpus_')
+        corpus_path = os.path.join(tmp_path, 'corpus')
+        corpus = corpus_config(args)
+        start = time.perf_counter()
+        corpus.update(generate_corpus(corpus_path, corpus))
+        logging.info(f"Generated corpus in {time.perf_counter() - start:.2f}s")
+    try:
+        results = run_benchmarks(corpus_path, names, options, args.repeat)
+    finally:
+        if tmp_path:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'corpus': corpus or {'path': corpus_path},
+        'workers': args.workers,
+        'results': results
+    }
+    with open(args.output_path, 'w') as file:
+        json.dump(report, file, indent=4)
+    logging.info(f"Wrote benchmark results to {args.output_path}")
+
+    if args.compare_path:
+        with open(args.compare_path, 'r') as file:
+            compare_results(report, json.load(file))
+
+if __name__ == "__main__":
+    main()
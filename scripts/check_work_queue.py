@@ -0,0 +1,220 @@
+import os
+import sys
+import time
+import argparse
+import logging
+import threading
+from db import add_db_arguments, load_db_config, connection, cursor
+from work_queue import WorkQueue, CLAIM
+
+# Statements of sql/create_tables.sql use this schema, replaced by the throwaway one
+SQL_SCHEMA = 'my_schema'
+
+def create_schema(db_config, schema, repos):
+    """
+    Create a throwaway schema with the tables of sql/create_tables.sql, one organization and
+    the given number of repositories to scan, plus one repository that is not to be scanned.
+    
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :param schema: Name of the schema, which must not exist.
+    :param repos: Number of repositories to scan.
+    :return: Sorted list of the IDs of the repositories to scan.
+    """
+    sql_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sql', 'create_tables.sql')
+    with open(sql_path, 'r') as file:
+        statements = file.read().replace(SQL_SCHEMA, schema)
+    with cursor(db_config) as cur:
+        cur.execute(f"CREATE SCHEMA {schema}")
+        # Foreign keys of the script reference the tables without their schema
+        cur.execute(f"SET LOCAL search_path TO {schema}")
+        cur.execute(statements)
+        cur.execute(f"""
+            INSERT INTO {schema}.organizations (initiative, contact, name, scan)
+            VALUES ('check', 'check', 'check', TRUE) RETURNING id
+        """)
+        organization_id = cur.fetchone()[0]
+        cur.execute(f"""
+            INSERT INTO {schema}.repositories (organization_id, name, link, scan)
+            SELECT %s, 'repo' || n, 'file:///check/repo' || n, n <= %s
+            FROM generate_series(1, %s + 1) AS n
+            RETURNING id, scan
+        """, (organization_id, repos, repos))
+        return sorted(repo_id for repo_id, scan in cur.fetchall() if scan)
+
+def drop_schema(db_config, schema):
+    """
+    Drop the throwaway schema and everything in it.
+    
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :param schema: Name of the schema.
+    """
+    with cursor(db_config) as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+
+def claim_all(work_queue, batch_size, barrier, claimed):
+    """
+    Claim batches of repositories until none is left, after every node is ready.
+    
+    :param work_queue: WorkQueue of the node.
+    :param batch_size: Number of repositories claimed at a time.
+    :param barrier: threading.Barrier shared by the nodes, so their claims overlap.
+    :param claimed: List to which the claimed repository IDs are appended.
+    """
+    barrier.wait()
+    while True:
+        rows = work_queue.claim(batch_size)
+        if not rows:
+            break
+        claimed.extend(repo_id for repo_id, _ in rows)
+
+def check_concurrent_claims(db_config, schema, repo_ids, nodes, batch_size, check):
+    """
+    Let several nodes claim the queue at the same time and check that every repository to
+    scan is leased by exactly one of them.
+    
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :param schema: Name of the throwaway schema.
+    :param repo_ids: IDs of the repositories to scan.
+    :param nodes: Number of nodes claiming at the same time.
+    :param batch_size: Number of repositories claimed at a time.
+    :param check: Function called with a condition and a description.
+    """
+    queues = [WorkQueue(db_config, f'node-{index}', schema=schema) for index in range(nodes)]
+    queues[0].enqueue()
+    barrier = threading.Barrier(nodes)
+    claimed = [[] for _ in queues]
+    threads = [threading.Thread(target=claim_all, args=(work_queue, batch_size, barrier, ids))
+               for work_queue, ids in zip(queues, claimed)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_claimed = [repo_id for ids in claimed for repo_id in ids]
+    logging.info(f"Claims per node: {', '.join(str(len(ids)) for ids in claimed)}")
+    check(len(all_claimed) == len(set(all_claimed)), "no repository is leased by two nodes")
+    check(sorted(all_claimed) == repo_ids, "every repository to scan is leased, and no other")
+    with cursor(db_config) as cur:
+        cur.execute(f"SELECT id, lease_owner FROM {schema}.repositories WHERE lease_owner IS NOT NULL")
+        owners = dict(cur.fetchall())
+    check(all(owners.get(repo_id) == work_queue.node_id
+              for work_queue, ids in zip(queues, claimed) for repo_id in ids),
+          "the lease owner of each repository is the node that claimed it")
+
+    for work_queue, ids in zip(queues, claimed):
+        work_queue.complete(ids)
+    check(queues[0].pending() == 0, "the queue is empty once every node completes its repositories")
+
+def check_skip_locked(db_config, schema, repo_ids, batch_size, check):
+    """
+    Hold the rows of an uncommitted claim and check that another node claims other rows
+    without waiting for it, and claims the held rows once the first claim rolls back.
+    
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :param schema: Name of the throwaway schema.
+    :param repo_ids: IDs of the repositories to scan.
+    :param batch_size: Number of repositories held by the uncommitted claim.
+    :param check: Function called with a condition and a description.
+    """
+    other = WorkQueue(db_config, 'other', schema=schema)
+    other.enqueue()
+    claimed = []
+    with connection(db_config) as conn, conn.cursor() as cur:
+        cur.execute(CLAIM.format(schema=schema), {'node_id': 'holder', 'lease_seconds': 60,
+                                                  'max_attempts': other.max_attempts, 'limit': batch_size})
+        held = {repo_id for repo_id, _ in cur.fetchall()}
+        thread = threading.Thread(target=lambda: claimed.extend(other.claim(len(repo_ids))), daemon=True)
+        thread.start()
+        thread.join(10)
+        check(not thread.is_alive(), "a claim does not wait for the rows locked by another claim")
+        conn.rollback()
+    thread.join()
+    claimed_ids = {repo_id for repo_id, _ in claimed}
+    check(not claimed_ids & held, "rows locked by another claim are skipped")
+    check(claimed_ids | held == set(repo_ids), "every other repository is claimed")
+    again = {repo_id for repo_id, _ in other.claim(len(repo_ids))}
+    check(again == held, "the skipped rows are claimed once the other claim rolls back")
+    other.complete(list(claimed_ids | again))
+
+def check_expired_leases(db_config, schema, repo_ids, lease_seconds, check):
+    """
+    Check that a lease blocks other nodes until it expires, that expired leases are claimed
+    again, and that heartbeats keep a lease from expiring.
+    
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :param schema: Name of the throwaway schema.
+    :param repo_ids: IDs of the repositories to scan.
+    :param lease_seconds: Lease of the nodes, waited for until it expires.
+    :param check: Function called with a condition and a description.
+    """
+    crashed = WorkQueue(db_config, 'crashed', lease_seconds=lease_seconds, max_attempts=10, schema=schema)
+    survivor = WorkQueue(db_config, 'survivor', lease_seconds=lease_seconds, max_attempts=10, schema=schema)
+    crashed.enqueue()
+    # The crashed node sends no heartbeat
+    crashed.claim(len(repo_ids))
+    check(not survivor.claim(len(repo_ids)), "leased repositories are not claimed by other nodes")
+    time.sleep(lease_seconds + 0.5)
+    reclaimed = sorted(repo_id for repo_id, _ in survivor.claim(len(repo_ids)))
+    check(reclaimed == repo_ids, "repositories whose lease expired are claimed again")
+    with cursor(db_config) as cur:
+        cur.execute(f"SELECT DISTINCT attempts FROM {schema}.repositories WHERE id = ANY(%s)", (repo_ids,))
+        attempts = [row[0] for row in cur.fetchall()]
+    check(attempts == [2], "claiming an expired lease counts a new attempt")
+    check(crashed.release(repo_ids) == 0, "a node cannot release repositories reclaimed by another node")
+    survivor.release(reclaimed, error='check')
+
+    alive = WorkQueue(db_config, 'alive', lease_seconds=lease_seconds, heartbeat_interval=lease_seconds / 4,
+                      max_attempts=10, schema=schema)
+    alive.claim(len(repo_ids))
+    alive.start()
+    try:
+        time.sleep(lease_seconds + 0.5)
+        check(not survivor.claim(len(repo_ids)), "heartbeats keep leases from expiring")
+    finally:
+        alive.stop()
+    released = sorted(repo_id for repo_id, _ in survivor.claim(len(repo_ids)))
+    check(released == repo_ids, "repositories released by a stopping node are claimed at once")
+    survivor.complete(released)
+
+def main():
+    """
+    Main function to check the work queue against a throwaway schema of a local database.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Check the leases of the work queue (work_queue.py) against a throwaway schema.')
+    add_db_arguments(parser)
+    parser.add_argument('--repos', type=int, default=200, help='Number of queued repositories.')
+    parser.add_argument('--nodes', type=int, default=2, help='Number of nodes claiming at the same time.')
+    parser.add_argument('--batch_size', type=int, default=7, help='Number of repositories claimed at a time.')
+    parser.add_argument('--lease_seconds', type=int, default=2, help='Lease waited for in the expiry checks.')
+    parser.add_argument('--schema', type=str, default=f'work_queue_check_{os.getpid()}', help='Name of the throwaway schema.')
+    parser.add_argument('--keep_schema', action='store_true', help='Keep the throwaway schema after the checks.')
+    args = parser.parse_args()
+
+    failures = []
+
+    def check(condition, description):
+        if condition:
+            logging.info(f"OK: {description}")
+        else:
+            logging.error(f"FAILED: {description}")
+        if not condition:
+            failures.append(description)
+
+    db_config = load_db_config(args)
+    repo_ids = create_schema(db_config, args.schema, args.repos)
+    try:
+        check_concurrent_claims(db_config, args.schema, repo_ids, args.nodes, args.batch_size, check)
+        check_skip_locked(db_config, args.schema, repo_ids, args.batch_size, check)
+        check_expired_leases(db_config, args.schema, repo_ids, args.lease_seconds, check)
+    finally:
+        if not args.keep_schema:
+            drop_schema(db_config, args.schema)
+    if failures:
+        logging.error(f"{len(failures)} work queue checks failed")
+        sys.exit(1)
+    logging.info("Every work queue check passed")
+
+if __name__ == "__main__":
+    main()
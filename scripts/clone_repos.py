@@ -1,43 +1,147 @@
 import os
+import time
+import shutil
 import argparse
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from git import Repo, Git
-import psycopg2
+from db import add_db_arguments, load_db_config
+from repositories import (build_clone_options, get_repositories_to_clone, log_clone_summary, repo_name,
+                          unique_repo_urls, write_heads_report, SPARSE_CHECKOUT_PATTERNS)
+from metrics import METRICS, add_profile_arguments, profile_run
 
-# Configurar GitPython para usar el ejecutable de Git explícitamente
+# Configurar GitPython para usar el ejecutable de Git explícitamente si existe; si no, GitPython
+# usa el de la variable de entorno GIT_PYTHON_GIT_EXECUTABLE o el git del PATH
 git_executable_path = r"C:\Users\juan.jimenez_bluetab\AppData\Local\Atlassian\SourceTree\git_local\cmd\git.exe"
-Git.refresh(git_executable_path)
+if os.path.exists(git_executable_path):
+    Git.refresh(git_executable_path)
 
-def clone_repo(repo_url, clone_path):
+def clone_repo(repo_url, clone_path, depth=None, blob_filter=None, sparse=False, timeout=None, no_checkout=False):
     """
     Clone a repository from a given URL to a specified path.
     
     :param repo_url: URL of the repository to clone.
     :param clone_path: Path where the repository will be cloned.
+    :param depth: Number of commits to fetch (e.g. 1 for a shallow clone), or None for the full history.
+    :param blob_filter: Partial clone filter passed to git (e.g. 'blob:none'), or None.
+    :param sparse: Whether to check out only the files read by the scanner.
+    :param timeout: Seconds after which each git command is killed, or None to wait forever.
+    :param no_checkout: Whether to skip the working tree entirely, for scans with scanner.py --git_refs.
     """
     logging.info(f"Cloning repository: {repo_url} into {clone_path}")
-    Repo.clone_from(repo_url, clone_path)
+    options = build_clone_options(depth, blob_filter, sparse, no_checkout)
+    Git().clone(*options, '--', repo_url, clone_path, kill_after_timeout=timeout)
+    if sparse and not no_checkout:
+        Repo(clone_path).git.sparse_checkout('set', '--no-cone', *SPARSE_CHECKOUT_PATTERNS, kill_after_timeout=timeout)
 
-def get_repositories_to_clone(db_config):
+def update_repo(clone_path, depth=None, timeout=None, no_checkout=False):
     """
-    Get the list of repositories to clone from the database.
+    Fetch the latest commit of the checked out branch and hard reset the clone to it.
     
-    :param db_config: Database configuration dictionary.
-    :return: List of repository URLs to clone.
+    :param clone_path: Path of the existing clone.
+    :param depth: Number of commits to fetch (e.g. 1 to keep the clone shallow), or None for the full history.
+    :param timeout: Seconds after which each git command is killed, or None to wait forever.
+    :param no_checkout: Whether to only move the branch (soft reset), leaving the working tree empty.
     """
-    conn = psycopg2.connect(**db_config)
-    cursor = conn.cursor()
-    query = f"""
-    SELECT r.link
-    FROM my_schema.organizations o
-    JOIN my_schema.repositories r ON o.id = r.organization_id
-    WHERE o.scan = TRUE AND r.scan = TRUE;
+    logging.info(f"Updating repository at {clone_path}")
+    repo = Repo(clone_path)
+    options = [f'--depth={depth}'] if depth else []
+    refspec = 'HEAD' if repo.head.is_detached else repo.active_branch.name
+    repo.git.fetch(*options, 'origin', refspec, kill_after_timeout=timeout)
+    repo.git.reset('--soft' if no_checkout else '--hard', 'FETCH_HEAD', kill_after_timeout=timeout)
+
+def get_head(clone_path):
+    """
+    Get the commit the HEAD of a clone points to.
+    
+    :param clone_path: Path of the clone.
+    :return: Commit SHA as a string, or None if it cannot be read.
+    """
+    try:
+        return Repo(clone_path).head.commit.hexsha
+    except Exception:
+        return None
+
+def run_with_retry(operation, repo_url, clone_path, retries=2, retry_delay=5, cleanup=False):
+    """
+    Run a git operation on a repository, retrying on failure.
+    
+    :param operation: Function without arguments performing the operation.
+    :param repo_url: URL of the repository, used for logging.
+    :param clone_path: Path of the clone.
+    :param retries: Number of retries after the first failed attempt.
+    :param retry_delay: Base delay in seconds between attempts, multiplied by the attempt number.
+    :param cleanup: Whether to remove the clone path between attempts (for partial clones).
+    :return: True if the operation succeeded, False otherwise.
+    """
+    for attempt in range(1, retries + 2):
+        try:
+            operation()
+            return True
+        except Exception as e:
+            logging.error(f"Error processing {repo_url} (attempt {attempt}/{retries + 1}): {e}")
+            if cleanup and os.path.exists(clone_path):
+                shutil.rmtree(clone_path, ignore_errors=True)
+            if attempt <= retries:
+                time.sleep(retry_delay * attempt)
+    return False
+
+def sync_repo(repo_url, clone_path, update=False, retries=2, **clone_options):
+    """
+    Clone a repository, or update it if it already exists and updates are enabled.
+    
+    :param repo_url: URL of the repository.
+    :param clone_path: Path where the repository is cloned.
+    :param update: Whether to fetch and hard reset existing clones instead of skipping them.
+    :param retries: Number of retries after the first failed attempt.
+    :param clone_options: Extra options passed to clone_repo.
+    :return: Dictionary with the url, status, old_head and new_head of the repository.
+    """
+    result = {'url': repo_url, 'old_head': None, 'new_head': None}
+    if not os.path.exists(clone_path):
+        with METRICS.timer('git.clone', 'slowest_git_operations', repo_url):
+            ok = run_with_retry(lambda: clone_repo(repo_url, clone_path, **clone_options),
+                                repo_url, clone_path, retries, cleanup=True)
+        result['status'] = 'cloned' if ok else 'failed'
+    elif update:
+        result['old_head'] = get_head(clone_path)
+        with METRICS.timer('git.update', 'slowest_git_operations', repo_url):
+            ok = run_with_retry(lambda: update_repo(clone_path, clone_options.get('depth'), clone_options.get('timeout'),
+                                                    clone_options.get('no_checkout', False)),
+                                repo_url, clone_path, retries)
+        result['status'] = 'updated' if ok else 'failed'
+    else:
+        logging.info(f"Repository already exists at {clone_path}")
+        result['old_head'] = get_head(clone_path)
+        result['status'] = 'skipped'
+    result['new_head'] = get_head(clone_path)
+    if result['status'] == 'updated' and result['old_head'] == result['new_head']:
+        result['status'] = 'unchanged'
+    METRICS.count(f"repositories.{result['status']}")
+    return result
+
+def clone_repositories(repo_urls, clone_path, workers=4, retries=2, update=False, **clone_options):
+    """
+    Clone repositories concurrently, updating or skipping those that already exist.
+    
+    :param repo_urls: List of repository URLs to clone.
+    :param clone_path: Path where the repositories will be cloned.
+    :param workers: Maximum number of git operations running at the same time.
+    :param retries: Number of retries for each repository.
+    :param update: Whether to fetch and hard reset existing clones instead of skipping them.
+    :param clone_options: Extra options passed to clone_repo.
+    :return: Dictionary mapping repository names to their status and old and new HEAD commits.
     """
-    cursor.execute(query)
-    repo_urls = [row[0] for row in cursor.fetchall()]
-    cursor.close()
-    conn.close()
-    return repo_urls
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        # Two clones of the same path would overwrite, or on failure delete, each other
+        for repo_url in unique_repo_urls(repo_urls):
+            name = repo_name(repo_url)
+            repo_clone_path = os.path.join(clone_path, name)
+            futures[name] = executor.submit(sync_repo, repo_url, repo_clone_path, update, retries, **clone_options)
+        results = {repo_name: future.result() for repo_name, future in futures.items()}
+    log_clone_summary(results)
+    return results
 
 def main():
     """
@@ -46,34 +150,31 @@ def main():
     logging.basicConfig(level=logging.INFO)
     
     parser = argparse.ArgumentParser(description='Clone repositories from the database.')
-    parser.add_argument('--db_host', type=str, required=True, help='Database host.')
-    parser.add_argument('--db_port', type=str, required=True, help='Database port.')
-    parser.add_argument('--db_name', type=str, required=True, help='Database name.')
-    parser.add_argument('--db_user', type=str, required=True, help='Database user.')
-    parser.add_argument('--db_password', type=str, required=True, help='Database password.')
+    add_db_arguments(parser)
     parser.add_argument('--clone_path', type=str, required=True, help='Path where repositories will be cloned.')
+    parser.add_argument('--workers', type=int, default=4, help='Maximum number of concurrent clones.')
+    parser.add_argument('--depth', type=int, help='Create shallow clones with the given number of commits (e.g. 1).')
+    parser.add_argument('--filter', type=str, help="Partial clone filter, e.g. 'blob:none' for blobless clones.")
+    parser.add_argument('--sparse', action='store_true', help='Only check out the files read by the scanner.')
+    parser.add_argument('--no_checkout', action='store_true', help='Clone without a working tree; scan the clones with scanner.py --git_refs.')
+    parser.add_argument('--retries', type=int, default=2, help='Number of retries for each repository.')
+    parser.add_argument('--timeout', type=int, help='Seconds after which a git command is killed.')
+    parser.add_argument('--update', action='store_true', help='Fetch and hard reset existing clones instead of skipping them.')
+    parser.add_argument('--heads_output_path', type=str, help='Path to a JSON file where the old and new HEAD of every repository is written.')
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
-    db_config = {
-        'host': args.db_host,
-        'port': args.db_port,
-        'dbname': args.db_name,
-        'user': args.db_user,
-        'password': args.db_password
-    }
-
-    repo_urls = get_repositories_to_clone(db_config)
+    repo_urls = get_repositories_to_clone(load_db_config(args))
     if not repo_urls:
         logging.error("No repositories found to clone.")
         return
     
-    for repo_url in repo_urls:
-        repo_name = repo_url.split('/')[-1].replace('.git', '')
-        repo_clone_path = os.path.join(args.clone_path, repo_name)
-        if not os.path.exists(repo_clone_path):
-            clone_repo(repo_url, repo_clone_path)
-        else:
-            logging.info(f"Repository {repo_name} already exists at {repo_clone_path}")
+    with profile_run(args.profile, args.metrics_path):
+        results = clone_repositories(repo_urls, args.clone_path, args.workers, args.retries, args.update, depth=args.depth,
+                                     blob_filter=args.filter, sparse=args.sparse, timeout=args.timeout,
+                                     no_checkout=args.no_checkout)
+        if args.heads_output_path:
+            write_heads_report(results, args.heads_output_path)
 
 if __name__ == "__main__":
     main()
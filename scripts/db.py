@@ -0,0 +1,142 @@
+import os
+import logging
+import weakref
+import threading
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+from yaml_backend import load_config
+
+# Connection settings: name in the 'database' section of the configuration file and
+# command line (--db_<name>), psycopg2 keyword and libpq environment variable
+DB_SETTINGS = (
+    ('host', 'host', 'PGHOST'),
+    ('port', 'port', 'PGPORT'),
+    ('name', 'dbname', 'PGDATABASE'),
+    ('user', 'user', 'PGUSER'),
+    ('password', 'password', 'PGPASSWORD')
+)
+
+DEFAULT_POOL_SIZE = 8
+
+# Connection pools keyed by their settings, shared by every caller of the process
+_pools = {}
+_pools_lock = threading.Lock()
+# Names of the statements prepared on the session of each open connection
+_prepared = weakref.WeakKeyDictionary()
+
+def add_db_arguments(parser, required=False):
+    """
+    Add the database connection arguments shared by every script to an argument parser.
+    
+    :param parser: argparse.ArgumentParser to extend.
+    :param required: Whether the connection arguments are mandatory. When they are not,
+                     missing settings are read from the environment and the configuration file.
+    """
+    parser.add_argument('--db_host', type=str, required=required, help='Database host.')
+    parser.add_argument('--db_port', type=int, required=required, help='Database port.')
+    parser.add_argument('--db_name', type=str, required=required, help='Database name.')
+    parser.add_argument('--db_user', type=str, required=required, help='Database user.')
+    parser.add_argument('--db_password', type=str, required=required, help='Database password.')
+    parser.add_argument('--db_config_path', type=str,
+                        help="Path to a configuration file with a 'database' section (host, port, name, user, password).")
+
+def load_db_config(args=None, config_path=None):
+    """
+    Resolve the database connection settings. Command line arguments take precedence over
+    the libpq environment variables (PGHOST, PGPORT, PGDATABASE, PGUSER, PGPASSWORD),
+    which take precedence over the 'database' section of the configuration file.
+    
+    :param args: Parsed arguments with the --db_* options (see add_db_arguments), or None.
+    :param config_path: Path to the configuration file, or None to use args.db_config_path.
+    :return: Dictionary of psycopg2 connection keywords.
+    """
+    config_path = config_path or getattr(args, 'db_config_path', None)
+    section = {}
+    if config_path:
+        section = (load_config(config_path) or {}).get('database') or {}
+
+    db_config = {}
+    for name, keyword, variable in DB_SETTINGS:
+        value = getattr(args, f'db_{name}', None)
+        if value is None:
+            value = os.environ.get(variable)
+        if value is None:
+            value = section.get(name)
+        if value is not None:
+            db_config[keyword] = value
+    return db_config
+
+def get_pool(db_config, pool_size=DEFAULT_POOL_SIZE):
+    """
+    Get the connection pool of a database, creating it on first use.
+    
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :param pool_size: Maximum number of connections of a new pool.
+    :return: psycopg2 ThreadedConnectionPool.
+    """
+    key = tuple(sorted((keyword, str(value)) for keyword, value in db_config.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            logging.info(f"Opening connection pool to {db_config.get('host')}/{db_config.get('dbname')}")
+            pool = ThreadedConnectionPool(1, pool_size, **db_config)
+            _pools[key] = pool
+        return pool
+
+@contextmanager
+def connection(db_config):
+    """
+    Borrow a connection from the pool for one transaction, committed on success and
+    rolled back on error. Broken connections are discarded instead of returned to the pool.
+    
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :return: Context manager yielding the connection.
+    """
+    pool = get_pool(db_config)
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+@contextmanager
+def cursor(db_config):
+    """
+    Open a cursor on a pooled connection (see connection).
+    
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :return: Context manager yielding the cursor.
+    """
+    with connection(db_config) as conn:
+        with conn.cursor() as cur:
+            yield cur
+
+def execute_prepared(cur, name, parameter_types, statement, params):
+    """
+    Execute a server-side prepared statement, preparing it the first time it is used on the connection.
+    
+    :param cur: Database cursor.
+    :param name: Name of the prepared statement.
+    :param parameter_types: SQL types of the parameters, e.g. ('text[]',).
+    :param statement: Statement using $1, $2... placeholders.
+    :param params: Parameter values.
+    """
+    prepared = _prepared.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} ({', '.join(parameter_types)}) AS {statement}")
+        prepared.add(name)
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+def close_pools():
+    """
+    Close every connection of every pool.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
@@ -0,0 +1,365 @@
+import os
+import re
+import sqlite3
+import logging
+import argparse
+from db import add_db_arguments, load_db_config, cursor
+from scan_results import read_scan_results
+from versions import pinned_version, specifier_set, specifiers_overlap, version_matches
+from requirements_parser import normalize_name, parse_requirement
+
+def yaml_key_paths(content, prefix=''):
+    """
+    List the dotted key paths of a YAML document. Lists are transparent, so the keys of
+    the items of a list appear under the path of the list itself.
+    
+    :param content: Parsed YAML content.
+    :param prefix: Path of the content within the document.
+    :return: Set of key paths, e.g. {'spark', 'spark.version'}.
+    """
+    paths = set()
+    if isinstance(content, dict):
+        for key, value in content.items():
+            path = f"{prefix}.{key}" if prefix else str(key)
+            paths.add(path)
+            paths |= yaml_key_paths(value, path)
+    elif isinstance(content, list):
+        for item in content:
+            paths |= yaml_key_paths(item, prefix)
+    return paths
+
+def split_artifact(artifact):
+    """
+    Split an artifact query into its groupId and artifactId patterns.
+    
+    :param artifact: 'groupId:artifactId' or 'artifactId'; both parts accept glob wildcards.
+    :return: Tuple of (groupId pattern or None, artifactId pattern).
+    """
+    if ':' in artifact:
+        group_id, artifact_id = artifact.split(':', 1)
+        return group_id or None, artifact_id
+    return None, artifact
+
+class DependencyIndex:
+    """
+    Inverted index of scan results stored in a local SQLite database.
+    
+    Dependencies are indexed by artifactId and groupId, requirements by package name and
+    YAML files by every key path they contain, so queries never read the scan results.
+    """
+
+    def __init__(self, index_path):
+        """
+        Open (and create if needed) the index database.
+        
+        :param index_path: Path to the SQLite index file.
+        """
+        logging.info(f"Opening dependency index: {index_path}")
+        self.conn = sqlite3.connect(index_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS repositories (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS dependencies (
+                artifact_id TEXT,
+                group_id TEXT,
+                version TEXT,
+                repository_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS requirements (
+                name TEXT,
+                specifier TEXT,
+                version TEXT,
+                requirement TEXT,
+                repository_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS yaml_keys (
+                key TEXT,
+                file TEXT,
+                repository_id INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS dependencies_artifact_idx ON dependencies (artifact_id, group_id);
+            CREATE INDEX IF NOT EXISTS requirements_name_idx ON requirements (name);
+            CREATE INDEX IF NOT EXISTS yaml_keys_key_idx ON yaml_keys (key);
+        """)
+
+    def add(self, repo, repo_data):
+        """
+        Index the scan results of a repository.
+        
+        :param repo: Name of the repository.
+        :param repo_data: ScanResult of the repository.
+        """
+        repo_id = self.conn.execute("INSERT INTO repositories (name) VALUES (?)", (repo,)).lastrowid
+        self.conn.executemany(
+            "INSERT INTO dependencies (artifact_id, group_id, version, repository_id) VALUES (?, ?, ?, ?)",
+            ((dep.artifact_id, dep.group_id, dep.version, repo_id) for dep in repo_data.dependencies)
+        )
+        requirements = []
+        for requirement in repo_data.requirements or ():
+            parsed = parse_requirement(requirement)
+            if parsed is not None:
+                requirements.append((parsed[0], parsed[1], pinned_version(parsed[1]), requirement, repo_id))
+        self.conn.executemany(
+            "INSERT INTO requirements (name, specifier, version, requirement, repository_id) VALUES (?, ?, ?, ?, ?)",
+            requirements
+        )
+        self.conn.executemany(
+            "INSERT INTO yaml_keys (key, file, repository_id) VALUES (?, ?, ?)",
+            ((key, yaml_file, repo_id)
+             for yaml_file, yaml_content in repo_data.yaml_configs.items()
+             for key in sorted(yaml_key_paths(yaml_content)))
+        )
+
+    def find_artifacts(self, artifact, version_spec=None):
+        """
+        Find the repositories using an artifact, optionally within a version range.
+        
+        :param artifact: 'groupId:artifactId' or 'artifactId', with optional glob wildcards.
+        :param version_spec: Version range, e.g. '<3.0' or '>=2.4,<3.0' (see versions.version_matches).
+        :return: List of (repo, groupId, artifactId, version) tuples.
+        """
+        group_id, artifact_id = split_artifact(artifact)
+        rows = self.conn.execute("""
+            SELECT r.name, d.group_id, d.artifact_id, d.version
+            FROM dependencies d JOIN repositories r ON r.id = d.repository_id
+            WHERE d.artifact_id GLOB ? AND (? IS NULL OR d.group_id GLOB ?)
+            ORDER BY r.name, d.group_id, d.artifact_id, d.version
+        """, (artifact_id, group_id, group_id))
+        return [row for row in rows if version_matches(row[3], version_spec)]
+
+    def find_requirements(self, name, version_spec=None):
+        """
+        Find the repositories requiring a Python package, optionally admitting a version of a range.
+        
+        :param name: Package name.
+        :param version_spec: Version range that the specifier of the requirement must overlap, or None
+                             (see versions.specifiers_overlap). Requirements without a specifier admit any version.
+        :return: List of (repo, requirement) tuples.
+        """
+        rows = self.conn.execute("""
+            SELECT r.name, q.requirement, q.specifier
+            FROM requirements q JOIN repositories r ON r.id = q.repository_id
+            WHERE q.name = ?
+            ORDER BY r.name, q.requirement
+        """, (normalize_name(name),))
+        return [(repo, requirement) for repo, requirement, specifier in rows
+                if version_spec is None or specifiers_overlap(specifier, version_spec)]
+
+    def find_yaml_keys(self, key):
+        """
+        Find the YAML files containing a key path.
+        
+        :param key: Dotted key path, e.g. 'spark.version', with optional glob wildcards.
+        :return: List of (repo, file) tuples.
+        """
+        return self.conn.execute("""
+            SELECT DISTINCT r.name, y.file
+            FROM yaml_keys y JOIN repositories r ON r.id = y.repository_id
+            WHERE y.key GLOB ?
+            ORDER BY r.name, y.file
+        """, (key,)).fetchall()
+
+    def close(self):
+        """
+        Commit pending changes and close the index database.
+        """
+        self.conn.commit()
+        self.conn.close()
+
+def build_index(scan_results_path, index_path):
+    """
+    Build the dependency index of a scan results file, replacing any previous index atomically.
+    
+    :param scan_results_path: Path to the scan results JSON or JSON Lines file.
+    :param index_path: Path to the SQLite index file.
+    """
+    index_dir = os.path.dirname(index_path)
+    if index_dir and not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    tmp_path = f"{index_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    index = DependencyIndex(tmp_path)
+    count = 0
+    try:
+        for repo, repo_data in read_scan_results(scan_results_path):
+            index.add(repo, repo_data)
+            count += 1
+    finally:
+        index.close()
+    os.replace(tmp_path, index_path)
+    logging.info(f"Indexed {count} repositories into {index_path}")
+
+def glob_to_like(pattern):
+    """
+    Translate a glob pattern with '*' and '?' wildcards into a LIKE pattern.
+    
+    :param pattern: Glob pattern.
+    :return: LIKE pattern.
+    """
+    escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped.replace('*', '%').replace('?', '_')
+
+def key_to_jsonpath(key):
+    """
+    Translate a dotted YAML key path into a lax SQL/JSON path, which also looks inside lists.
+    
+    :param key: Dotted key path. Whole segments may be '*'; other wildcards are not supported.
+    :return: JSON path, e.g. '$."spark"."version"'.
+    """
+    segments = []
+    for segment in key.split('.'):
+        if segment == '*':
+            segments.append('*')
+        elif any(char in segment for char in '*?['):
+            raise ValueError(f"Only whole '*' segments are supported in database YAML key queries: {key}")
+        else:
+            segments.append('"' + segment.replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '$.' + '.'.join(segments)
+
+def find_artifacts_db(cursor, artifact, version_spec=None):
+    """
+    Find the repositories using an artifact in the database (see DependencyIndex.find_artifacts).
+    
+    Uses the dependencies_coordinates_idx index of sql/create_tables.sql.
+    
+    :param cursor: Database cursor.
+    :param artifact: 'groupId:artifactId' or 'artifactId', with optional glob wildcards.
+    :param version_spec: Version range, or None.
+    :return: List of (repo, groupId, artifactId, version) tuples.
+    """
+    group_id, artifact_id = split_artifact(artifact)
+    conditions = []
+    params = []
+    for column, pattern in (('d.group_id', group_id), ('d.artifact_id', artifact_id)):
+        if pattern is None:
+            continue
+        if any(char in pattern for char in '*?'):
+            conditions.append(f"{column} LIKE %s")
+            params.append(glob_to_like(pattern))
+        else:
+            conditions.append(f"{column} = %s")
+            params.append(pattern)
+    cursor.execute(f"""
+        SELECT r.name, d.group_id, d.artifact_id, d.version
+        FROM my_schema.dependencies d JOIN my_schema.repositories r ON r.id = d.repository_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY r.name, d.group_id, d.artifact_id, d.version
+    """, params)
+    return [row for row in cursor.fetchall() if version_matches(row[3], version_spec)]
+
+def requirement_regex(name):
+    """
+    Build a POSIX regular expression matching the requirements of a package under any spelling of its name.
+    
+    :param name: Package name.
+    :return: Regular expression, matched case-insensitively.
+    """
+    parts = [re.escape(part) for part in normalize_name(name).split('-')]
+    return r'^\s*' + '[-_.]+'.join(parts) + r'\s*([][<>=!~;#]|$)'
+
+def find_requirements_db(cursor, name, version_spec=None):
+    """
+    Find the repositories requiring a Python package in the database (see DependencyIndex.find_requirements).
+    
+    Uses the requirements_name_idx index of sql/create_tables.sql. Rows exported before the
+    name column existed are matched on the requirement text instead.
+    
+    :param cursor: Database cursor.
+    :param name: Package name.
+    :param version_spec: Version range that the specifier of the requirement must overlap, or None.
+    :return: List of (repo, requirement) tuples.
+    """
+    name = normalize_name(name)
+    cursor.execute("""
+        SELECT r.name, q.requirement, q.specifier
+        FROM my_schema.requirements q JOIN my_schema.repositories r ON r.id = q.repository_id
+        WHERE q.name = %s OR (q.name IS NULL AND q.requirement ~* %s)
+        ORDER BY r.name, q.requirement
+    """, (name, requirement_regex(name)))
+    results = []
+    for repo, requirement, specifier in cursor.fetchall():
+        if specifier is None:
+            parsed = parse_requirement(requirement)
+            if parsed is None or parsed[0] != name:
+                continue
+            specifier = parsed[1]
+        if version_spec is None or specifiers_overlap(specifier, version_spec):
+            results.append((repo, requirement))
+    return results
+
+def find_yaml_keys_db(cursor, key):
+    """
+    Find the YAML files containing a key path in the database (see DependencyIndex.find_yaml_keys).
+    
+    Uses the GIN index on yaml_files.yaml_content of sql/create_tables.sql.
+    
+    :param cursor: Database cursor.
+    :param key: Dotted key path; whole segments may be '*'.
+    :return: List of (repo, file) tuples.
+    """
+    cursor.execute("""
+        SELECT r.name, y.yaml_file_name
+        FROM my_schema.yaml_files y JOIN my_schema.repositories r ON r.id = y.repository_id
+        WHERE y.yaml_content @? %s::jsonpath
+        ORDER BY r.name, y.yaml_file_name
+    """, (key_to_jsonpath(key),))
+    return cursor.fetchall()
+
+def main():
+    """
+    Main function to build the dependency index or answer artifact, requirement and YAML key queries
+    from the index or the database.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Query dependencies, requirements and YAML keys across repositories.')
+    parser.add_argument('--index_path', type=str, help='Path to the SQLite dependency index. Queried unless --use_db or --db_host is given.')
+    parser.add_argument('--build', type=str, metavar='SCAN_RESULTS_PATH', help='Build the index from a scan results JSON or JSON Lines file.')
+    parser.add_argument('--artifact', type=str, help="Artifact to look for, 'groupId:artifactId' or 'artifactId', with optional * and ? wildcards.")
+    parser.add_argument('--requirement', type=str, help='Python package to look for in the requirements.')
+    parser.add_argument('--yaml_key', type=str, help="Dotted YAML key path to look for, e.g. 'spark.version'.")
+    parser.add_argument('--version', type=str, help="Version range of the artifact, or that the range of the requirement must overlap, e.g. '<3.0' or '>=2.4,<3.0'.")
+    parser.add_argument('--use_db', action='store_true', help='Query the database instead of the index.')
+    add_db_arguments(parser)
+    args = parser.parse_args()
+    if args.version and specifier_set(args.version) is None:
+        parser.error(f"--version {args.version} is not a valid version range")
+
+    if args.build:
+        if not args.index_path:
+            parser.error('--build requires --index_path')
+        build_index(args.build, args.index_path)
+    if not (args.artifact or args.requirement or args.yaml_key):
+        return
+
+    rows = []
+    if args.use_db or args.db_host:
+        with cursor(load_db_config(args)) as cur:
+            if args.artifact:
+                rows += find_artifacts_db(cur, args.artifact, args.version)
+            if args.requirement:
+                rows += find_requirements_db(cur, args.requirement, args.version)
+            if args.yaml_key:
+                rows += find_yaml_keys_db(cur, args.yaml_key)
+    elif args.index_path:
+        index = DependencyIndex(args.index_path)
+        try:
+            if args.artifact:
+                rows += index.find_artifacts(args.artifact, args.version)
+            if args.requirement:
+                rows += index.find_requirements(args.requirement, args.version)
+            if args.yaml_key:
+                rows += index.find_yaml_keys(args.yaml_key)
+        finally:
+            index.close()
+    else:
+        parser.error('queries require --index_path, --use_db or --db_host')
+
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+if __name__ == "__main__":
+    main()
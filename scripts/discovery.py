@@ -0,0 +1,185 @@
+import os
+import logging
+from yaml_backend import load_config
+from fnmatch import fnmatch
+
+# Default scanner settings, overridden by the 'scanner' section of config.yaml
+DEFAULT_SCAN_CONFIG = {
+    'ignored_dirs': ['.git', '.hg', '.svn', 'node_modules', 'target', 'build', 'dist', 'venv', '.venv',
+                     'env', '__pycache__', '.tox', '.idea', '.gradle', '.mvn'],
+    'use_gitignore': True,
+    'max_file_size': 10 * 1024 * 1024,
+    # Patterns containing '/' are matched against the repo-relative path, the rest against the file name
+    'manifest_patterns': {
+        'yaml': ['*.yaml', '*.yml'],
+        'pom': ['pom.xml'],
+        'requirements': ['/requirements.txt'],
+        'setup_cfg': ['/setup.cfg'],
+        'pyproject': ['/pyproject.toml']
+    },
+    # Keyword arguments passed to the parser of each kind of file
+    'parser_options': {
+        'yaml': {'max_size': 5 * 1024 * 1024, 'oversize': 'truncate'},
+        'pom': {'local_repository': None}
+    }
+}
+
+def merge_config(defaults, overrides):
+    """
+    Merge settings into a copy of the defaults. Nested dictionaries are merged key by key,
+    so overriding one kind of file keeps the defaults of the others; other values are replaced.
+    
+    :param defaults: Dictionary of default settings.
+    :param overrides: Dictionary of settings that take precedence.
+    :return: New dictionary with the merged settings.
+    """
+    merged = dict(defaults)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def load_scan_config(config_path=None):
+    """
+    Load the scanner settings from the 'scanner' section of a configuration file.
+    
+    :param config_path: Path to the YAML configuration file, or None to use the defaults.
+    :return: Dictionary with the scanner settings.
+    """
+    config = (load_config(config_path) or {}) if config_path else {}
+    return merge_config(DEFAULT_SCAN_CONFIG, config.get('scanner') or {})
+
+def matches(pattern, relpath, name):
+    """
+    Check whether a file or directory matches a glob pattern.
+    
+    :param pattern: Glob pattern. Patterns containing '/' are anchored to the base directory.
+    :param relpath: Path relative to the base directory, using '/' as separator.
+    :param name: Base name of the file or directory.
+    :return: True if the pattern matches.
+    """
+    if '/' in pattern:
+        return fnmatch(relpath, pattern.strip('/'))
+    return fnmatch(name, pattern)
+
+def parse_gitignore(lines, rel_dir):
+    """
+    Parse the directory rules of the lines of a .gitignore file.
+    
+    Only the subset of the syntax needed to prune directories is supported;
+    negated patterns are ignored.
+    
+    :param lines: Lines of the .gitignore file.
+    :param rel_dir: Repo-relative directory containing the .gitignore file.
+    :return: List of (base directory, pattern) tuples.
+    """
+    rules = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or line.startswith('!'):
+            continue
+        pattern = line.rstrip('/')
+        if line.startswith('/') or '/' in pattern:
+            pattern = '/' + pattern.lstrip('/')
+        rules.append((rel_dir, pattern))
+    return rules
+
+def read_gitignore(gitignore_path, rel_dir):
+    """
+    Read the directory rules of a .gitignore file (see parse_gitignore).
+    
+    :param gitignore_path: Path to the .gitignore file.
+    :param rel_dir: Repo-relative directory containing the .gitignore file.
+    :return: List of (base directory, pattern) tuples.
+    """
+    try:
+        with open(gitignore_path, 'r', errors='replace') as file:
+            return parse_gitignore(file, rel_dir)
+    except OSError as e:
+        logging.warning(f"Error reading {gitignore_path}: {e}")
+        return []
+
+def is_gitignored(rel_path, name, rules):
+    """
+    Check whether a directory is excluded by the .gitignore rules that apply to it.
+    
+    :param rel_path: Repo-relative path of the directory.
+    :param name: Name of the directory.
+    :param rules: List of (base directory, pattern) tuples.
+    :return: True if the directory is ignored.
+    """
+    for base, pattern in rules:
+        sub_path = rel_path[len(base) + 1:] if base else rel_path
+        if matches(pattern, sub_path, name):
+            return True
+    return False
+
+def manifest_patterns(scan_config):
+    """
+    Flatten the manifest patterns of the scanner settings.
+    
+    :param scan_config: Scanner settings.
+    :return: List of (kind, pattern) tuples.
+    """
+    return [(kind, pattern) for kind, kind_patterns in scan_config['manifest_patterns'].items()
+            for pattern in kind_patterns]
+
+def match_kind(patterns, rel_path, name):
+    """
+    Find the kind of manifest a file is, if any.
+    
+    :param patterns: List of (kind, pattern) tuples.
+    :param rel_path: Repo-relative path of the file.
+    :param name: Name of the file.
+    :return: Kind of the first matching pattern, or None.
+    """
+    return next((kind for kind, pattern in patterns if matches(pattern, rel_path, name)), None)
+
+def discover_files(repo_path, scan_config=None):
+    """
+    Walk a repository with os.scandir and yield the manifest files it contains.
+    
+    Ignored directories (from the configuration and .gitignore files) are pruned
+    without being visited, and files above the size limit are skipped.
+    
+    :param repo_path: Path to the repository.
+    :param scan_config: Scanner settings (see DEFAULT_SCAN_CONFIG).
+    :return: Generator of (kind, relpath, path, stat) tuples in a stable order, where kind is the
+             manifest type and relpath the repo-relative path using '/' as separator.
+    """
+    scan_config = scan_config or DEFAULT_SCAN_CONFIG
+    ignored_dirs = set(scan_config['ignored_dirs'])
+    max_file_size = scan_config.get('max_file_size')
+    patterns = manifest_patterns(scan_config)
+
+    stack = [('', repo_path, [])]
+    while stack:
+        rel_dir, dir_path, rules = stack.pop()
+        try:
+            with os.scandir(dir_path) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError as e:
+            logging.warning(f"Error reading directory {dir_path}: {e}")
+            continue
+
+        if scan_config.get('use_gitignore') and any(entry.name == '.gitignore' for entry in entries):
+            rules = rules + read_gitignore(os.path.join(dir_path, '.gitignore'), rel_dir)
+
+        subdirs = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in ignored_dirs and not is_gitignored(rel_path, entry.name, rules):
+                    subdirs.append((rel_path, entry.path, rules))
+                continue
+            kind = match_kind(patterns, rel_path, entry.name)
+            if kind is None or not entry.is_file():
+                continue
+            stat = entry.stat()
+            if max_file_size and stat.st_size > max_file_size:
+                logging.warning(f"Skipping {entry.path}: {stat.st_size} bytes exceeds the {max_file_size} bytes limit")
+                continue
+            yield kind, rel_path, entry.path, stat
+        stack.extend(reversed(subdirs))
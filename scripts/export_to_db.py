@@ -1,92 +1,331 @@
 import json
-import psycopg2
+from psycopg2.extras import execute_values
 import argparse
 import logging
 from datetime import datetime
+from db import add_db_arguments, load_db_config, connection, execute_prepared
+from scan_results import read_scan_results
+from records import content_hash
+from requirements_parser import parse_requirement
+from metrics import METRICS, add_profile_arguments, profile_run
 
-def export_to_db(json_path, db_config):
+# Hot statements, prepared once per pooled connection
+FETCH_REPOSITORIES = """
+    SELECT DISTINCT ON (name) name, id, content_hash FROM my_schema.repositories
+    WHERE name = ANY($1)
+    ORDER BY name, id
+"""
+FETCH_REPOSITORIES_BY_ID = """
+    SELECT id, content_hash FROM my_schema.repositories
+    WHERE id = ANY($1)
+"""
+INSERT_DEPENDENCIES = """
+    INSERT INTO my_schema.dependencies (repository_id, group_id, artifact_id, version)
+    SELECT * FROM unnest($1::int[], $2::text[], $3::text[], $4::text[])
+"""
+
+def fetch_repositories(cursor, repos):
     """
-    Export JSON data to the PostgreSQL database.
+    Resolve the IDs and stored content hashes of several repositories with a single query.
     
-    :param json_path: Path to the JSON file.
-    :param db_config: Dictionary containing database configuration.
+    :param cursor: Database cursor.
+    :param repos: List of repository names.
+    :return: Dictionary mapping repository names to (id, content_hash) tuples.
     """
-    try:
-        logging.info(f"Reading JSON file: {json_path}")
-        with open(json_path, 'r') as file:
-            data = json.load(file)
-    except Exception as e:
-        logging.error(f"Error reading JSON file: {e}")
-        return
+    with METRICS.timer('db.fetch_repositories'):
+        execute_prepared(cursor, 'fetch_repositories', ('text[]',), FETCH_REPOSITORIES, (list(repos),))
+        return {name: (repo_id, stored_hash) for name, repo_id, stored_hash in cursor.fetchall()}
+
+def resolve_batch(cursor, batch, by_id=False):
+    """
+    Resolve the repository IDs and stored content hashes of a batch, dropping the repositories
+    that are not in my_schema.repositories.
     
-    try:
-        logging.info("Connecting to the database")
-        conn = psycopg2.connect(**db_config)
-        cursor = conn.cursor()
-    except Exception as e:
-        logging.error(f"Error connecting to the database: {e}")
-        return
+    Repositories are looked up by name unless their IDs are given. Names are not unique across
+    organizations, so callers that know the ID of each repository (e.g. pipeline.py with a work
+    queue) pass it to write the results to that repository.
+    
+    :param cursor: Database cursor.
+    :param batch: List of (repo, ScanResult) tuples, or of (repository ID, repo, ScanResult) tuples if by_id.
+    :param by_id: Whether the items of the batch carry the ID of their repository.
+    :return: List of (repository ID, repo, ScanResult, stored content hash) tuples.
+    """
+    if by_id:
+        with METRICS.timer('db.fetch_repositories'):
+            execute_prepared(cursor, 'fetch_repositories_by_id', ('int[]',), FETCH_REPOSITORIES_BY_ID,
+                             ([repo_id for repo_id, _, _ in batch],))
+            hashes = dict(cursor.fetchall())
+    else:
+        repos = fetch_repositories(cursor, [repo for repo, _ in batch])
+        hashes = dict(repos.values())
+        batch = [(repos.get(repo, (None,))[0], repo, repo_data) for repo, repo_data in batch]
+    resolved = []
+    for repo_id, repo, repo_data in batch:
+        if repo_id not in hashes:
+            logging.error(f"Repository {repo} not found in my_schema.repositories")
+            continue
+        resolved.append((repo_id, repo, repo_data, hashes[repo_id]))
+    return resolved
+
+def prepare_rows(repo_id, repo_data):
+    """
+    Build the yaml_files, dependencies and requirements rows of a repository.
+    
+    Duplicate dependencies and requirements are dropped, as the tables hold one row per value.
+    
+    :param repo_id: ID of the repository.
+    :param repo_data: ScanResult of the repository.
+    :return: Tuple of (yaml rows, dependency rows, requirement rows).
+    """
+    yaml_rows = [
+        (repo_id, yaml_file, json.dumps(yaml_content), content_hash(yaml_content))
+        for yaml_file, yaml_content in repo_data.yaml_configs.items()
+    ]
+    dependency_rows = list(dict.fromkeys(
+        (repo_id, dep.group_id, dep.artifact_id, dep.version)
+        for dep in repo_data.dependencies
+    ))
+    requirement_rows = list(dict.fromkeys((repo_id, req, *requirement_columns(req)) for req in repo_data.requirements or ()))
+    return yaml_rows, dependency_rows, requirement_rows
+
+def requirement_columns(requirement):
+    """
+    Get the normalized name and specifier stored with a requirement.
+    
+    :param requirement: Requirement, e.g. 'PySpark>=3.3'.
+    :return: Tuple of (name, specifier), e.g. ('pyspark', '>=3.3'), or (None, None) if it cannot be parsed.
+    """
+    parsed = parse_requirement(requirement)
+    return (parsed[0], parsed[1]) if parsed else (None, None)
+
+def insert_dependencies(cursor, rows, batch_size=1000, upsert=False):
+    """
+    Insert dependency rows with a prepared statement taking one array per column.
+    
+    :param cursor: Database cursor.
+    :param rows: List of (repository_id, group_id, artifact_id, version) tuples.
+    :param batch_size: Number of rows sent to the database in each statement.
+    :param upsert: Whether to skip rows that already exist instead of failing.
+    """
+    name = 'upsert_dependencies' if upsert else 'insert_dependencies'
+    statement = INSERT_DEPENDENCIES + (" ON CONFLICT DO NOTHING" if upsert else "")
+    METRICS.count('rows.dependencies', len(rows))
+    for start in range(0, len(rows), batch_size):
+        columns = [list(column) for column in zip(*rows[start:start + batch_size])]
+        with METRICS.timer('db.insert.dependencies'):
+            execute_prepared(cursor, name, ('int[]', 'text[]', 'text[]', 'text[]'), statement, columns)
+
+def insert_rows(cursor, table, statement, rows, batch_size=1000):
+    """
+    Insert the rows of a table with execute_values, timing the round trips.
+    
+    :param cursor: Database cursor.
+    :param table: Name of the table, used for the metrics.
+    :param statement: INSERT statement with a single VALUES %s placeholder.
+    :param rows: List of row tuples.
+    :param batch_size: Number of rows sent to the database in each statement.
+    """
+    METRICS.count(f'rows.{table}', len(rows))
+    with METRICS.timer(f'db.insert.{table}'):
+        execute_values(cursor, statement, rows, page_size=batch_size)
+
+def update_repositories(cursor, ids, hashes, execution_date):
+    """
+    Update the last_scan_date of the exported repositories and the content hash of those that changed.
     
+    :param cursor: Database cursor.
+    :param ids: IDs of the exported repositories.
+    :param hashes: List of (id, content_hash) tuples of the repositories whose content was written.
+    :param execution_date: Date stored as last_scan_date of the repositories.
+    """
+    METRICS.count('repositories.exported', len(ids))
+    with METRICS.timer('db.update_repositories'):
+        execute_values(cursor, """
+            UPDATE my_schema.repositories AS r
+            SET content_hash = v.content_hash
+            FROM (VALUES %s) AS v (id, content_hash)
+            WHERE r.id = v.id
+        """, hashes)
+        cursor.execute("""
+            UPDATE my_schema.repositories
+            SET last_scan_date = %s
+            WHERE id = ANY(%s)
+        """, (execution_date, ids))
+
+def export_batch(cursor, batch, execution_date, batch_size=1000, by_id=False):
+    """
+    Export the scan results of a batch of repositories, replacing all their rows.
+    
+    Repository IDs are resolved in one query, old rows are deleted with one statement
+    per table and new rows are inserted with execute_values in pages.
+    
+    :param cursor: Database cursor.
+    :param batch: List of (repo, ScanResult) tuples, or of (repository ID, repo, ScanResult) tuples if by_id.
+    :param execution_date: Date stored as last_scan_date of the repositories.
+    :param batch_size: Number of rows sent to the database in each INSERT statement.
+    :param by_id: Whether the items of the batch carry the ID of their repository (see resolve_batch).
+    """
+    ids = []
+    hashes = []
+    yaml_rows = []
+    dependency_rows = []
+    requirement_rows = []
+    for repo_id, repo, repo_data, _ in resolve_batch(cursor, batch, by_id):
+        logging.info(f"Preparing data for repository: {repo}")
+        ids.append(repo_id)
+        hashes.append((repo_id, repo_data.content_hash()))
+        yaml, dependencies, requirements = prepare_rows(repo_id, repo_data)
+        yaml_rows.extend(yaml)
+        dependency_rows.extend(dependencies)
+        requirement_rows.extend(requirements)
+
+    # Delete old entries from yaml_files, dependencies, and requirements tables
+    logging.info(f"Delete old entries from yaml_files, dependencies, and requirements for {len(ids)} repositories")
+    with METRICS.timer('db.delete'):
+        cursor.execute("DELETE FROM my_schema.yaml_files WHERE repository_id = ANY(%s)", (ids,))
+        cursor.execute("DELETE FROM my_schema.dependencies WHERE repository_id = ANY(%s)", (ids,))
+        cursor.execute("DELETE FROM my_schema.requirements WHERE repository_id = ANY(%s)", (ids,))
+
+    logging.info(f"Inserting {len(yaml_rows)} YAML files, {len(dependency_rows)} dependencies "
+                 f"and {len(requirement_rows)} requirements")
+    insert_rows(cursor, 'yaml_files', """
+        INSERT INTO my_schema.yaml_files (repository_id, yaml_file_name, yaml_content, content_hash)
+        VALUES %s
+    """, yaml_rows, batch_size)
+    insert_dependencies(cursor, dependency_rows, batch_size)
+    insert_rows(cursor, 'requirements', """
+        INSERT INTO my_schema.requirements (repository_id, requirement, name, specifier)
+        VALUES %s
+    """, requirement_rows, batch_size)
+
+    update_repositories(cursor, ids, hashes, execution_date)
+
+def export_batch_diff(cursor, batch, execution_date, batch_size=1000, by_id=False):
+    """
+    Export the scan results of a batch of repositories, writing only the rows that changed.
+    
+    Repositories whose content hash matches the stored one are skipped. For the rest, the
+    stored rows are compared with the incoming ones and only the delta is deleted or upserted.
+    
+    :param cursor: Database cursor.
+    :param batch: List of (repo, ScanResult) tuples, or of (repository ID, repo, ScanResult) tuples if by_id.
+    :param execution_date: Date stored as last_scan_date of the repositories.
+    :param batch_size: Number of rows sent to the database in each INSERT statement.
+    :param by_id: Whether the items of the batch carry the ID of their repository (see resolve_batch).
+    """
+    ids = []
+    changed = {}
+    for repo_id, repo, repo_data, stored_hash in resolve_batch(cursor, batch, by_id):
+        ids.append(repo_id)
+        new_hash = repo_data.content_hash()
+        if new_hash != stored_hash:
+            logging.info(f"Preparing data for repository: {repo}")
+            changed[repo_id] = (repo_data, new_hash)
+    logging.info(f"{len(changed)} of {len(ids)} repositories changed since the last export")
+
+    if changed:
+        changed_ids = list(changed)
+        with METRICS.timer('db.fetch_stored_rows'):
+            cursor.execute("""
+                SELECT id, repository_id, yaml_file_name, content_hash FROM my_schema.yaml_files
+                WHERE repository_id = ANY(%s)
+            """, (changed_ids,))
+            stored_yaml = {(repo_id, name): (row_id, stored_hash) for row_id, repo_id, name, stored_hash in cursor.fetchall()}
+            cursor.execute("""
+                SELECT id, repository_id, group_id, artifact_id, version FROM my_schema.dependencies
+                WHERE repository_id = ANY(%s)
+            """, (changed_ids,))
+            stored_dependencies = {tuple(row[1:]): row[0] for row in cursor.fetchall()}
+            cursor.execute("""
+                SELECT id, repository_id, requirement, name FROM my_schema.requirements
+                WHERE repository_id = ANY(%s)
+            """, (changed_ids,))
+            stored_requirements = {tuple(row[1:3]): (row[0], row[3]) for row in cursor.fetchall()}
+
+        yaml_upserts = []
+        dependency_inserts = []
+        requirement_inserts = []
+        incoming_yaml = set()
+        incoming_dependencies = set()
+        incoming_requirements = set()
+        for repo_id, (repo_data, _) in changed.items():
+            yaml, dependencies, requirements = prepare_rows(repo_id, repo_data)
+            for row in yaml:
+                incoming_yaml.add(row[:2])
+                stored = stored_yaml.get(row[:2])
+                if stored is None or stored[1] != row[3]:
+                    yaml_upserts.append(row)
+            for row in dependencies:
+                incoming_dependencies.add(row)
+                if row not in stored_dependencies:
+                    dependency_inserts.append(row)
+            for row in requirements:
+                incoming_requirements.add(row[:2])
+                stored = stored_requirements.get(row[:2])
+                # Rows exported before the name column existed are filled in as well
+                if stored is None or stored[1] != row[2]:
+                    requirement_inserts.append(row)
+
+        yaml_deletes = [row_id for key, (row_id, _) in stored_yaml.items() if key not in incoming_yaml]
+        dependency_deletes = [row_id for key, row_id in stored_dependencies.items() if key not in incoming_dependencies]
+        requirement_deletes = [row_id for key, (row_id, _) in stored_requirements.items() if key not in incoming_requirements]
+
+        logging.info(f"Deleting {len(yaml_deletes)} YAML files, {len(dependency_deletes)} dependencies "
+                     f"and {len(requirement_deletes)} requirements")
+        with METRICS.timer('db.delete'):
+            cursor.execute("DELETE FROM my_schema.yaml_files WHERE id = ANY(%s)", (yaml_deletes,))
+            cursor.execute("DELETE FROM my_schema.dependencies WHERE id = ANY(%s)", (dependency_deletes,))
+            cursor.execute("DELETE FROM my_schema.requirements WHERE id = ANY(%s)", (requirement_deletes,))
+
+        logging.info(f"Upserting {len(yaml_upserts)} YAML files, {len(dependency_inserts)} dependencies "
+                     f"and {len(requirement_inserts)} requirements")
+        insert_rows(cursor, 'yaml_files', """
+            INSERT INTO my_schema.yaml_files (repository_id, yaml_file_name, yaml_content, content_hash)
+            VALUES %s
+            ON CONFLICT (repository_id, yaml_file_name)
+            DO UPDATE SET yaml_content = EXCLUDED.yaml_content, content_hash = EXCLUDED.content_hash
+        """, yaml_upserts, batch_size)
+        insert_dependencies(cursor, dependency_inserts, batch_size, upsert=True)
+        insert_rows(cursor, 'requirements', """
+            INSERT INTO my_schema.requirements (repository_id, requirement, name, specifier)
+            VALUES %s
+            ON CONFLICT (repository_id, requirement)
+            DO UPDATE SET name = EXCLUDED.name, specifier = EXCLUDED.specifier
+        """, requirement_inserts, batch_size)
+
+    update_repositories(cursor, ids, [(repo_id, new_hash) for repo_id, (_, new_hash) in changed.items()], execution_date)
+
+def export_to_db(json_path, db_config, batch_size=1000, mode='replace'):
+    """
+    Export JSON data to the PostgreSQL database.
+    
+    Repositories are read one at a time (streamed for JSON Lines files) and exported
+    in batches of batch_size repositories within a single transaction, on a connection
+    borrowed from the shared pool so repeated exports in one process reuse it.
+    
+    :param json_path: Path to the JSON or JSON Lines file.
+    :param db_config: Dictionary containing database configuration.
+    :param batch_size: Number of repositories per batch and rows per INSERT statement.
+    :param mode: 'replace' to delete and reinsert all rows of each repository, or 'diff'
+                 to write only the rows that changed.
+    """
     execution_date = datetime.now()
+    export = export_batch_diff if mode == 'diff' else export_batch
     
     try:
-        for repo, repo_data in data.items():
-            logging.info(f"Preparing data for repository: {repo}")
-            yaml_configs = repo_data.get('yaml_configs', {})
-            dependencies = repo_data.get('dependencies', [])
-            requirements = repo_data.get('requirements', [])
-            
-            # Fetch the repository ID from the repositories table
-            cursor.execute(f"""
-                SELECT id FROM my_schema.repositories WHERE name = %s
-            """, (repo,))
-            repo_id = cursor.fetchone()
-            
-            if repo_id is None:
-                logging.error(f"Repository {repo} not found in my_schema.repositories")
-                continue
-            
-            repo_id = repo_id[0]
-            
-            # Delete old entries from yaml_files, dependencies, and requirements tables
-            logging.info(f"Delete old entries from yaml_files, dependencies, and requirements for: {repo}")
-            cursor.execute(f"DELETE FROM my_schema.yaml_files WHERE repository_id = %s", (repo_id,))
-            cursor.execute(f"DELETE FROM my_schema.dependencies WHERE repository_id = %s", (repo_id,))
-            cursor.execute(f"DELETE FROM my_schema.requirements WHERE repository_id = %s", (repo_id,))
-            
-            logging.info(f"Inserting data for repository: {repo}")
-            for yaml_file, yaml_content in yaml_configs.items():
-                cursor.execute(f"""
-                    INSERT INTO my_schema.yaml_files (repository_id, yaml_file_name, yaml_content)
-                    VALUES (%s, %s, %s)
-                """, (repo_id, yaml_file, json.dumps(yaml_content)))
-            
-            for dep in dependencies:
-                cursor.execute(f"""
-                    INSERT INTO my_schema.dependencies (repository_id, group_id, artifact_id, version)
-                    VALUES (%s, %s, %s, %s)
-                """, (repo_id, dep['groupId'], dep['artifactId'], dep['version']))
-            
-            for req in requirements:
-                cursor.execute(f"""
-                    INSERT INTO my_schema.requirements (repository_id, requirement)
-                    VALUES (%s, %s)
-                """, (repo_id, req))
-            
-            # Update the last_scan_date for the repository
-            cursor.execute(f"""
-                UPDATE my_schema.repositories
-                SET last_scan_date = %s
-                WHERE id = %s
-            """, (execution_date, repo_id))
-        
-        conn.commit()
+        with connection(db_config) as conn, conn.cursor() as cursor:
+            batch = []
+            for repo, repo_data in read_scan_results(json_path):
+                batch.append((repo, repo_data))
+                if len(batch) >= batch_size:
+                    with METRICS.timer('export.batch'):
+                        export(cursor, batch, execution_date, batch_size)
+                    batch = []
+            if batch:
+                with METRICS.timer('export.batch'):
+                    export(cursor, batch, execution_date, batch_size)
     except Exception as e:
         logging.error(f"Error inserting data: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
 
 def main():
     """
@@ -95,23 +334,16 @@ def main():
     logging.basicConfig(level=logging.INFO)
     
     parser = argparse.ArgumentParser(description='Export JSON data to the PostgreSQL database.')
-    parser.add_argument('--json_path', type=str, required=True, help='Path to the JSON file.')
-    parser.add_argument('--db_host', type=str, required=True, help='Database host.')
-    parser.add_argument('--db_port', type=int, required=True, help='Database port.')
-    parser.add_argument('--db_name', type=str, required=True, help='Database name.')
-    parser.add_argument('--db_user', type=str, required=True, help='Database user.')
-    parser.add_argument('--db_password', type=str, required=True, help='Database password.')
+    parser.add_argument('--json_path', type=str, required=True, help='Path to the JSON or JSON Lines (.ndjson/.jsonl) file.')
+    add_db_arguments(parser)
+    parser.add_argument('--batch_size', type=int, default=1000, help='Number of repositories exported per batch and rows sent in each INSERT statement.')
+    parser.add_argument('--mode', type=str, choices=['replace', 'diff'], default='replace',
+                        help="'replace' deletes and reinserts every row; 'diff' only writes the rows that changed.")
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
-    db_config = {
-        'host': args.db_host,
-        'port': args.db_port,
-        'dbname': args.db_name,
-        'user': args.db_user,
-        'password': args.db_password
-    }
-
-    export_to_db(args.json_path, db_config)
+    with profile_run(args.profile, args.metrics_path):
+        export_to_db(args.json_path, load_db_config(args), args.batch_size, args.mode)
 
 if __name__ == "__main__":
     main()
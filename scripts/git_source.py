@@ -0,0 +1,113 @@
+import os
+import shutil
+import logging
+import tempfile
+from git import Repo
+from gitdb.exc import BadName, BadObject
+from records import ScanResult
+from discovery import DEFAULT_SCAN_CONFIG, manifest_patterns, match_kind, parse_gitignore, is_gitignored
+
+# Git file mode of symbolic links, which are not followed
+SYMLINK_MODE = 0o120000
+
+def discover_blobs(tree, scan_config=None):
+    """
+    Walk a git tree and yield the manifest blobs it contains, without checking anything out.
+    
+    Applies the same rules as discovery.discover_files: ignored directories and those
+    excluded by .gitignore files are pruned, and blobs above the size limit are skipped.
+    
+    :param tree: GitPython Tree object of the commit to scan.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :return: Generator of (kind, relpath, blob) tuples in a stable order.
+    """
+    scan_config = scan_config or DEFAULT_SCAN_CONFIG
+    ignored_dirs = set(scan_config['ignored_dirs'])
+    max_file_size = scan_config.get('max_file_size')
+    patterns = manifest_patterns(scan_config)
+
+    stack = [('', tree, [])]
+    while stack:
+        rel_dir, current, rules = stack.pop()
+        blobs = sorted(current.blobs, key=lambda blob: blob.name)
+        if scan_config.get('use_gitignore'):
+            gitignore = next((blob for blob in blobs if blob.name == '.gitignore'), None)
+            if gitignore is not None:
+                lines = gitignore.data_stream.read().decode('utf-8', errors='replace').splitlines()
+                rules = rules + parse_gitignore(lines, rel_dir)
+
+        for blob in blobs:
+            rel_path = f"{rel_dir}/{blob.name}" if rel_dir else blob.name
+            kind = match_kind(patterns, rel_path, blob.name)
+            if kind is None or blob.mode & 0o170000 == SYMLINK_MODE:
+                continue
+            if max_file_size and blob.size > max_file_size:
+                logging.warning(f"Skipping {rel_path}: {blob.size} bytes exceeds the {max_file_size} bytes limit")
+                continue
+            yield kind, rel_path, blob
+
+        subdirs = []
+        for subtree in sorted(current.trees, key=lambda subtree: subtree.name):
+            rel_path = f"{rel_dir}/{subtree.name}" if rel_dir else subtree.name
+            if subtree.name not in ignored_dirs and not is_gitignored(rel_path, subtree.name, rules):
+                subdirs.append((rel_path, subtree, rules))
+        stack.extend(reversed(subdirs))
+
+def resolve_commit(repo_path, ref):
+    """
+    Resolve a ref of a (possibly bare or --no-checkout) clone to a commit.
+    
+    :param repo_path: Path to the clone.
+    :param ref: Branch, tag or commit to resolve. Remote branches such as 'origin/main' are accepted.
+    :return: GitPython Commit object.
+    """
+    return Repo(repo_path).commit(ref)
+
+def export_manifests(commit, target_path, scan_config=None):
+    """
+    Write the manifest blobs of a commit to a directory, keeping their repo-relative paths.
+    
+    Blob contents are streamed from the object database (git cat-file --batch), so
+    only the manifest files ever reach the disk.
+    
+    :param commit: GitPython Commit object.
+    :param target_path: Directory where the manifests are written.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :return: Number of files written.
+    """
+    count = 0
+    for _, rel_path, blob in discover_blobs(commit.tree, scan_config):
+        file_path = os.path.join(target_path, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as file:
+            shutil.copyfileobj(blob.data_stream, file)
+        count += 1
+    return count
+
+def scan_git_ref(repo_path, ref, scan, previous=None, scan_config=None):
+    """
+    Scan a ref of a clone straight from the git object store.
+    
+    :param repo_path: Path to the clone (bare, --no-checkout or regular).
+    :param ref: Branch, tag or commit to scan.
+    :param scan: Function scanning a directory, with the signature of scanner.scan_repository.
+    :param previous: Previous scan state of the repository and ref, already checked against the
+                     scanner version and settings, {} for a first incremental scan, or None to
+                     scan without tracking state.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :return: Tuple of (repository data or None if nothing was found, new scan state or None).
+             Both are None when the ref does not exist in the clone.
+    """
+    try:
+        commit = resolve_commit(repo_path, ref)
+    except (BadName, BadObject, ValueError) as e:
+        logging.warning(f"Skipping {ref} of {repo_path}: {e}")
+        return None, None
+    if previous and previous.get('head') == commit.hexsha:
+        logging.info(f"{ref} unchanged at {commit.hexsha}, reusing previous results")
+        return ScanResult.from_json(previous['repo_data']), dict(previous, stats={'parsed': 0, 'reused': len(previous['files'])})
+
+    with tempfile.TemporaryDirectory(prefix='repo_scanner_') as target_path:
+        count = export_manifests(commit, target_path, scan_config)
+        logging.info(f"Read {count} manifest files from {ref} ({commit.hexsha})")
+        return scan(target_path, previous, scan_config, head=commit.hexsha)
@@ -1,107 +1,207 @@
+import importlib.util
 import pandas as pd
-import psycopg2
-from psycopg2 import sql
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from psycopg2.extras import execute_values
 import yaml
 import argparse
 import logging
+from db import add_db_arguments, load_db_config, connection
+
+# Hojas del archivo Excel y columnas de cada una
+ORGANIZATION_COLUMNS = ['initiative', 'contact', 'name', 'link', 'scan']
+REPOSITORY_COLUMNS = ['organization', 'name', 'link', 'scan']
+MEETING_COLUMNS = ['organization', 'date', 'description']
+
+# Valores de texto que se interpretan como verdadero en las columnas booleanas
+TRUE_VALUES = ['true', '1', 'yes', 'y', 'si', 'sí', 'x']
+
+# Motor de lectura: python-calamine (en Rust) si está instalado, openpyxl en caso contrario
+EXCEL_ENGINE = 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
 
 def read_excel(file_path):
     """
     Leer el archivo Excel y extraer las hojas de organizaciones, repositorios y reuniones.
     
+    Las tres hojas se leen en una sola pasada sobre el libro.
+    
     :param file_path: Ruta del archivo Excel.
     :return: DataFrames de organizaciones, repositorios y reuniones.
     """
-    logging.info(f"Leyendo el archivo Excel: {file_path}")
-    xls = pd.ExcelFile(file_path)
-    orgs_df = pd.read_excel(xls, 'organizations')
-    repos_df = pd.read_excel(xls, 'repositories')
-    meetings_df = pd.read_excel(xls, 'meetings')
-    return orgs_df, repos_df, meetings_df
+    logging.info(f"Leyendo el archivo Excel: {file_path} (motor {EXCEL_ENGINE})")
+    sheets = pd.read_excel(file_path, sheet_name=['organizations', 'repositories', 'meetings'], engine=EXCEL_ENGINE)
+    return sheets['organizations'], sheets['repositories'], sheets['meetings']
 
-def connect_db(db_config):
+def normalize_text(series):
     """
-    Conectar a la base de datos PostgreSQL.
+    Normalizar una columna de texto: recortar espacios y tratar las cadenas vacías como nulas.
     
-    :param db_config: Diccionario con la configuración de la base de datos.
-    :return: Conexión a la base de datos.
+    :param series: Columna a normalizar.
+    :return: Columna normalizada.
     """
-    logging.info("Conectando a la base de datos PostgreSQL")
-    conn = psycopg2.connect(**db_config)
-    return conn
+    series = series.astype('string').str.strip()
+    return series.mask(series == '')
+
+def normalize_bool(series):
+    """
+    Normalizar una columna booleana que puede contener booleanos, números o texto ('sí', 'yes', 'x'...).
+    
+    :param series: Columna a normalizar.
+    :return: Columna booleana, con los valores nulos como False.
+    """
+    if is_bool_dtype(series):
+        return series.fillna(False).astype(bool)
+    # Las columnas numéricas con celdas vacías se leen como float (1.0, NaN), que no son texto
+    if is_numeric_dtype(series):
+        return series.fillna(0).astype(bool)
+    return series.astype('string').str.strip().str.lower().isin(TRUE_VALUES)
+
+def normalize_sheet(df, sheet, columns, required, key):
+    """
+    Normalizar y validar una hoja: comprobar sus columnas, descartar las filas incompletas
+    y quedarse con la última aparición de cada clave.
+    
+    :param df: DataFrame de la hoja.
+    :param sheet: Nombre de la hoja, usado en los mensajes.
+    :param columns: Columnas esperadas en la hoja.
+    :param required: Columnas que no pueden estar vacías.
+    :param key: Columnas que identifican cada fila.
+    :return: DataFrame normalizado con las columnas esperadas.
+    """
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise ValueError(f"Faltan las columnas {missing} en la hoja {sheet}")
+    df = df[columns].copy()
+    for column in columns:
+        if column == 'scan':
+            df[column] = normalize_bool(df[column])
+        elif column == 'date':
+            df[column] = pd.to_datetime(df[column], errors='coerce').dt.date
+        else:
+            df[column] = normalize_text(df[column])
+
+    invalid = df[required].isna().any(axis=1)
+    if invalid.any():
+        logging.warning(f"Descartando {int(invalid.sum())} filas incompletas de la hoja {sheet}")
+        df = df[~invalid]
+    duplicated = df.duplicated(key, keep='last')
+    if duplicated.any():
+        logging.warning(f"Descartando {int(duplicated.sum())} filas duplicadas de la hoja {sheet}")
+        df = df[~duplicated]
+    return df
+
+def to_rows(df, columns):
+    """
+    Convertir las columnas de un DataFrame en tuplas de valores de Python, con None para los nulos.
+    
+    :param df: DataFrame.
+    :param columns: Columnas a convertir, en orden.
+    :return: Lista de tuplas.
+    """
+    values = df[columns].astype(object)
+    return list(values.where(values.notna(), None).itertuples(index=False, name=None))
+
+def insert_organizations(cursor, df, batch_size=1000):
+    """
+    Insertar o actualizar las organizaciones y devolver sus IDs.
+    
+    :param cursor: Cursor de la base de datos.
+    :param df: DataFrame normalizado de organizaciones.
+    :param batch_size: Número de filas enviadas en cada sentencia.
+    :return: DataFrame con las columnas organization e organization_id.
+    """
+    logging.info(f"Insertando {len(df)} filas en la tabla: organizations")
+    ids = execute_values(cursor, """
+        INSERT INTO my_schema.organizations (initiative, contact, name, link, scan)
+        VALUES %s
+        ON CONFLICT (name) DO UPDATE
+        SET initiative = EXCLUDED.initiative, contact = EXCLUDED.contact, link = EXCLUDED.link, scan = EXCLUDED.scan
+        RETURNING name, id
+    """, to_rows(df, ORGANIZATION_COLUMNS), page_size=batch_size, fetch=True)
+    return pd.DataFrame(ids, columns=['organization', 'organization_id'])
+
+def map_organization_ids(cursor, df, org_ids, sheet):
+    """
+    Añadir el ID de organización a las filas de una hoja, buscando en la base de datos las
+    organizaciones que no están en el archivo Excel y descartando las que no existen.
+    
+    :param cursor: Cursor de la base de datos.
+    :param df: DataFrame normalizado con la columna organization.
+    :param org_ids: DataFrame con las columnas organization e organization_id.
+    :param sheet: Nombre de la hoja, usado en los mensajes.
+    :return: DataFrame con la columna organization_id.
+    """
+    unknown = set(df['organization']) - set(org_ids['organization'])
+    if unknown:
+        cursor.execute("SELECT name, id FROM my_schema.organizations WHERE name = ANY(%s)", (sorted(unknown),))
+        stored = pd.DataFrame(cursor.fetchall(), columns=['organization', 'organization_id'])
+        org_ids = pd.concat([org_ids, stored], ignore_index=True)
+    merged = df.merge(org_ids, on='organization', how='left', validate='many_to_one')
+    missing = merged['organization_id'].isna()
+    if missing.any():
+        names = sorted(merged.loc[missing, 'organization'].unique())
+        logging.warning(f"Descartando {int(missing.sum())} filas de la hoja {sheet} con organizaciones desconocidas: {names}")
+        merged = merged[~missing]
+    return merged.astype({'organization_id': int})
 
-def insert_organizations(conn, df):
+def insert_repositories(cursor, df, batch_size=1000):
     """
-    Insertar datos en la tabla de organizaciones y devolver un diccionario con los IDs generados.
+    Insertar o actualizar los repositorios.
     
-    :param conn: Conexión a la base de datos.
-    :param df: DataFrame con los datos a insertar.
-    :return: Diccionario con los nombres de las organizaciones y sus IDs generados.
-    """
-    logging.info("Insertando datos en la tabla: organizations")
-    cursor = conn.cursor()
-    org_ids = {}
-    for index, row in df.iterrows():
-        columns = list(row.index)
-        values = [row[col] for col in columns]
-        insert_statement = sql.SQL(
-            'INSERT INTO my_schema.organizations ({}) VALUES ({}) RETURNING id'
-        ).format(
-            sql.SQL(', ').join(map(sql.Identifier, columns)),
-            sql.SQL(', ').join(sql.Placeholder() * len(values))
-        )
-        cursor.execute(insert_statement, values)
-        org_id = cursor.fetchone()[0]
-        org_ids[row['name']] = org_id
-    conn.commit()
-    cursor.close()
-    return org_ids
-
-def insert_repositories(conn, df, org_ids):
-    """
-    Insertar datos en la tabla de repositorios.
+    :param cursor: Cursor de la base de datos.
+    :param df: DataFrame normalizado de repositorios con la columna organization_id.
+    :param batch_size: Número de filas enviadas en cada sentencia.
+    :return: IDs de los repositorios insertados o actualizados.
+    """
+    logging.info(f"Insertando {len(df)} filas en la tabla: repositories")
+    ids = execute_values(cursor, """
+        INSERT INTO my_schema.repositories (organization_id, name, link, scan)
+        VALUES %s
+        ON CONFLICT (organization_id, name) DO UPDATE
+        SET link = EXCLUDED.link, scan = EXCLUDED.scan
+        RETURNING id
+    """, to_rows(df, ['organization_id', 'name', 'link', 'scan']), page_size=batch_size, fetch=True)
+    return [row[0] for row in ids]
+
+def insert_meetings(cursor, df, batch_size=1000):
+    """
+    Insertar las reuniones que no existan todavía.
     
-    :param conn: Conexión a la base de datos.
-    :param df: DataFrame con los datos a insertar.
-    :param org_ids: Diccionario con los nombres de las organizaciones y sus IDs generados.
-    """
-    logging.info("Insertando datos en la tabla: repositories")
-    cursor = conn.cursor()
-    for index, row in df.iterrows():
-        columns = ['organization_id', 'name', 'link', 'scan', 'last_scan_date']
-        values = [org_ids[row['organization']], row['name'], row['link'], row['scan'], None]
-        insert_statement = sql.SQL(
-            'INSERT INTO my_schema.repositories ({}) VALUES ({})'
-        ).format(
-            sql.SQL(', ').join(map(sql.Identifier, columns)),
-            sql.SQL(', ').join(sql.Placeholder() * len(values))
-        )
-        cursor.execute(insert_statement, values)
-    conn.commit()
-    cursor.close()
-
-def insert_meetings(conn, df, org_ids):
-    """
-    Insertar datos en la tabla de reuniones.
+    :param cursor: Cursor de la base de datos.
+    :param df: DataFrame normalizado de reuniones con la columna organization_id.
+    :param batch_size: Número de filas enviadas en cada sentencia.
+    :return: IDs de las reuniones insertadas.
+    """
+    logging.info(f"Insertando {len(df)} filas en la tabla: meetings")
+    ids = execute_values(cursor, """
+        INSERT INTO my_schema.meetings (organization_id, date, description)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    """, to_rows(df, ['organization_id', 'date', 'description']), page_size=batch_size, fetch=True)
+    return [row[0] for row in ids]
+
+def import_excel(file_path, db_config, batch_size=1000):
+    """
+    Importar el archivo Excel en una sola transacción. Volver a importar el mismo archivo
+    actualiza las organizaciones y repositorios existentes en lugar de duplicarlos.
     
-    :param conn: Conexión a la base de datos.
-    :param df: DataFrame con los datos a insertar.
-    :param org_ids: Diccionario con los nombres de las organizaciones y sus IDs generados.
-    """
-    logging.info("Insertando datos en la tabla: meetings")
-    cursor = conn.cursor()
-    for index, row in df.iterrows():
-        columns = ['organization_id', 'date', 'description']
-        values = [org_ids[row['organization']], row['date'], row['description']]
-        insert_statement = sql.SQL(
-            'INSERT INTO my_schema.meetings ({}) VALUES ({})'
-        ).format(
-            sql.SQL(', ').join(map(sql.Identifier, columns)),
-            sql.SQL(', ').join(sql.Placeholder() * len(values))
-        )
-        cursor.execute(insert_statement, values)
-    conn.commit()
-    cursor.close()
+    :param file_path: Ruta del archivo Excel.
+    :param db_config: Diccionario con la configuración de la base de datos.
+    :param batch_size: Número de filas enviadas en cada sentencia.
+    """
+    orgs_df, repos_df, meetings_df = read_excel(file_path)
+    orgs_df = normalize_sheet(orgs_df, 'organizations', ORGANIZATION_COLUMNS, ['initiative', 'contact', 'name'], ['name'])
+    repos_df = normalize_sheet(repos_df, 'repositories', REPOSITORY_COLUMNS, ['organization', 'name', 'link'],
+                               ['organization', 'name'])
+    meetings_df = normalize_sheet(meetings_df, 'meetings', MEETING_COLUMNS, ['organization', 'date'],
+                                  MEETING_COLUMNS)
+
+    logging.info("Conectando a la base de datos PostgreSQL")
+    with connection(db_config) as conn, conn.cursor() as cursor:
+        org_ids = insert_organizations(cursor, orgs_df, batch_size)
+        repo_ids = insert_repositories(cursor, map_organization_ids(cursor, repos_df, org_ids, 'repositories'), batch_size)
+        meeting_ids = insert_meetings(cursor, map_organization_ids(cursor, meetings_df, org_ids, 'meetings'), batch_size)
+    logging.info(f"Importadas {len(org_ids)} organizaciones, {len(repo_ids)} repositorios y {len(meeting_ids)} reuniones nuevas")
 
 def main():
     """
@@ -111,35 +211,17 @@ def main():
     
     parser = argparse.ArgumentParser(description='Importar datos de un archivo Excel a la base de datos PostgreSQL.')
     parser.add_argument('--config_path', type=str, required=True, help='Ruta del archivo de configuración.')
-    parser.add_argument('--db_host', type=str, required=True, help='Host de la base de datos.')
-    parser.add_argument('--db_port', type=int, required=True, help='Puerto de la base de datos.')
-    parser.add_argument('--db_name', type=str, required=True, help='Nombre de la base de datos.')
-    parser.add_argument('--db_user', type=str, required=True, help='Usuario de la base de datos.')
-    parser.add_argument('--db_password', type=str, required=True, help='Contraseña de la base de datos.')
+    add_db_arguments(parser)
+    parser.add_argument('--batch_size', type=int, default=1000, help='Número de filas enviadas en cada sentencia INSERT.')
     args = parser.parse_args()
 
     try:
         with open(args.config_path, 'r') as file:
             config = yaml.safe_load(file)
         
-        file_path = config['excel_file_path']
-        orgs_df, repos_df, meetings_df = read_excel(file_path)
-        
-        db_config = {
-            'host': args.db_host,
-            'port': args.db_port,
-            'dbname': args.db_name,
-            'user': args.db_user,
-            'password': args.db_password
-        }
-        
-        conn = connect_db(db_config)
-        try:
-            org_ids = insert_organizations(conn, orgs_df)
-            insert_repositories(conn, repos_df, org_ids)
-            insert_meetings(conn, meetings_df, org_ids)
-        finally:
-            conn.close()
+        # La sección 'database' se lee del mismo archivo de configuración si no se indica otro
+        db_config = load_db_config(args, args.db_config_path or args.config_path)
+        import_excel(config['excel_file_path'], db_config, args.batch_size)
     except Exception as e:
         logging.error(f"Error en la función principal: {e}")
 
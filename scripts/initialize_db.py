@@ -1,6 +1,6 @@
-import psycopg2
 import argparse
 import logging
+from db import add_db_arguments, load_db_config, connection
 
 def execute_sql_file(cursor, file_path):
     """
@@ -33,24 +33,13 @@ def initialize_db(db_config):
     """
     try:
         logging.info("Connecting to the database")
-        conn = psycopg2.connect(**db_config)
-        cursor = conn.cursor()
-    except Exception as e:
-        logging.error(f"Error connecting to the database: {e}")
-        return
-    
-    try:
-        # Set the search path to the schema
-        cursor.execute(f"SET search_path TO my_schema;")
-        clear_tables(cursor)
-        execute_sql_file(cursor, f'../sql/create_tables.sql')
-        conn.commit()
+        with connection(db_config) as conn, conn.cursor() as cursor:
+            # Set the search path to the schema
+            cursor.execute(f"SET search_path TO my_schema;")
+            clear_tables(cursor)
+            execute_sql_file(cursor, f'../sql/create_tables.sql')
     except Exception as e:
         logging.error(f"Error executing SQL file: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
 
 def main():
     """
@@ -59,22 +48,10 @@ def main():
     logging.basicConfig(level=logging.INFO)
     
     parser = argparse.ArgumentParser(description='Initialize the PostgreSQL database.')
-    parser.add_argument('--db_host', type=str, required=True, help='Database host.')
-    parser.add_argument('--db_port', type=int, required=True, help='Database port.')
-    parser.add_argument('--db_name', type=str, required=True, help='Database name.')
-    parser.add_argument('--db_user', type=str, required=True, help='Database user.')
-    parser.add_argument('--db_password', type=str, required=True, help='Database password.')
+    add_db_arguments(parser)
     args = parser.parse_args()
 
-    db_config = {
-        'host': args.db_host,
-        'port': args.db_port,
-        'dbname': args.db_name,
-        'user': args.db_user,
-        'password': args.db_password
-    }
-
-    initialize_db(db_config)
+    initialize_db(load_db_config(args))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,237 @@
+import io
+import json
+import time
+import heapq
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager
+
+# Number of entries kept in each slowest-N report
+SLOWEST_N = 20
+PROFILE_MODES = ('cpu', 'memory', 'all')
+
+class Metrics:
+    """
+    Timers, counters and slowest-N reports of a process.
+    
+    Timers accumulate the number of calls, total and maximum seconds of each stage
+    (e.g. 'parse.pom' or 'db.insert'); counters hold integer totals (e.g. 'files.yaml');
+    slowest-N reports keep the slowest items of each category (e.g. the slowest POM files).
+    All methods are thread-safe. Worker processes send their snapshot back to the parent,
+    which merges it.
+    """
+
+    def __init__(self, slowest_n=SLOWEST_N):
+        """
+        Create an empty set of metrics.
+        
+        :param slowest_n: Number of entries kept in each slowest-N report.
+        """
+        self.slowest_n = slowest_n
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+        self.slowest = {}
+
+    def add_time(self, stage, seconds, category=None, label=None):
+        """
+        Add a measured duration to a stage timer and, optionally, to a slowest-N report.
+        
+        :param stage: Name of the stage.
+        :param seconds: Duration in seconds.
+        :param category: Slowest-N report the item belongs to, or None.
+        :param label: Name of the item in the report, e.g. a file path.
+        """
+        with self.lock:
+            timer = self.timers.setdefault(stage, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            if category is not None:
+                self.push_slowest(category, seconds, label)
+
+    def push_slowest(self, category, seconds, label):
+        """
+        Offer an item to a slowest-N report. Must be called with the lock held.
+        
+        :param category: Name of the report.
+        :param seconds: Duration of the item.
+        :param label: Name of the item.
+        """
+        heap = self.slowest.setdefault(category, [])
+        if len(heap) < self.slowest_n:
+            heapq.heappush(heap, (seconds, label))
+        elif seconds > heap[0][0]:
+            heapq.heapreplace(heap, (seconds, label))
+
+    def count(self, name, value=1):
+        """
+        Increase a counter.
+        
+        :param name: Name of the counter.
+        :param value: Amount to add.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, stage, category=None, label=None):
+        """
+        Time a block of code (see add_time).
+        
+        :param stage: Name of the stage.
+        :param category: Slowest-N report the item belongs to, or None.
+        :param label: Name of the item in the report.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, category, label)
+
+    def snapshot(self, reset=False):
+        """
+        Get the current metrics as a JSON-serializable dictionary.
+        
+        :param reset: Whether to clear the metrics afterwards, e.g. in a worker process that
+                      sends its metrics to the parent after each task.
+        :return: Dictionary with the timers, counters and slowest-N reports.
+        """
+        with self.lock:
+            snapshot = {
+                'timers': {stage: {'count': count, 'seconds': seconds, 'max_seconds': longest}
+                           for stage, (count, seconds, longest) in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'slowest': {category: [{'seconds': seconds, 'item': label} for seconds, label in sorted(heap, reverse=True)]
+                            for category, heap in sorted(self.slowest.items())}
+            }
+            if reset:
+                self.timers = {}
+                self.counters = {}
+                self.slowest = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Add the metrics of another process (see snapshot).
+        
+        :param snapshot: Dictionary returned by snapshot, or None.
+        """
+        if not snapshot:
+            return
+        with self.lock:
+            for stage, timer in snapshot['timers'].items():
+                current = self.timers.setdefault(stage, [0, 0.0, 0.0])
+                current[0] += timer['count']
+                current[1] += timer['seconds']
+                current[2] = max(current[2], timer['max_seconds'])
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for category, items in snapshot['slowest'].items():
+                for item in items:
+                    self.push_slowest(category, item['seconds'], item['item'])
+
+# Metrics of the current process, used by the scripts
+METRICS = Metrics()
+
+def reset_metrics():
+    """
+    Clear the metrics of the current process. Used as the initializer of worker processes,
+    which would otherwise report again the metrics inherited from their parent when forked.
+    """
+    METRICS.snapshot(reset=True)
+
+def timed(function, stage, category=None):
+    """
+    Wrap a function so each call is timed, with its first argument as the slowest-N label.
+    
+    :param function: Function to wrap, e.g. a manifest parser taking a file path.
+    :param stage: Name of the stage.
+    :param category: Slowest-N report of the calls, or None.
+    :return: Wrapped function.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with METRICS.timer(stage, category, args[0] if args else None):
+            return function(*args, **kwargs)
+    return wrapper
+
+def add_profile_arguments(parser):
+    """
+    Add the --profile and --metrics_path arguments shared by the scripts to an argument parser.
+    
+    :param parser: argparse.ArgumentParser to extend.
+    """
+    parser.add_argument('--profile', type=str, choices=PROFILE_MODES,
+                        help="Profile the run: 'cpu' with cProfile, 'memory' with tracemalloc, or 'all'. "
+                             "Only the main process is profiled; the metrics include worker processes.")
+    parser.add_argument('--metrics_path', type=str,
+                        help='Path to a JSON file where the timers, counters, slowest-N reports and profile are written at exit.')
+
+def log_summary(snapshot, top=10):
+    """
+    Log the stages that took the longest.
+    
+    :param snapshot: Dictionary returned by Metrics.snapshot.
+    :param top: Number of stages logged.
+    """
+    timers = sorted(snapshot['timers'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+    for stage, timer in timers[:top]:
+        logging.info(f"Stage {stage}: {timer['seconds']:.3f}s in {timer['count']} calls "
+                     f"(max {timer['max_seconds']:.3f}s)")
+
+@contextmanager
+def profile_run(profile=None, metrics_path=None, top=30):
+    """
+    Profile a run and write its metrics when it finishes, even if it fails.
+    
+    :param profile: 'cpu', 'memory', 'all' or None (see PROFILE_MODES).
+    :param metrics_path: Path to the JSON metrics file, or None to only log a summary.
+    :param top: Number of functions and allocation sites included in the profile reports.
+    """
+    profiler = cProfile.Profile() if profile in ('cpu', 'all') else None
+    trace_memory = profile in ('memory', 'all')
+    if trace_memory:
+        tracemalloc.start(10)
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield METRICS
+    finally:
+        wall_time = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+        report = METRICS.snapshot()
+        report['wall_seconds'] = wall_time
+
+        if profiler is not None:
+            stats = pstats.Stats(profiler, stream=io.StringIO())
+            functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+            report['cpu_profile'] = [
+                {'function': f"{path}:{line}({name})", 'calls': calls, 'own_seconds': own, 'cumulative_seconds': cumulative}
+                for (path, line, name), (_, calls, own, cumulative, _) in functions
+            ]
+            if metrics_path:
+                profiler.dump_stats(f"{metrics_path}.prof")
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            sites = tracemalloc.take_snapshot().statistics('lineno')[:top]
+            tracemalloc.stop()
+            report['memory_profile'] = {
+                'current_bytes': current,
+                'peak_bytes': peak,
+                'top_allocations': [{'site': str(stat.traceback[0]), 'bytes': stat.size, 'blocks': stat.count}
+                                    for stat in sites]
+            }
+
+        if profile or metrics_path:
+            log_summary(report)
+        if metrics_path:
+            logging.info(f"Writing metrics to JSON file: {metrics_path}")
+            with open(metrics_path, 'w') as file:
+                json.dump(report, file, indent=4, default=str)
@@ -0,0 +1,457 @@
+import os
+import time
+import queue
+import sqlite3
+import argparse
+import logging
+import threading
+from datetime import datetime
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from db import add_db_arguments, load_db_config, connection
+from clone_repos import sync_repo
+from repositories import get_repositories_to_clone, repo_name, unique_repo_urls
+from scanner import scan_repository_task
+from scan_cache import ScanCache
+from scan_results import write_ndjson_record
+from discovery import load_scan_config, DEFAULT_SCAN_CONFIG
+from export_to_db import export_batch, export_batch_diff
+from work_queue import WorkQueue, DEFAULT_LEASE_SECONDS, DEFAULT_HEARTBEAT_INTERVAL, DEFAULT_MAX_ATTEMPTS
+from metrics import METRICS, reset_metrics, add_profile_arguments, profile_run
+
+# Marker sent through a queue once every item of the previous stage has been processed
+DONE = object()
+
+class Checkpoint:
+    """
+    Progress of the pipeline stored in a local SQLite database, so an interrupted run
+    can be resumed without scanning and exporting again the repositories it finished.
+    
+    Each repository has one row with the last stage it completed and the HEAD commit it
+    was processed at. The database is shared by the stage threads.
+    """
+
+    def __init__(self, checkpoint_path):
+        """
+        Open (and create if needed) the checkpoint database.
+        
+        :param checkpoint_path: Path to the SQLite checkpoint file.
+        """
+        logging.info(f"Opening pipeline checkpoint: {checkpoint_path}")
+        checkpoint_dir = os.path.dirname(checkpoint_path)
+        if checkpoint_dir and not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(checkpoint_path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_state (
+                repo TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                head TEXT,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def is_done(self, repo, head):
+        """
+        Check whether a repository was already exported at the given HEAD.
+        
+        :param repo: Name of the repository.
+        :param head: Current HEAD commit of the clone, or None if it cannot be read.
+        :return: True if the repository can be skipped.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT stage, head FROM pipeline_state WHERE repo = ?", (repo,)).fetchone()
+        return head is not None and row == ('exported', head)
+
+    def put(self, repo, stage, head):
+        """
+        Record the last stage completed for a repository. Changes are committed immediately.
+        
+        :param repo: Name of the repository.
+        :param stage: 'cloned', 'scanned' or 'exported'.
+        :param head: HEAD commit the repository was processed at.
+        """
+        with self.lock:
+            self.conn.execute("""
+                INSERT OR REPLACE INTO pipeline_state (repo, stage, head, updated_at)
+                VALUES (?, ?, ?, ?)
+            """, (repo, stage, head, datetime.now().isoformat()))
+            self.conn.commit()
+
+    def close(self):
+        """
+        Close the checkpoint database.
+        """
+        with self.lock:
+            self.conn.close()
+
+class Stage:
+    """
+    A pipeline stage: a group of threads taking items from an inbox queue, processing them
+    and putting the results on an outbox queue.
+    
+    Both queues are bounded, so a slow stage blocks the ones feeding it instead of letting
+    work pile up in memory. The DONE marker is forwarded once every thread has finished.
+    """
+
+    def __init__(self, name, process, inbox, outbox=None, threads=1, on_error=None):
+        """
+        Create the threads of the stage, without starting them.
+        
+        :param name: Name of the stage, used for logging.
+        :param process: Function taking an item and returning a list of items for the outbox.
+        :param inbox: Queue the stage reads from.
+        :param outbox: Queue the stage writes to, or None for the last stage.
+        :param threads: Number of items processed at the same time.
+        :param on_error: Function called with the item and the exception when processing an item fails, or None.
+        """
+        self.name = name
+        self.process = process
+        self.on_error = on_error
+        self.inbox = inbox
+        self.outbox = outbox
+        self.busy = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+        self.running = threads
+        self.threads = [threading.Thread(target=self.run, name=f"{name}-{index}", daemon=True)
+                        for index in range(threads)]
+
+    def start(self):
+        """
+        Start the threads of the stage.
+        """
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        """
+        Wait until every thread of the stage has finished.
+        """
+        for thread in self.threads:
+            thread.join()
+
+    def run(self):
+        """
+        Process items from the inbox until the DONE marker is reached. Errors are logged and
+        the item is dropped, so one failing repository does not stop the pipeline.
+        """
+        try:
+            while True:
+                item = self.inbox.get()
+                if item is DONE:
+                    # Let the other threads of the stage see the marker too
+                    self.inbox.put(DONE)
+                    break
+                start = time.perf_counter()
+                try:
+                    results = self.process(item)
+                except Exception as e:
+                    logging.error(f"Error in {self.name} stage: {e}")
+                    if self.on_error is not None:
+                        self.on_error(item, e)
+                    results = []
+                with self.lock:
+                    self.busy += time.perf_counter() - start
+                    self.count += 1
+                if self.outbox is not None:
+                    for result in results:
+                        self.outbox.put(result)
+        finally:
+            with self.lock:
+                self.running -= 1
+                last = self.running == 0
+            if last and self.outbox is not None:
+                self.outbox.put(DONE)
+
+def drain(inbox, first, limit):
+    """
+    Take the items already waiting on a queue, without blocking, to process them in one batch.
+    
+    :param inbox: Queue to read from.
+    :param first: Item already taken from the queue.
+    :param limit: Maximum number of items in the batch.
+    :return: Tuple of (list of items, whether the DONE marker was reached).
+    """
+    batch = [first]
+    while len(batch) < limit:
+        try:
+            item = inbox.get_nowait()
+        except queue.Empty:
+            break
+        if item is DONE:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+def run_pipeline(repo_urls, clone_path, db_config, clone_workers=4, scan_workers=1, queue_size=16,
+                 export_batch_size=100, mode='replace', cache_path=None, checkpoint_path=None,
+                 scan_config=None, ndjson_output_path=None, update=False, retries=2, work_queue=None,
+                 poll_interval=10, **clone_options):
+    """
+    Clone, scan and export repositories as a streaming pipeline.
+    
+    Each repository is scanned as soon as its clone finishes and exported as soon as its
+    scan finishes, so the stages overlap and the total time is close to that of the
+    slowest stage. Scans run in a pool of worker processes; exports are grouped into
+    batches of whatever scan results are waiting, each committed in its own transaction.
+    
+    With a work queue, repositories are claimed from the database in batches of queue_size
+    instead of read from repo_urls, so several nodes can run the pipeline at the same time.
+    Each repository leaves the queue once exported, and is given back to the queue if it
+    fails. The pipeline ends when no queued repository is waiting or leased.
+    
+    :param repo_urls: List of repository URLs. Ignored with a work queue.
+    :param clone_path: Path where the repositories are cloned.
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :param clone_workers: Maximum number of git operations running at the same time.
+    :param scan_workers: Number of scanner worker processes. 1 scans in the current process.
+    :param queue_size: Maximum number of repositories waiting between two stages.
+    :param export_batch_size: Maximum number of repositories exported in one transaction.
+    :param mode: 'replace' or 'diff' (see export_to_db.export_to_db).
+    :param cache_path: Path to the scan cache used for incremental scans, or None.
+    :param checkpoint_path: Path to the checkpoint database used to resume interrupted runs, or None.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :param ndjson_output_path: Path to a JSON Lines file where the scan results are also written, or None.
+    :param update: Whether to fetch and hard reset existing clones instead of skipping them.
+    :param retries: Number of retries for each git operation.
+    :param work_queue: WorkQueue to claim the repositories from, or None.
+    :param poll_interval: Seconds between two claims while the other nodes hold every queued repository.
+    :param clone_options: Extra options passed to clone_repos.clone_repo.
+    :return: Dictionary with the number of repositories in each final status.
+    """
+    scan_config = scan_config or DEFAULT_SCAN_CONFIG
+    # Clones without a working tree are scanned from the object store
+    ref = 'HEAD' if clone_options.get('no_checkout') else None
+    execution_date = datetime.now()
+    export = export_batch_diff if mode == 'diff' else export_batch
+    checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+    cache = ScanCache(cache_path, shared=True) if cache_path else None
+    cache_lock = threading.Lock()
+    # Scan workers are started while clone threads are running git, so they are spawned
+    # rather than forked, which could copy a lock held by another thread and deadlock
+    executor = ProcessPoolExecutor(max_workers=scan_workers, initializer=reset_metrics,
+                                   mp_context=get_context('spawn')) if scan_workers > 1 else None
+    output = open(ndjson_output_path, 'w') if ndjson_output_path else None
+    counts = {}
+    counts_lock = threading.Lock()
+
+    def count(status, number=1):
+        with counts_lock:
+            counts[status] = counts.get(status, 0) + number
+
+    def clone(item):
+        repo_id, repo_url = item
+        repo = repo_name(repo_url)
+        # Repositories claimed from the work queue are cloned into a directory of their own ID,
+        # since names are not unique across organizations. The key also identifies them in the
+        # scan cache and the checkpoint.
+        key = repo if repo_id is None else f"{repo_id}/{repo}"
+        repo_path = os.path.join(clone_path, *key.split('/'))
+        result = sync_repo(repo_url, repo_path, update, retries, **clone_options)
+        if result['status'] == 'failed':
+            fail(repo_id, 'clone failed')
+            return []
+        if checkpoint is not None:
+            if checkpoint.is_done(key, result['new_head']):
+                logging.info(f"{key} already exported at {result['new_head']}, skipping")
+                count('skipped')
+                complete([repo_id])
+                return []
+            checkpoint.put(key, 'cloned', result['new_head'])
+        return [(repo_id, key, repo, repo_path, result['new_head'])]
+
+    def scan(item):
+        repo_id, key, repo, repo_path, head = item
+        previous = None
+        if cache is not None:
+            with cache_lock:
+                previous = cache.get(key) or {}
+        if executor is not None:
+            _, repo_data, state, _, _, worker_metrics = executor.submit(scan_repository_task, repo, repo_path, previous,
+                                                                        scan_config, ref, True).result()
+            METRICS.merge(worker_metrics)
+        else:
+            _, repo_data, state, _, _, _ = scan_repository_task(repo, repo_path, previous, scan_config, ref)
+        if cache is not None and state is not None:
+            state.pop('stats')
+            with cache_lock:
+                cache.put(key, state)
+        if checkpoint is not None:
+            checkpoint.put(key, 'scanned', head)
+        if repo_data is None:
+            # Nothing to export, the repository is done
+            if checkpoint is not None:
+                checkpoint.put(key, 'exported', head)
+            complete([repo_id])
+            count('empty')
+            return []
+        return [(repo_id, key, repo, repo_data, head)]
+
+    def complete(repo_ids):
+        if work_queue is not None:
+            work_queue.complete(repo_ids)
+
+    def fail(repo_id, error):
+        count('failed')
+        if work_queue is not None:
+            work_queue.fail(repo_id, error)
+
+    def claim():
+        # Feeds the clone stage from the work queue, at most queue_size repositories ahead
+        try:
+            while True:
+                claimed = work_queue.claim(queue_size)
+                if not claimed:
+                    if not work_queue.pending():
+                        break
+                    # Wait for the other nodes to finish, or for the leases of crashed ones to expire
+                    time.sleep(poll_interval)
+                    continue
+                for repo_id, repo_url in claimed:
+                    url_queue.put((repo_id, repo_url))
+        except Exception as e:
+            logging.error(f"Error claiming repositories: {e}")
+        finally:
+            url_queue.put(DONE)
+
+    scan_queue = queue.Queue(maxsize=queue_size)
+    export_queue = queue.Queue(maxsize=queue_size)
+    url_queue = queue.Queue() if work_queue is None else queue.Queue(maxsize=queue_size)
+    stages = [
+        Stage('clone', clone, url_queue, scan_queue, clone_workers, lambda item, e: fail(item[0], e)),
+        Stage('scan', scan, scan_queue, export_queue, scan_workers, lambda item, e: fail(item[0], e))
+    ]
+    if work_queue is None:
+        repo_urls = unique_repo_urls(repo_urls)
+        for repo_url in repo_urls:
+            url_queue.put((None, repo_url))
+        url_queue.put(DONE)
+        logging.info(f"Running pipeline for {len(repo_urls)} repositories "
+                     f"({clone_workers} clone workers, {scan_workers} scan workers)")
+    else:
+        feeder = threading.Thread(target=claim, name='claim', daemon=True)
+        logging.info(f"Running pipeline from the work queue as node {work_queue.node_id} "
+                     f"({clone_workers} clone workers, {scan_workers} scan workers)")
+    start = time.perf_counter()
+    export_busy = 0.0
+    try:
+        if work_queue is not None:
+            work_queue.start()
+            feeder.start()
+        for stage in stages:
+            stage.start()
+
+        # The export stage runs in the current thread, on a single pooled connection
+        finished = False
+        while not finished:
+            item = export_queue.get()
+            if item is DONE:
+                break
+            batch, finished = drain(export_queue, item, export_batch_size)
+            batch_start = time.perf_counter()
+            try:
+                with connection(db_config) as conn, conn.cursor() as cursor:
+                    if work_queue is None:
+                        export(cursor, [(repo, repo_data) for _, _, repo, repo_data, _ in batch], execution_date)
+                    else:
+                        # Exported by the claimed ID, as another organization may have a repository of the same name
+                        export(cursor, [(repo_id, repo, repo_data) for repo_id, _, repo, repo_data, _ in batch],
+                               execution_date, by_id=True)
+            except Exception as e:
+                logging.error(f"Error exporting {len(batch)} repositories: {e}")
+                for repo_id, _, _, _, _ in batch:
+                    fail(repo_id, e)
+                continue
+            finally:
+                export_busy += time.perf_counter() - batch_start
+            for _, key, repo, repo_data, head in batch:
+                if output is not None:
+                    write_ndjson_record(output, repo, repo_data)
+                if checkpoint is not None:
+                    checkpoint.put(key, 'exported', head)
+            complete([repo_id for repo_id, _, _, _, _ in batch])
+            count('exported', len(batch))
+
+        for stage in stages:
+            stage.join()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if cache is not None:
+            cache.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        if output is not None:
+            output.close()
+        if work_queue is not None:
+            work_queue.stop()
+
+    wall_time = time.perf_counter() - start
+    for stage in stages:
+        logging.info(f"Stage {stage.name}: {stage.count} repositories, {stage.busy:.2f}s busy")
+    logging.info(f"Stage export: {counts.get('exported', 0)} repositories, {export_busy:.2f}s busy")
+    logging.info(f"Pipeline finished in {wall_time:.2f}s: "
+                 + ", ".join(f"{number} {status}" for status, number in sorted(counts.items())))
+    return counts
+
+def main():
+    """
+    Main function to clone, scan and export the repositories of the database in one streaming run.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(threadName)s %(levelname)s %(message)s')
+
+    parser = argparse.ArgumentParser(description='Clone, scan and export repositories as a streaming pipeline.')
+    add_db_arguments(parser)
+    parser.add_argument('--clone_path', type=str, required=True, help='Path where repositories will be cloned.')
+    parser.add_argument('--clone_workers', type=int, default=4, help='Maximum number of concurrent clones.')
+    parser.add_argument('--scan_workers', type=int, default=1, help='Number of worker processes used to scan repositories.')
+    parser.add_argument('--queue_size', type=int, default=16, help='Maximum number of repositories waiting between two stages.')
+    parser.add_argument('--export_batch_size', type=int, default=100, help='Maximum number of repositories exported in one transaction.')
+    parser.add_argument('--mode', type=str, choices=['replace', 'diff'], default='replace',
+                        help="'replace' deletes and reinserts every row; 'diff' only writes the rows that changed.")
+    parser.add_argument('--checkpoint_path', type=str, help='Path to the SQLite checkpoint used to resume interrupted runs.')
+    parser.add_argument('--cache_path', type=str, help='Path to the SQLite scan cache. Enables incremental scans when given.')
+    parser.add_argument('--config_path', type=str, help="Path to the configuration file with the 'scanner' settings.")
+    parser.add_argument('--ndjson_output_path', type=str, help='Path to a JSON Lines file where the scan results are also written.')
+    parser.add_argument('--depth', type=int, help='Create shallow clones with the given number of commits (e.g. 1).')
+    parser.add_argument('--filter', type=str, help="Partial clone filter, e.g. 'blob:none' for blobless clones.")
+    parser.add_argument('--sparse', action='store_true', help='Only check out the files read by the scanner.')
+    parser.add_argument('--no_checkout', action='store_true', help='Clone without a working tree and scan HEAD from the object store.')
+    parser.add_argument('--retries', type=int, default=2, help='Number of retries for each repository.')
+    parser.add_argument('--timeout', type=int, help='Seconds after which a git command is killed.')
+    parser.add_argument('--update', action='store_true', help='Fetch and hard reset existing clones instead of skipping them.')
+    parser.add_argument('--work_queue', action='store_true', help='Claim the repositories from the work queue in the database, so several nodes can run at the same time.')
+    parser.add_argument('--enqueue', action='store_true', help='Queue every repository to scan before claiming (with --work_queue).')
+    parser.add_argument('--node_id', type=str, help='Identifier of this node in the work queue. Defaults to <hostname>-<pid>.')
+    parser.add_argument('--lease_seconds', type=int, default=DEFAULT_LEASE_SECONDS, help='Seconds after which a repository claimed by a node that stopped sending heartbeats can be claimed again.')
+    parser.add_argument('--heartbeat_interval', type=int, default=DEFAULT_HEARTBEAT_INTERVAL, help='Seconds between two lease extensions.')
+    parser.add_argument('--max_attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Number of times a repository is claimed before it is given up.')
+    parser.add_argument('--poll_interval', type=int, default=10, help='Seconds between two claims while other nodes hold every queued repository.')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    db_config = load_db_config(args)
+    work_queue = None
+    repo_urls = []
+    if args.work_queue:
+        work_queue = WorkQueue(db_config, args.node_id, args.lease_seconds, args.heartbeat_interval, args.max_attempts)
+        if args.enqueue:
+            work_queue.enqueue()
+    else:
+        repo_urls = get_repositories_to_clone(db_config)
+        if not repo_urls:
+            logging.error("No repositories found to process.")
+            return
+
+    with profile_run(args.profile, args.metrics_path):
+        run_pipeline(repo_urls, args.clone_path, db_config, args.clone_workers, args.scan_workers, args.queue_size,
+                     args.export_batch_size, args.mode, args.cache_path, args.checkpoint_path,
+                     load_scan_config(args.config_path), args.ndjson_output_path, args.update, args.retries,
+                     work_queue, args.poll_interval, depth=args.depth, blob_filter=args.filter, sparse=args.sparse, timeout=args.timeout,
+                     no_checkout=args.no_checkout)
+
+if __name__ == "__main__":
+    main()
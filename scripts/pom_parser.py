@@ -0,0 +1,351 @@
+import os
+import re
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+# Number of parsed POMs and effective models kept, least recently used first out. Parents
+# and BOMs shared by many modules stay cached; the bound keeps long-running processes
+# from holding every POM of the estate.
+POM_CACHE_SIZE = 4096
+EFFECTIVE_CACHE_SIZE = 4096
+
+# Parsed POMs keyed by absolute path, with the mtime and size they were parsed at
+_pom_cache = OrderedDict()
+# Effective properties and managed versions keyed by absolute path and parent lookup settings,
+# with the mtime and size of every POM they were computed from (the POM itself, its parents and
+# imported BOMs) and of every path where a parent or BOM was looked up, None if it was missing
+_effective_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+PROPERTY_PATTERN = re.compile(r'\$\{([^}]+)\}')
+
+# Elements whose text is collected for a dependency
+DEPENDENCY_FIELDS = ('groupId', 'artifactId', 'version', 'scope', 'type')
+
+def local_name(tag):
+    """
+    Strip the XML namespace from a tag.
+    
+    :param tag: Tag as returned by ElementTree, e.g. '{http://maven.apache.org/POM/4.0.0}version'.
+    :return: Tag without namespace.
+    """
+    return tag.rsplit('}', 1)[-1]
+
+def read_dependency(element):
+    """
+    Read the fields of a <dependency> element.
+    
+    :param element: Dependency element.
+    :return: Dictionary with the groupId, artifactId, version, scope and type of the dependency.
+    """
+    dependency = dict.fromkeys(DEPENDENCY_FIELDS)
+    for child in element:
+        name = local_name(child.tag)
+        if name in dependency and child.text:
+            dependency[name] = child.text.strip()
+    return dependency
+
+def parse_pom_file(xml_path):
+    """
+    Parse a POM file with iterparse, clearing elements as soon as they have been read.
+    
+    :param xml_path: Path to the POM file.
+    :return: Dictionary with the coordinates, parent, properties, managed dependencies,
+             dependencies and modules of the POM.
+    """
+    pom = {
+        'path': xml_path,
+        'groupId': None,
+        'artifactId': None,
+        'version': None,
+        'parent': {},
+        'properties': {},
+        'managed': [],
+        'dependencies': [],
+        'modules': []
+    }
+    stack = []
+    for event, element in ET.iterparse(xml_path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(local_name(element.tag))
+            continue
+
+        path = stack
+        name = path[-1]
+        text = element.text.strip() if element.text else None
+        depth = len(path)
+        if depth == 2 and name in ('groupId', 'artifactId', 'version'):
+            pom[name] = text
+        elif depth == 3 and path[1] == 'parent':
+            pom['parent'][name] = text
+        elif depth == 3 and path[1] == 'properties':
+            pom['properties'][name] = text or ''
+        elif depth == 3 and path[1] == 'modules' and name == 'module':
+            pom['modules'].append(text)
+        elif name == 'dependency':
+            if 'dependencyManagement' in path:
+                pom['managed'].append(read_dependency(element))
+            else:
+                pom['dependencies'].append(read_dependency(element))
+            element.clear()
+        elif depth <= 2:
+            element.clear()
+        stack.pop()
+
+    if pom['groupId'] is None:
+        pom['groupId'] = pom['parent'].get('groupId')
+    if pom['version'] is None:
+        pom['version'] = pom['parent'].get('version')
+    return pom
+
+def file_key(path):
+    """
+    Get the mtime and size of a file, used to detect changes to cached POMs.
+    
+    :param path: Path to the file.
+    :return: Tuple of (mtime in nanoseconds, size), or None if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def cache_get(cache, key):
+    """
+    Get an entry of an LRU cache, marking it as the most recently used.
+    
+    :param cache: OrderedDict used as cache.
+    :param key: Key of the entry.
+    :return: Cached value, or None.
+    """
+    with _cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+def cache_put(cache, key, value, size):
+    """
+    Add an entry to an LRU cache, evicting the least recently used ones beyond its size.
+    
+    :param cache: OrderedDict used as cache.
+    :param key: Key of the entry.
+    :param value: Value to cache.
+    :param size: Maximum number of entries.
+    """
+    with _cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > size:
+            cache.popitem(last=False)
+
+def load_pom(xml_path):
+    """
+    Get a parsed POM, reusing the cached one if the file has not changed.
+    
+    :param xml_path: Path to the POM file.
+    :return: Parsed POM (see parse_pom_file).
+    """
+    xml_path = os.path.abspath(xml_path)
+    stat = os.stat(xml_path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = cache_get(_pom_cache, xml_path)
+    if cached and cached[0] == key:
+        return cached[1]
+    pom = parse_pom_file(xml_path)
+    cache_put(_pom_cache, xml_path, (key, pom), POM_CACHE_SIZE)
+    return pom
+
+def find_pom(group_id, artifact_id, version, repo_poms=(), local_repository=None, probed=None):
+    """
+    Find a POM by its coordinates among the POMs of the repository or in a local Maven repository.
+    
+    :param group_id: groupId of the POM.
+    :param artifact_id: artifactId of the POM.
+    :param version: Version of the POM.
+    :param repo_poms: Paths of the POM files of the repository being scanned.
+    :param local_repository: Path to a local Maven repository (e.g. ~/.m2/repository), or None.
+    :param probed: List to which the paths looked up in the local repository are appended, or None.
+    :return: Parsed POM, or None if it cannot be found.
+    """
+    for xml_path in repo_poms:
+        try:
+            pom = load_pom(xml_path)
+        except ET.ParseError:
+            continue
+        if (pom['groupId'], pom['artifactId'], pom['version']) == (group_id, artifact_id, version):
+            return pom
+    if not (local_repository and group_id and artifact_id and version):
+        return None
+    xml_path = os.path.join(os.path.expanduser(local_repository), *group_id.split('.'),
+                            artifact_id, version, f"{artifact_id}-{version}.pom")
+    if probed is not None:
+        probed.append(os.path.abspath(xml_path))
+    if os.path.exists(xml_path):
+        return load_pom(xml_path)
+    return None
+
+def find_parent(pom, repo_poms=(), local_repository=None, probed=None):
+    """
+    Find the parent of a POM, first through its relativePath and then by its coordinates.
+    
+    :param pom: Parsed POM.
+    :param repo_poms: Paths of the POM files of the repository being scanned.
+    :param local_repository: Path to a local Maven repository, or None.
+    :param probed: List to which the paths where the parent is looked up are appended, or None.
+    :return: Parsed parent POM, or None if the POM has no parent or it cannot be found.
+    """
+    parent = pom['parent']
+    if not parent.get('artifactId'):
+        return None
+    relative_path = parent.get('relativePath', '../pom.xml')
+    if relative_path:
+        parent_path = os.path.join(os.path.dirname(pom['path']), relative_path)
+        if os.path.isdir(parent_path):
+            parent_path = os.path.join(parent_path, 'pom.xml')
+        if probed is not None:
+            probed.append(os.path.abspath(parent_path))
+        if os.path.isfile(parent_path):
+            try:
+                candidate = load_pom(parent_path)
+                if candidate['artifactId'] == parent['artifactId']:
+                    return candidate
+            except ET.ParseError as e:
+                logging.warning(f"Error parsing parent POM {parent_path}: {e}")
+    return find_pom(parent.get('groupId'), parent['artifactId'], parent.get('version'), repo_poms, local_repository,
+                    probed)
+
+def interpolate(value, properties):
+    """
+    Replace ${property} references in a value, following references between properties.
+    
+    :param value: Value that may contain property references.
+    :param properties: Dictionary of properties.
+    :return: Value with every known property replaced; unknown references are left as they are.
+    """
+    for _ in range(10):
+        if not value or '${' not in value:
+            break
+        resolved = PROPERTY_PATTERN.sub(lambda match: properties.get(match.group(1)) or match.group(0), value)
+        if resolved == value:
+            break
+        value = resolved
+    return value
+
+def effective_model(pom, repo_poms=(), local_repository=None):
+    """
+    Compute the effective properties and managed dependency versions of a POM,
+    inheriting from its parents and importing BOMs.
+    
+    :param pom: Parsed POM.
+    :param repo_poms: Paths of the POM files of the repository being scanned.
+    :param local_repository: Path to a local Maven repository, or None.
+    :return: Tuple of (properties, managed versions keyed by (groupId, artifactId)). Managed versions
+             inherited from parents are not interpolated, since Maven resolves them with the
+             properties of the child, which override those of its parents.
+    """
+    _, properties, managed = resolve_model(pom, repo_poms, local_repository)
+    return properties, managed
+
+def resolve_model(pom, repo_poms=(), local_repository=None, seen=None):
+    """
+    Compute the effective model of a POM (see effective_model), reusing the cached one
+    unless the POM, one of its parents or one of its imported BOMs changed, or a parent or BOM
+    appeared where it was looked up.
+    
+    :param pom: Parsed POM.
+    :param repo_poms: Paths of the POM files of the repository being scanned.
+    :param local_repository: Path to a local Maven repository, or None.
+    :param seen: Paths already being resolved, used to break cycles.
+    :return: Tuple of (sources, properties, managed versions), where sources is a tuple of
+             (path, file_key) of every POM the model was computed from and every path looked up.
+    """
+    path = os.path.abspath(pom['path'])
+    # Parents and BOMs found by coordinates depend on the POMs of the repository and the local repository
+    cache_key = (path, tuple(repo_poms), local_repository)
+    cached = cache_get(_effective_cache, cache_key)
+    if cached is not None and all(file_key(source) == key for source, key in cached[0]):
+        return cached
+    seen = (seen or set()) | {path}
+
+    sources = [(path, file_key(path))]
+    probed = []
+    properties = {}
+    managed = {}
+    parent = find_parent(pom, repo_poms, local_repository, probed)
+    if parent is not None and os.path.abspath(parent['path']) not in seen:
+        parent_sources, parent_properties, parent_managed = resolve_model(parent, repo_poms, local_repository, seen)
+        sources.extend(parent_sources)
+        properties.update(parent_properties)
+        managed.update(parent_managed)
+        properties['project.parent.version'] = parent['version']
+        properties['project.parent.groupId'] = parent['groupId']
+
+    properties.update(pom['properties'])
+    for key in ('groupId', 'artifactId', 'version'):
+        if pom[key] is not None:
+            properties[f'project.{key}'] = pom[key]
+            properties[f'pom.{key}'] = pom[key]
+    if pom['version'] is not None:
+        properties['version'] = pom['version']
+
+    own_managed = {}
+    for dependency in pom['managed']:
+        group_id = interpolate(dependency['groupId'], properties)
+        artifact_id = interpolate(dependency['artifactId'], properties)
+        version = interpolate(dependency['version'], properties)
+        if dependency['scope'] == 'import' and dependency['type'] == 'pom':
+            bom = find_pom(group_id, artifact_id, version, repo_poms, local_repository, probed)
+            if bom is None:
+                logging.debug(f"BOM {group_id}:{artifact_id}:{version} not found")
+            elif os.path.abspath(bom['path']) not in seen:
+                bom_sources, bom_properties, bom_managed = resolve_model(bom, repo_poms, local_repository, seen)
+                sources.extend(bom_sources)
+                # Imported versions are resolved with the properties of the BOM, not those of the importer
+                for key, bom_version in bom_managed.items():
+                    managed.setdefault(key, interpolate(bom_version, bom_properties))
+            continue
+        own_managed[(group_id, artifact_id)] = dependency['version']
+    managed.update(own_managed)
+    sources.extend((probed_path, file_key(probed_path)) for probed_path in probed)
+
+    model = (tuple(dict.fromkeys(sources)), properties, managed)
+    cache_put(_effective_cache, cache_key, model, EFFECTIVE_CACHE_SIZE)
+    return model
+
+def parse_dependencies(xml_path, repo_poms=(), local_repository=None):
+    """
+    Parse the dependencies of a POM, resolving their versions from properties,
+    dependencyManagement sections, parent POMs and imported BOMs.
+    
+    Parents and BOMs are looked up by relativePath, then by coordinates among the POMs
+    of the same repository and finally in the local Maven repository.
+    
+    :param xml_path: Path to the POM file.
+    :param repo_poms: Paths of the POM files of the repository being scanned.
+    :param local_repository: Path to a local Maven repository used to find parents and BOMs, or None.
+    :return: List of dictionaries with the groupId, artifactId and version of each dependency.
+             The version is left unresolved (e.g. '${spark.version}') when it cannot be resolved,
+             and is None when it is not declared anywhere.
+    """
+    pom = load_pom(xml_path)
+    properties, managed = effective_model(pom, repo_poms, local_repository)
+    dependencies = []
+    for dependency in pom['managed'] + pom['dependencies']:
+        if dependency['scope'] == 'import':
+            continue
+        group_id = interpolate(dependency['groupId'], properties)
+        artifact_id = interpolate(dependency['artifactId'], properties)
+        if not group_id or not artifact_id:
+            continue
+        # Managed versions are interpolated with the properties of this POM, which override its parents'
+        version = interpolate(dependency['version'] or managed.get((group_id, artifact_id)), properties)
+        dependencies.append({
+            'groupId': group_id,
+            'artifactId': artifact_id,
+            'version': version
+        })
+    return dependencies
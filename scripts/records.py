@@ -0,0 +1,188 @@
+import sys
+import json
+import hashlib
+
+# Dependency records by coordinates, so each distinct dependency is held once per process
+_DEPENDENCIES = {}
+
+def intern_string(value):
+    """
+    Intern a string so equal values share a single object.
+    
+    :param value: String or None.
+    :return: The interned string, or None.
+    """
+    return sys.intern(value) if isinstance(value, str) else value
+
+def content_hash(value):
+    """
+    Compute a stable SHA-1 hash of a JSON-serializable value.
+    
+    :param value: Value to hash.
+    :return: Hex digest of the value serialized with sorted keys.
+    """
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def dependency(group_id, artifact_id, version):
+    """
+    Get the record of a dependency, creating it the first time its coordinates are seen.
+    
+    :param group_id: groupId of the dependency.
+    :param artifact_id: artifactId of the dependency.
+    :param version: Version of the dependency, unresolved (e.g. '${spark.version}') or None.
+    :return: Shared Dependency record.
+    """
+    key = (group_id, artifact_id, version)
+    record = _DEPENDENCIES.get(key)
+    if record is None:
+        record = _DEPENDENCIES.setdefault(key, Dependency(group_id, artifact_id, version))
+    return record
+
+class Dependency:
+    """
+    Maven coordinates of a dependency found in a POM file.
+    
+    Records are immutable and interned: use dependency() to get them, so the thousands of
+    repositories depending on the same artifact share one record and one copy of each string.
+    """
+    __slots__ = ('group_id', 'artifact_id', 'version')
+
+    def __init__(self, group_id, artifact_id, version):
+        """
+        Create a dependency record (see dependency()).
+        
+        :param group_id: groupId of the dependency.
+        :param artifact_id: artifactId of the dependency.
+        :param version: Version of the dependency, or None.
+        """
+        self.group_id = intern_string(group_id)
+        self.artifact_id = intern_string(artifact_id)
+        self.version = intern_string(version)
+
+    @classmethod
+    def from_json(cls, value):
+        """
+        Get the record of a dependency from its JSON form.
+        
+        :param value: Dictionary with the groupId, artifactId and version, or a Dependency.
+        :return: Shared Dependency record.
+        """
+        if isinstance(value, cls):
+            return value
+        return dependency(value['groupId'], value['artifactId'], value.get('version'))
+
+    def to_json(self):
+        """
+        Convert the record to the JSON form written by the scanner.
+        
+        :return: Dictionary with the groupId, artifactId and version.
+        """
+        return {'groupId': self.group_id, 'artifactId': self.artifact_id, 'version': self.version}
+
+    def key(self):
+        """
+        Get the coordinates of the dependency.
+        
+        :return: Tuple of (groupId, artifactId, version).
+        """
+        return (self.group_id, self.artifact_id, self.version)
+
+    def __eq__(self, other):
+        return isinstance(other, Dependency) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __reduce__(self):
+        # Unpickled records (e.g. sent back by worker processes) are interned again
+        return dependency, self.key()
+
+    def __repr__(self):
+        return f"Dependency({self.group_id!r}, {self.artifact_id!r}, {self.version!r})"
+
+class ScanResult:
+    """
+    Scan results of a repository: its YAML configs, POM dependencies and requirements.
+    
+    Dependencies are a tuple of shared Dependency records and requirements a tuple of
+    interned strings, or None when the repository has no requirements file. The JSON form
+    (see to_json) is the one written by the scanner and read by the other scripts.
+    """
+    __slots__ = ('yaml_configs', 'dependencies', 'requirements')
+
+    def __init__(self, yaml_configs=None, dependencies=(), requirements=None):
+        """
+        Create the scan results of a repository.
+        
+        :param yaml_configs: Dictionary mapping repo-relative YAML paths to their parsed contents.
+        :param dependencies: Iterable of Dependency records or their JSON form.
+        :param requirements: Iterable of requirement strings, or None.
+        """
+        self.yaml_configs = yaml_configs or {}
+        self.dependencies = tuple(Dependency.from_json(dep) for dep in dependencies)
+        self.requirements = None if requirements is None else tuple(intern_string(req) for req in requirements)
+
+    @classmethod
+    def from_json(cls, value):
+        """
+        Build the scan results of a repository from their JSON form.
+        
+        :param value: Dictionary written by the scanner, a ScanResult, or None.
+        :return: ScanResult, or None.
+        """
+        if value is None or isinstance(value, cls):
+            return value
+        return cls(value.get('yaml_configs'), value.get('dependencies', ()), value.get('requirements'))
+
+    def to_json(self):
+        """
+        Convert the scan results to the JSON form written by the scanner. The conversion is
+        lossless: from_json(result.to_json()) == result.
+        
+        :return: Dictionary with the yaml_configs and dependencies, and the requirements if any.
+        """
+        value = {
+            'yaml_configs': self.yaml_configs,
+            'dependencies': [dep.to_json() for dep in self.dependencies]
+        }
+        if self.requirements is not None:
+            value['requirements'] = list(self.requirements)
+        return value
+
+    def content_hash(self):
+        """
+        Hash the JSON form of the scan results, used to detect repositories whose results changed.
+        
+        :return: Hex digest (see content_hash).
+        """
+        return content_hash(self.to_json())
+
+    def is_empty(self):
+        """
+        Check whether nothing was found in the repository, in which case it is left out of the results.
+        
+        :return: True if nothing was found in the repository.
+        """
+        return not (self.yaml_configs or self.dependencies or self.requirements is not None)
+
+    def __eq__(self, other):
+        return (isinstance(other, ScanResult) and self.yaml_configs == other.yaml_configs
+                and self.dependencies == other.dependencies and self.requirements == other.requirements)
+
+    def __reduce__(self):
+        return ScanResult, (self.yaml_configs, self.dependencies, self.requirements)
+
+    def __repr__(self):
+        return (f"ScanResult({len(self.yaml_configs)} YAML configs, {len(self.dependencies)} dependencies, "
+                f"{'no' if self.requirements is None else len(self.requirements)} requirements)")
+
+def to_json(value):
+    """
+    Convert records to their JSON form. Used as the default function of json.dump.
+    
+    :param value: Dependency or ScanResult.
+    :return: JSON-serializable form of the record.
+    """
+    if isinstance(value, (Dependency, ScanResult)):
+        return value.to_json()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,112 @@
+import os
+import shutil
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where reflinks are never attempted
+    fcntl = None
+
+# Linux ioctl cloning a whole file into another one (Btrfs, XFS, bcachefs...)
+FICLONE = 0x40049409
+
+COPY_MODES = ('copy', 'hardlink', 'reflink')
+
+# Devices where reflinks or hardlinks have already failed, so they are not attempted again
+_no_reflink_devices = set()
+_no_hardlink_devices = set()
+
+def reflink(src_path, dst_path):
+    """
+    Create a copy-on-write clone of a file.
+    
+    :param src_path: Path to the source file.
+    :param dst_path: Path to the new file, which must not exist.
+    :return: True if the file was cloned, False if the filesystem does not support it.
+    """
+    if fcntl is None:
+        return False
+    with open(src_path, 'rb') as src:
+        try:
+            with open(dst_path, 'xb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            if os.path.exists(dst_path):
+                os.remove(dst_path)
+            return False
+    shutil.copystat(src_path, dst_path)
+    return True
+
+def duplicate_file(src_path, dst_path, mode, device):
+    """
+    Duplicate a file with the cheapest method allowed by the mode, falling back to a real copy.
+    
+    :param src_path: Path to the source file.
+    :param dst_path: Path to the new file.
+    :param mode: 'reflink', 'hardlink' or 'copy' (see copy_tree).
+    :param device: Device of the source tree, used to remember unsupported methods.
+    :return: Method actually used.
+    """
+    if mode == 'reflink' and device not in _no_reflink_devices:
+        if reflink(src_path, dst_path):
+            return 'reflink'
+        logging.info(f"Reflinks not supported for {src_path}, falling back to hardlinks")
+        _no_reflink_devices.add(device)
+    if mode in ('reflink', 'hardlink') and device not in _no_hardlink_devices:
+        try:
+            os.link(src_path, dst_path)
+            return 'hardlink'
+        except OSError as e:
+            logging.info(f"Hardlinks not supported for {src_path} ({e}), falling back to copies")
+            _no_hardlink_devices.add(device)
+    shutil.copy2(src_path, dst_path)
+    return 'copy'
+
+def copy_tree(src_path, dst_path, mode='copy'):
+    """
+    Duplicate a directory tree, sharing the file contents with the original where possible.
+    
+    In 'reflink' mode files are cloned copy-on-write when the filesystem supports it and
+    hardlinked otherwise; in 'hardlink' mode they are hardlinked. Both fall back to real
+    copies (e.g. across devices). Hardlinked files share their contents with the original,
+    so they must go through materialize before being modified in place.
+    
+    :param src_path: Path to the directory to duplicate.
+    :param dst_path: Path to the new directory, which must not exist.
+    :param mode: 'reflink', 'hardlink' or 'copy'.
+    :return: Dictionary with the number of files duplicated with each method.
+    """
+    if mode not in COPY_MODES:
+        raise ValueError(f"Unknown copy mode: {mode}")
+    device = os.stat(src_path).st_dev
+    counts = dict.fromkeys(COPY_MODES, 0)
+    os.makedirs(dst_path)
+    shutil.copystat(src_path, dst_path)
+    stack = [(src_path, dst_path)]
+    while stack:
+        src_dir, dst_dir = stack.pop()
+        with os.scandir(src_dir) as iterator:
+            for entry in iterator:
+                target = os.path.join(dst_dir, entry.name)
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), target)
+                elif entry.is_dir():
+                    os.mkdir(target)
+                    shutil.copystat(entry.path, target)
+                    stack.append((entry.path, target))
+                else:
+                    counts[duplicate_file(entry.path, target, mode, device)] += 1
+    return counts
+
+def materialize(file_path):
+    """
+    Make sure a file of a duplicated tree can be modified without touching the original,
+    replacing it with a real copy if it is a hardlink.
+    
+    :param file_path: Path to the file about to be modified.
+    """
+    if os.stat(file_path).st_nlink > 1:
+        tmp_path = f"{file_path}.tmp"
+        shutil.copy2(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
@@ -0,0 +1,99 @@
+import json
+import logging
+from db import cursor
+
+# Files read by scanner.py, used to limit sparse checkouts
+SPARSE_CHECKOUT_PATTERNS = ['*.yaml', '*.yml', 'pom.xml', 'requirements.txt', 'setup.cfg', 'pyproject.toml']
+
+def repo_name(repo_url):
+    """
+    Get the name of the directory a repository is cloned into.
+    
+    :param repo_url: URL of the repository.
+    :return: Last component of the URL without the '.git' suffix.
+    """
+    return repo_url.split('/')[-1].replace('.git', '')
+
+def unique_repo_urls(repo_urls):
+    """
+    Drop the repositories that would be cloned into the same directory as an earlier one,
+    e.g. repositories with the same name in two organizations.
+    
+    :param repo_urls: List of repository URLs.
+    :return: List of URLs with one repository per name, in the original order.
+    """
+    urls = {}
+    for repo_url in repo_urls:
+        name = repo_name(repo_url)
+        if name in urls:
+            logging.error(f"Skipping {repo_url}: {urls[name]} is cloned into the same directory '{name}'")
+        else:
+            urls[name] = repo_url
+    return list(urls.values())
+
+def build_clone_options(depth=None, blob_filter=None, sparse=False, no_checkout=False):
+    """
+    Build the git clone options for the given settings (see clone_repos.clone_repo).
+    
+    :param depth: Number of commits to fetch, or None for the full history.
+    :param blob_filter: Partial clone filter, or None.
+    :param sparse: Whether to prepare a sparse checkout.
+    :param no_checkout: Whether to skip the working tree entirely.
+    :return: List of command line options.
+    """
+    options = []
+    if depth:
+        options.append(f'--depth={depth}')
+    if blob_filter:
+        options.append(f'--filter={blob_filter}')
+    if no_checkout:
+        options.append('--no-checkout')
+    elif sparse:
+        options.append('--sparse')
+    return options
+
+def log_clone_summary(results):
+    """
+    Log how many repositories ended in each status and which ones failed.
+    
+    :param results: Dictionary mapping repository names to the results of sync_repo.
+    """
+    counts = {}
+    for result in results.values():
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    logging.info("Repositories: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    failed = [result['url'] for result in results.values() if result['status'] == 'failed']
+    if failed:
+        logging.error(f"Failed to process {len(failed)} repositories: {', '.join(failed)}")
+
+def write_heads_report(results, output_path):
+    """
+    Write the status and old and new HEAD of every repository to a JSON file.
+    
+    :param results: Dictionary returned by clone_repos.clone_repositories.
+    :param output_path: Path to the output JSON file.
+    """
+    logging.info(f"Writing HEAD report to JSON file: {output_path}")
+    report = {}
+    for repo_name, result in sorted(results.items()):
+        report[repo_name] = dict(result, changed=result['old_head'] != result['new_head'])
+    with open(output_path, 'w') as file:
+        json.dump(report, file, indent=4)
+
+def get_repositories_to_clone(db_config):
+    """
+    Get the list of repositories to clone from the database.
+    
+    :param db_config: Database configuration dictionary.
+    :return: List of repository URLs to clone.
+    """
+    query = f"""
+    SELECT r.link
+    FROM my_schema.organizations o
+    JOIN my_schema.repositories r ON o.id = r.organization_id
+    WHERE o.scan = TRUE AND r.scan = TRUE;
+    """
+    with cursor(db_config) as cur:
+        cur.execute(query)
+        repo_urls = [row[0] for row in cur.fetchall()]
+    return repo_urls
@@ -0,0 +1,170 @@
+import os
+import re
+import logging
+import configparser
+from functools import lru_cache
+from packaging.requirements import Requirement, InvalidRequirement
+from packaging.utils import canonicalize_name
+from versions import PARSE_CACHE_SIZE
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+# Comments start at a '#' at the beginning of a line or after whitespace, as in pip
+COMMENT = re.compile(r'(^|\s+)#.*$')
+INCLUDE_OPTION = re.compile(r'^(?:-r|--requirement)(?:\s*=\s*|\s+|(?=[^\s-]))(?P<path>\S+)')
+# Options that may follow a requirement on the same line, e.g. '--hash=sha256:...'
+TRAILING_OPTIONS = re.compile(r'\s+--?[A-Za-z].*$')
+POETRY_CONSTRAINT = re.compile(r'^(?P<operator>[\^~])\s*(?P<version>\d+(?:\.\d+)*)$')
+
+def normalize_name(name):
+    """
+    Normalize a Python package name (PEP 503), e.g. 'PySpark' -> 'pyspark'.
+    
+    :param name: Package name.
+    :return: Normalized name.
+    """
+    return canonicalize_name(name)
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_requirement(requirement):
+    """
+    Parse a requirement (PEP 508) into its normalized parts.
+    
+    :param requirement: Requirement, e.g. 'PySpark[sql]>=3.3,<3.5; python_version >= "3.8"'.
+    :return: Tuple of (normalized name, specifier, extras, marker), e.g.
+             ('pyspark', '<3.5,>=3.3', ('sql',), 'python_version >= "3.8"'), or None if it is not
+             a valid requirement. The specifier is '' when any version is accepted.
+    """
+    try:
+        parsed = Requirement(requirement)
+    except InvalidRequirement:
+        return None
+    return (normalize_name(parsed.name), str(parsed.specifier), tuple(sorted(parsed.extras)),
+            str(parsed.marker) if parsed.marker else None)
+
+def logical_lines(text):
+    """
+    Split a requirements file into its logical lines, joining continuations and dropping
+    comments and blank lines.
+    
+    :param text: Requirements file content.
+    :return: Generator of stripped lines.
+    """
+    for line in re.sub(r'\\\r?\n', '', text).splitlines():
+        line = COMMENT.sub('', line).strip()
+        if line:
+            yield line
+
+def read_requirements(req_path, seen=None):
+    """
+    Read the requirements of a requirements file, following '-r' includes.
+    
+    Other options (constraints, index URLs, editable installs...) are skipped, as are the
+    options following a requirement on the same line (e.g. '--hash').
+    
+    :param req_path: Path to the requirements file.
+    :param seen: Set of the real paths already read, used to stop include cycles.
+    :return: List of requirements as written, without comments.
+    """
+    seen = set() if seen is None else seen
+    real_path = os.path.realpath(req_path)
+    if real_path in seen:
+        return []
+    seen.add(real_path)
+    with open(req_path, 'r', encoding='utf-8', errors='replace') as file:
+        text = file.read()
+
+    requirements = []
+    for line in logical_lines(text):
+        if line.startswith('-'):
+            include = INCLUDE_OPTION.match(line)
+            if include is None:
+                continue
+            include_path = os.path.join(os.path.dirname(req_path), include.group('path'))
+            if os.path.isfile(include_path):
+                requirements.extend(read_requirements(include_path, seen))
+            else:
+                logging.warning(f"Requirements file {include_path} included from {req_path} not found")
+            continue
+        requirements.append(TRAILING_OPTIONS.sub('', line))
+    return requirements
+
+def read_setup_cfg(cfg_path):
+    """
+    Read the install_requires and extras_require requirements of a setup.cfg file.
+    
+    :param cfg_path: Path to the setup.cfg file.
+    :return: List of requirements.
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.read(cfg_path, encoding='utf-8')
+    values = []
+    if config.has_option('options', 'install_requires'):
+        values.append(config.get('options', 'install_requires'))
+    if config.has_section('options.extras_require'):
+        values.extend(value for _, value in config.items('options.extras_require'))
+    return [line for value in values for line in logical_lines(value)]
+
+def poetry_requirement(name, constraint):
+    """
+    Translate a Poetry dependency into a requirement.
+    
+    Caret (^1.2) and tilde (~1.2) constraints become PEP 440 ranges; other constraints are
+    kept as they are.
+    
+    :param name: Package name.
+    :param constraint: Version constraint, or a table with a 'version' key (git and path
+                       dependencies have none).
+    :return: Requirement, e.g. 'requests>=2.28,<3.0'.
+    """
+    if isinstance(constraint, list):
+        constraint = constraint[0] if constraint else None
+    if isinstance(constraint, dict):
+        constraint = constraint.get('version')
+    constraint = (constraint or '').strip()
+    if constraint in ('', '*'):
+        return name
+    match = POETRY_CONSTRAINT.match(constraint)
+    if match is None:
+        return f"{name}=={constraint}" if constraint[0].isdigit() else f"{name}{constraint.replace(' ', '')}"
+    parts = [int(part) for part in match.group('version').split('.')]
+    if match.group('operator') == '^':
+        position = next((index for index, part in enumerate(parts) if part), len(parts) - 1)
+    else:
+        position = min(1, len(parts) - 1)
+    upper = parts[:position] + [parts[position] + 1]
+    return f"{name}>={match.group('version')},<{'.'.join(map(str, upper))}"
+
+def read_pyproject(toml_path):
+    """
+    Read the requirements of a pyproject.toml file: its [project] dependencies and
+    optional-dependencies, and its Poetry dependency tables.
+    
+    :param toml_path: Path to the pyproject.toml file.
+    :return: List of requirements.
+    """
+    if tomllib is None:
+        logging.warning(f"Skipping {toml_path}: reading pyproject.toml files needs Python 3.11 or tomli")
+        return []
+    with open(toml_path, 'rb') as file:
+        pyproject = tomllib.load(file)
+
+    project = pyproject.get('project') or {}
+    requirements = list(project.get('dependencies') or [])
+    for extra in (project.get('optional-dependencies') or {}).values():
+        requirements.extend(extra)
+
+    poetry = (pyproject.get('tool') or {}).get('poetry') or {}
+    tables = [poetry.get('dependencies'), poetry.get('dev-dependencies')]
+    tables += [group.get('dependencies') for group in (poetry.get('group') or {}).values()]
+    for table in tables:
+        for name, constraint in (table or {}).items():
+            if name.lower() != 'python':
+                requirements.append(poetry_requirement(name, constraint))
+    return requirements
@@ -0,0 +1,146 @@
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+from datetime import datetime
+from records import to_json
+
+def read_git_head(repo_path):
+    """
+    Read the commit the repository HEAD points to without invoking git.
+    
+    :param repo_path: Path to the repository working tree.
+    :return: Commit SHA as a string, or None if the path is not a git repository.
+    """
+    git_dir = os.path.join(repo_path, '.git')
+    try:
+        if os.path.isfile(git_dir):
+            # Worktrees and submodules use a .git file pointing to the real git dir
+            with open(git_dir, 'r') as file:
+                content = file.read().strip()
+            if not content.startswith('gitdir:'):
+                return None
+            git_dir = os.path.join(repo_path, content[len('gitdir:'):].strip())
+        with open(os.path.join(git_dir, 'HEAD'), 'r') as file:
+            head = file.read().strip()
+    except OSError:
+        return None
+
+    if not head.startswith('ref:'):
+        return head
+    ref = head[len('ref:'):].strip()
+    try:
+        with open(os.path.join(git_dir, ref), 'r') as file:
+            return file.read().strip()
+    except OSError:
+        pass
+    try:
+        with open(os.path.join(git_dir, 'packed-refs'), 'r') as file:
+            for line in file:
+                parts = line.strip().split(' ')
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except OSError:
+        pass
+    return None
+
+def file_digest(file_path):
+    """
+    Compute the SHA-1 digest of a file's contents.
+    
+    :param file_path: Path to the file.
+    :return: Hex digest of the file contents.
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def encode_state_value(value):
+    """
+    Convert a value of a scan state that json cannot serialize by itself.
+    
+    :param value: Scan record (see records.py) or any other value, e.g. a date read from a YAML file.
+    :return: JSON form of the record, or the value as a string.
+    """
+    try:
+        return to_json(value)
+    except TypeError:
+        return str(value)
+
+class ScanCache:
+    """
+    Persistent scan state stored in a local SQLite database.
+    
+    Each repository has one row holding the HEAD commit it was scanned at and,
+    for every manifest file, its mtime, size, content hash and parsed result.
+    """
+
+    def __init__(self, cache_path, shared=False):
+        """
+        Open (and create if needed) the cache database.
+        
+        :param cache_path: Path to the SQLite cache file.
+        :param shared: Whether the cache is used from several threads, which must then
+                       serialize their calls (e.g. with a lock).
+        """
+        logging.info(f"Opening scan cache: {cache_path}")
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.conn = sqlite3.connect(cache_path, check_same_thread=not shared)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS scan_state (
+                repo TEXT PRIMARY KEY,
+                head TEXT,
+                state TEXT NOT NULL,
+                scanned_at TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, repo):
+        """
+        Get the stored scan state of a repository.
+        
+        :param repo: Name of the repository.
+        :return: State dictionary, or None if the repository has not been scanned before.
+        """
+        row = self.conn.execute("SELECT state FROM scan_state WHERE repo = ?", (repo,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, repo, state):
+        """
+        Store the scan state of a repository.
+        
+        :param repo: Name of the repository.
+        :param state: State dictionary returned by the scanner.
+        """
+        self.conn.execute("""
+            INSERT OR REPLACE INTO scan_state (repo, head, state, scanned_at)
+            VALUES (?, ?, ?, ?)
+        """, (repo, state.get('head'), json.dumps(state, default=encode_state_value), datetime.now().isoformat()))
+
+    def prune(self, repos):
+        """
+        Remove the state of repositories that no longer exist.
+        
+        :param repos: Names of the repositories that are still present.
+        """
+        repos = set(repos)
+        existing = [row[0] for row in self.conn.execute("SELECT repo FROM scan_state")]
+        stale = [(repo,) for repo in existing if repo not in repos]
+        if stale:
+            logging.info(f"Removing {len(stale)} stale repositories from scan cache")
+            self.conn.executemany("DELETE FROM scan_state WHERE repo = ?", stale)
+
+    def close(self):
+        """
+        Commit pending changes and close the cache database.
+        """
+        self.conn.commit()
+        self.conn.close()
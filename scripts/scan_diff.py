@@ -0,0 +1,320 @@
+import json
+import logging
+import argparse
+from psycopg2.extras import execute_values
+from db import add_db_arguments, load_db_config, connection, cursor
+from scan_results import read_scan_results
+from snapshot import Snapshot, is_snapshot
+from records import ScanResult
+from requirements_parser import parse_requirement
+from export_to_db import fetch_repositories
+
+# Number of repositories whose scan results are loaded from the database in each query
+LOAD_BATCH_SIZE = 500
+
+def yaml_leaves(content, prefix=''):
+    """
+    Flatten a YAML document into its leaf values by dotted key path. Lists are compared
+    as a whole, so they are leaves as well.
+    
+    :param content: Parsed YAML content.
+    :param prefix: Path of the content within the document.
+    :return: Dictionary mapping key paths (e.g. 'spark.version') to values.
+    """
+    if not isinstance(content, dict):
+        return {prefix: content}
+    leaves = {}
+    for key, value in content.items():
+        leaves.update(yaml_leaves(value, f"{prefix}.{key}" if prefix else str(key)))
+    return leaves
+
+def group_dependencies(repo_data):
+    """
+    Group the dependencies of a repository by artifact.
+    
+    :param repo_data: ScanResult of the repository.
+    :return: Dictionary mapping 'groupId:artifactId' to the sorted list of versions in use.
+    """
+    versions = {}
+    for dep in repo_data.dependencies:
+        versions.setdefault(f"{dep.group_id}:{dep.artifact_id}", set()).add(dep.version)
+    return {artifact: sorted(values, key=str) for artifact, values in versions.items()}
+
+def group_requirements(repo_data):
+    """
+    Group the requirements of a repository by normalized package name. Requirements that
+    cannot be parsed are grouped under their own text.
+    
+    :param repo_data: ScanResult of the repository.
+    :return: Dictionary mapping package names to the sorted list of their requirements.
+    """
+    requirements = {}
+    for requirement in repo_data.requirements or ():
+        parsed = parse_requirement(requirement)
+        requirements.setdefault(parsed[0] if parsed else requirement, set()).add(requirement)
+    return {name: sorted(values) for name, values in requirements.items()}
+
+def diff_groups(old, new, key_name):
+    """
+    Compare two groupings (see group_dependencies and group_requirements).
+    
+    :param old: Old dictionary of key -> list of values.
+    :param new: New dictionary of key -> list of values.
+    :param key_name: Name of the key in the entries, e.g. 'artifact'.
+    :return: Dictionary with the 'added' and 'removed' entries ({key_name, 'values'}) and the
+             'changed' entries ({key_name, 'old', 'new'}), sorted by key; empty lists are left out.
+    """
+    changes = {
+        'added': [{key_name: key, 'values': new[key]} for key in new.keys() - old.keys()],
+        'removed': [{key_name: key, 'values': old[key]} for key in old.keys() - new.keys()],
+        'changed': [{key_name: key, 'old': old[key], 'new': new[key]}
+                    for key in old.keys() & new.keys() if old[key] != new[key]]
+    }
+    return {kind: sorted(entries, key=lambda entry: str(entry[key_name]))
+            for kind, entries in changes.items() if entries}
+
+def diff_yaml(old_configs, new_configs):
+    """
+    Compare the YAML configs of a repository key by key.
+    
+    :param old_configs: Old dictionary of YAML path -> parsed content.
+    :param new_configs: New dictionary of YAML path -> parsed content.
+    :return: Dictionary with the 'added', 'removed' ({'file', 'key', 'value'}) and 'changed'
+             ({'file', 'key', 'old', 'new'}) keys; empty lists are left out.
+    """
+    changes = {'added': [], 'removed': [], 'changed': []}
+    for yaml_file in sorted(old_configs.keys() | new_configs.keys()):
+        old_content = old_configs.get(yaml_file)
+        new_content = new_configs.get(yaml_file)
+        if old_content == new_content:
+            continue
+        old_leaves = yaml_leaves(old_content) if yaml_file in old_configs else {}
+        new_leaves = yaml_leaves(new_content) if yaml_file in new_configs else {}
+        for key in sorted(new_leaves.keys() - old_leaves.keys()):
+            changes['added'].append({'file': yaml_file, 'key': key, 'value': new_leaves[key]})
+        for key in sorted(old_leaves.keys() - new_leaves.keys()):
+            changes['removed'].append({'file': yaml_file, 'key': key, 'value': old_leaves[key]})
+        for key in sorted(old_leaves.keys() & new_leaves.keys()):
+            if old_leaves[key] != new_leaves[key]:
+                changes['changed'].append({'file': yaml_file, 'key': key, 'old': old_leaves[key], 'new': new_leaves[key]})
+    return {kind: values for kind, values in changes.items() if values}
+
+def diff_repository(old_data, new_data):
+    """
+    Compare the scan results of a repository in two scans.
+    
+    :param old_data: Old ScanResult, or None if the repository is new.
+    :param new_data: New ScanResult, or None if the repository was removed.
+    :return: Dictionary with the changes of the 'dependencies', 'requirements' and 'yaml'
+             keys that changed (see diff_groups and diff_yaml).
+    """
+    old_data = old_data or ScanResult()
+    new_data = new_data or ScanResult()
+    changes = {
+        'dependencies': diff_groups(group_dependencies(old_data), group_dependencies(new_data), 'artifact'),
+        'requirements': diff_groups(group_requirements(old_data), group_requirements(new_data), 'name'),
+        'yaml': diff_yaml(old_data.yaml_configs, new_data.yaml_configs)
+    }
+    return {kind: values for kind, values in changes.items() if values}
+
+def file_source(path):
+    """
+    Open the scan results of a file as a diff source.
+    
+    Snapshots store the content hash of every repository, so only the records of the
+    repositories that changed are read. Other formats are read entirely and hashed.
+    
+    :param path: Path to a JSON, JSON Lines or snapshot file.
+    :return: Tuple of (dictionary of repository -> content hash, function loading the
+             ScanResults of a list of repositories as a dictionary).
+    """
+    if is_snapshot(path):
+        snapshot = Snapshot(path)
+        return snapshot.hashes(), lambda repos: {repo: snapshot.get(repo) for repo in repos}
+    results = dict(read_scan_results(path))
+    return {repo: repo_data.content_hash() for repo, repo_data in results.items()}, \
+        lambda repos: {repo: results[repo] for repo in repos}
+
+def resolve_generation(cur, generation):
+    """
+    Resolve a generation reference to its ID.
+    
+    :param cur: Database cursor.
+    :param generation: ID of the generation, or 'latest'.
+    :return: ID of the generation.
+    """
+    if generation != 'latest':
+        return int(generation)
+    cur.execute("SELECT max(id) FROM my_schema.scan_generations")
+    generation_id = cur.fetchone()[0]
+    if generation_id is None:
+        raise ValueError("No scan generation has been recorded yet")
+    return generation_id
+
+def generation_source(db_config, generation_id):
+    """
+    Open a scan generation recorded in the database as a diff source.
+    
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :param generation_id: ID of the generation.
+    :return: Tuple of (dictionary of repository -> content hash, function loading the
+             ScanResults of a list of repositories as a dictionary).
+    """
+    with cursor(db_config) as cur:
+        cur.execute("""
+            SELECT r.name, h.content_hash FROM my_schema.scan_history h
+            JOIN my_schema.repositories r ON r.id = h.repository_id
+            WHERE h.generation_id = %s
+        """, (generation_id,))
+        hashes = dict(cur.fetchall())
+    logging.info(f"Scan generation {generation_id} has {len(hashes)} repositories")
+
+    def load(repos):
+        """
+        Load the scan results of repositories of the generation in batches.
+        
+        :param repos: List of repository names.
+        :return: Dictionary mapping repository names to ScanResults.
+        """
+        results = {}
+        with cursor(db_config) as cur:
+            for start in range(0, len(repos), LOAD_BATCH_SIZE):
+                names = repos[start:start + LOAD_BATCH_SIZE]
+                cur.execute("""
+                    SELECT content_hash, repo_data FROM my_schema.scan_contents
+                    WHERE content_hash = ANY(%s)
+                """, ([hashes[repo] for repo in names],))
+                contents = dict(cur.fetchall())
+                results.update((repo, ScanResult.from_json(contents[hashes[repo]])) for repo in names)
+        return results
+
+    return hashes, load
+
+def diff_sources(old_source, new_source):
+    """
+    Compare two scans. Repositories with the same content hash in both are skipped without
+    reading their scan results.
+    
+    :param old_source: Old (hashes, load) source (see file_source and generation_source).
+    :param new_source: New (hashes, load) source.
+    :return: Dictionary mapping each added, removed or changed repository to a dictionary
+             with its 'status' and its changes (see diff_repository).
+    """
+    old_hashes, load_old = old_source
+    new_hashes, load_new = new_source
+    added = sorted(new_hashes.keys() - old_hashes.keys())
+    removed = sorted(old_hashes.keys() - new_hashes.keys())
+    changed = sorted(repo for repo in old_hashes.keys() & new_hashes.keys() if old_hashes[repo] != new_hashes[repo])
+    logging.info(f"{len(added)} added, {len(removed)} removed and {len(changed)} changed repositories; "
+                 f"{len(new_hashes) - len(added) - len(changed)} unchanged")
+
+    old_data = load_old(removed + changed)
+    new_data = load_new(added + changed)
+    diff = {}
+    for status, repos in (('added', added), ('removed', removed), ('changed', changed)):
+        for repo in repos:
+            diff[repo] = {'status': status, **diff_repository(old_data.get(repo), new_data.get(repo))}
+    return dict(sorted(diff.items()))
+
+def summarize(diff):
+    """
+    Count the repositories and changes of a diff.
+    
+    :param diff: Diff returned by diff_sources.
+    :return: Dictionary of counts, e.g. {'repositories.changed': 3, 'dependencies.added': 12}.
+    """
+    summary = {}
+    for repo_diff in diff.values():
+        key = f"repositories.{repo_diff['status']}"
+        summary[key] = summary.get(key, 0) + 1
+        for kind in ('dependencies', 'requirements', 'yaml'):
+            for change, values in repo_diff.get(kind, {}).items():
+                key = f"{kind}.{change}"
+                summary[key] = summary.get(key, 0) + len(values)
+    return dict(sorted(summary.items()))
+
+def save_generation(db_config, source, label):
+    """
+    Record scan results as a new scan generation. The scan results of each repository are
+    stored once per distinct content hash, so unchanged repositories only add a history row.
+    
+    :param db_config: Dictionary of psycopg2 connection keywords.
+    :param source: (hashes, load) source of the scan results (see file_source).
+    :param label: Description of the source stored with the generation, e.g. its path.
+    :return: ID of the new generation.
+    """
+    hashes, load = source
+    with connection(db_config) as conn, conn.cursor() as cur:
+        repos = fetch_repositories(cur, list(hashes))
+        for repo in hashes.keys() - repos.keys():
+            logging.error(f"Repository {repo} not found in my_schema.repositories")
+
+        cur.execute("""
+            SELECT content_hash FROM my_schema.scan_contents WHERE content_hash = ANY(%s)
+        """, (list(set(hashes.values())),))
+        stored = {row[0] for row in cur.fetchall()}
+        new_repos = list({hashes[repo]: repo for repo in repos if hashes[repo] not in stored}.values())
+        for start in range(0, len(new_repos), LOAD_BATCH_SIZE):
+            results = load(new_repos[start:start + LOAD_BATCH_SIZE])
+            execute_values(cur, """
+                INSERT INTO my_schema.scan_contents (content_hash, repo_data) VALUES %s
+                ON CONFLICT DO NOTHING
+            """, [(hashes[repo], json.dumps(repo_data.to_json(), default=str)) for repo, repo_data in results.items()])
+
+        cur.execute("""
+            INSERT INTO my_schema.scan_generations (source, repository_count) VALUES (%s, %s) RETURNING id
+        """, (label, len(repos)))
+        generation_id = cur.fetchone()[0]
+        execute_values(cur, """
+            INSERT INTO my_schema.scan_history (generation_id, repository_id, content_hash) VALUES %s
+        """, [(generation_id, repo_id, hashes[repo]) for repo, (repo_id, _) in repos.items()])
+    logging.info(f"Recorded scan generation {generation_id}: {len(repos)} repositories, "
+                 f"{len(new_repos)} new scan results")
+    return generation_id
+
+def main():
+    """
+    Main function to compare two scans and record scan generations.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Compare two scans and record scan generations in the database.')
+    parser.add_argument('--old_path', type=str, help='Path to the old scan results (JSON, JSON Lines or .snap snapshot).')
+    parser.add_argument('--new_path', type=str, help='Path to the new scan results (JSON, JSON Lines or .snap snapshot).')
+    parser.add_argument('--old_generation', type=str, help="ID of the old scan generation in the database, or 'latest'.")
+    parser.add_argument('--new_generation', type=str, help="ID of the new scan generation in the database, or 'latest'.")
+    parser.add_argument('--output_path', type=str, help='Path to the output JSON file with the diff.')
+    parser.add_argument('--save_generation', action='store_true', help='Record the scan results of --new_path as a new scan generation.')
+    add_db_arguments(parser)
+    args = parser.parse_args()
+
+    if args.old_path and args.old_generation:
+        parser.error('give only one of --old_path and --old_generation')
+    if not (args.old_path or args.old_generation or args.save_generation):
+        parser.error('give --old_path or --old_generation to compare, or --save_generation')
+    if bool(args.new_path) == bool(args.new_generation):
+        parser.error('give one of --new_path and --new_generation')
+    if args.save_generation and not args.new_path:
+        parser.error('--save_generation records the scan results of --new_path')
+
+    db_config = load_db_config(args) if args.old_generation or args.new_generation or args.save_generation else None
+    if args.old_generation or args.new_generation:
+        with cursor(db_config) as cur:
+            old_generation = args.old_generation and resolve_generation(cur, args.old_generation)
+            new_generation = args.new_generation and resolve_generation(cur, args.new_generation)
+
+    new_source = file_source(args.new_path) if args.new_path else generation_source(db_config, new_generation)
+    if args.old_path or args.old_generation:
+        old_source = file_source(args.old_path) if args.old_path else generation_source(db_config, old_generation)
+        diff = diff_sources(old_source, new_source)
+        for key, count in summarize(diff).items():
+            logging.info(f"{key}: {count}")
+        if args.output_path:
+            logging.info(f"Writing diff to {args.output_path}")
+            with open(args.output_path, 'w') as file:
+                json.dump({'summary': summarize(diff), 'repositories': diff}, file, indent=4, default=str)
+    if args.save_generation:
+        save_generation(db_config, new_source, args.new_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import json
+import logging
+from records import ScanResult
+from snapshot import Snapshot, is_snapshot
+
+# Extensions of scan result files written as JSON Lines, one repository per line
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+
+def is_ndjson(path):
+    """
+    Check whether a scan results file uses the JSON Lines format.
+    
+    :param path: Path to the scan results file.
+    :return: True if the file is a JSON Lines file.
+    """
+    return path.lower().endswith(NDJSON_EXTENSIONS)
+
+def scan_results_format(path):
+    """
+    Get the format of a scan results file from its extension, the only way readers tell formats apart.
+    
+    :param path: Path to the scan results file.
+    :return: 'snapshot', 'ndjson' or 'json'.
+    """
+    if is_snapshot(path):
+        return 'snapshot'
+    return 'ndjson' if is_ndjson(path) else 'json'
+
+def write_ndjson_record(file, repo, repo_data):
+    """
+    Write the scan results of a repository as a single JSON line.
+    
+    :param file: Open text file to write to.
+    :param repo: Name of the repository.
+    :param repo_data: ScanResult of the repository.
+    """
+    record = {'repository': repo}
+    record.update(repo_data.to_json())
+    file.write(json.dumps(record))
+    file.write("\n")
+
+def read_scan_results(path):
+    """
+    Iterate over the repositories of a scan results file.
+    
+    JSON Lines files and snapshots (see snapshot.py) are streamed one repository at a time;
+    JSON files written by scanner.py are loaded at once.
+    
+    :param path: Path to the scan results file.
+    :return: Generator of (repo, ScanResult) tuples.
+    """
+    logging.info(f"Reading scan results: {path}")
+    if is_snapshot(path):
+        with Snapshot(path) as snapshot:
+            yield from snapshot
+        return
+    with open(path, 'r') as file:
+        if not is_ndjson(path):
+            for repo, repo_data in json.load(file).items():
+                yield repo, ScanResult.from_json(repo_data)
+            return
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                yield record.pop('repository'), ScanResult.from_json(record)
@@ -1,59 +1,105 @@
 import yaml
+import configparser
 import xml.etree.ElementTree as ET
 import os
 import json
 import argparse
 import logging
+import time
+from collections import deque
+from functools import partial
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from scan_cache import ScanCache, read_git_head, file_digest
+from scan_results import write_ndjson_record, scan_results_format
+from snapshot import SnapshotWriter
+from yaml_backend import load_yaml_file
+from pom_parser import parse_dependencies
+from requirements_parser import read_requirements, read_setup_cfg, read_pyproject
+from records import Dependency, ScanResult, intern_string, to_json
+from discovery import discover_files, load_scan_config, DEFAULT_SCAN_CONFIG
+from metrics import METRICS, timed, reset_metrics, add_profile_arguments, profile_run
 
-def scan_yaml(yaml_path):
+# Version of the cached scan state, bumped when parsers change so old results are not reused
+SCAN_STATE_VERSION = 5
+
+def scan_yaml(yaml_path, max_size=None, oversize='skip'):
     """
     Scan a YAML file and return its contents as a dictionary.
     
+    Multi-document files are returned as a list with one entry per document.
+    
     :param yaml_path: Path to the YAML file.
-    :return: Dictionary containing the YAML file contents.
+    :param max_size: Maximum size in bytes of the files that are fully parsed, or None for no limit.
+    :param oversize: 'skip' or 'truncate' larger files (see yaml_backend.load_yaml_file).
+    :return: Dictionary containing the YAML file contents, or None if it could not be parsed.
     """
     logging.info(f"Scanning YAML file: {yaml_path}")
-    with open(yaml_path, 'r') as file:
-        config = yaml.safe_load(file)
-    return config
+    try:
+        return load_yaml_file(yaml_path, max_size, oversize)
+    except yaml.YAMLError as e:
+        logging.error(f"Error parsing YAML file {yaml_path}: {e}")
+        return None
 
-def scan_pom(xml_path):
+def scan_pom(xml_path, repo_poms=(), local_repository=None):
     """
     Scan a Maven POM file and return a list of dependencies.
     
+    Versions are resolved from properties, dependencyManagement sections, parent POMs
+    and imported BOMs (see pom_parser.parse_dependencies).
+    
     :param xml_path: Path to the POM file.
-    :return: List of dictionaries containing dependency information.
+    :param repo_poms: Paths of all the POM files of the repository, used to find parents and BOMs.
+    :param local_repository: Path to a local Maven repository used to find parents and BOMs, or None.
+    :return: List of Dependency records.
     """
     logging.info(f"Scanning POM file: {xml_path}")
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    namespaces = {'mvn': 'http://maven.apache.org/POM/4.0.0'}
-    dependencies = []
-    for dependency in root.findall('.//mvn:dependency', namespaces):
-        try:
-            group_id = dependency.find('mvn:groupId', namespaces).text
-            artifact_id = dependency.find('mvn:artifactId', namespaces).text
-            version = dependency.find('mvn:version', namespaces).text
-            dependencies.append({
-                'groupId': group_id,
-                'artifactId': artifact_id,
-                'version': version
-            })
-        except AttributeError:
-            continue  # Skip dependencies with missing information
-    return dependencies
+    try:
+        return [Dependency.from_json(dep) for dep in parse_dependencies(xml_path, repo_poms, local_repository)]
+    except ET.ParseError as e:
+        logging.error(f"Error parsing POM file {xml_path}: {e}")
+        return []
 
 def scan_requirements(req_path):
     """
     Scan a requirements.txt file and return a list of requirements.
     
+    Comments, blank lines and pip options are dropped and '-r' includes are followed
+    (see requirements_parser.read_requirements).
+    
     :param req_path: Path to the requirements.txt file.
-    :return: List of requirements as strings.
+    :return: List of requirements as interned strings.
     """
     logging.info(f"Scanning requirements file: {req_path}")
-    with open(req_path, 'r') as file:
-        requirements = file.readlines()
-    return [req.strip() for req in requirements]
+    return [intern_string(req) for req in read_requirements(req_path)]
+
+def scan_setup_cfg(cfg_path):
+    """
+    Scan a setup.cfg file and return the requirements of its install_requires and extras_require options.
+    
+    :param cfg_path: Path to the setup.cfg file.
+    :return: List of requirements as interned strings.
+    """
+    logging.info(f"Scanning setup.cfg file: {cfg_path}")
+    try:
+        return [intern_string(req) for req in read_setup_cfg(cfg_path)]
+    except configparser.Error as e:
+        logging.error(f"Error parsing setup.cfg file {cfg_path}: {e}")
+        return []
+
+def scan_pyproject(toml_path):
+    """
+    Scan a pyproject.toml file and return the requirements of its dependency tables.
+    
+    :param toml_path: Path to the pyproject.toml file.
+    :return: List of requirements as interned strings.
+    """
+    logging.info(f"Scanning pyproject.toml file: {toml_path}")
+    try:
+        return [intern_string(req) for req in read_pyproject(toml_path)]
+    except (ValueError, TypeError, AttributeError) as e:
+        logging.error(f"Error parsing pyproject.toml file {toml_path}: {e}")
+        return []
 
 def write_to_json(data, output_path):
     """
@@ -64,7 +110,37 @@ def write_to_json(data, output_path):
     """
     logging.info(f"Writing data to JSON file: {output_path}")
     with open(output_path, 'w') as file:
-        json.dump(data, file, indent=4)
+        json.dump(data, file, indent=4, default=to_json)
+
+def write_repo_to_txt(file, repo, repo_data):
+    """
+    Write the data of a repository to an open text file in a human-readable format.
+    
+    :param file: Open text file to write to.
+    :param repo: Name of the repository.
+    :param repo_data: ScanResult of the repository.
+    """
+    file.write(f"Repository: {repo}\n")
+    file.write("YAML Configs:\n")
+    for yaml_file, yaml_config in repo_data.yaml_configs.items():
+        file.write(f"  {yaml_file}:\n")
+        documents = yaml_config if isinstance(yaml_config, list) else [yaml_config]
+        for index, document in enumerate(documents):
+            if index:
+                file.write("    ---\n")
+            if isinstance(document, dict):
+                for key, value in document.items():
+                    file.write(f"    {key}: {value}\n")
+            elif document is not None:
+                file.write(f"    {document}\n")
+    file.write("Dependencies:\n")
+    for dep in repo_data.dependencies:
+        file.write(f"  - groupId: {dep.group_id}, artifactId: {dep.artifact_id}, version: {dep.version}\n")
+    if repo_data.requirements is not None:
+        file.write("Requirements:\n")
+        for req in repo_data.requirements:
+            file.write(f"  - {req}\n")
+    file.write("\n")
 
 def write_to_txt(data, output_path):
     """
@@ -76,20 +152,389 @@ def write_to_txt(data, output_path):
     logging.info(f"Writing data to text file: {output_path}")
     with open(output_path, 'w') as file:
         for repo, repo_data in data.items():
-            file.write(f"Repository: {repo}\n")
-            file.write("YAML Configs:\n")
-            for yaml_file, yaml_config in repo_data['yaml_configs'].items():
-                file.write(f"  {yaml_file}:\n")
-                for key, value in yaml_config.items():
-                    file.write(f"    {key}: {value}\n")
-            file.write("Dependencies:\n")
-            for dep in repo_data['dependencies']:
-                file.write(f"  - groupId: {dep['groupId']}, artifactId: {dep['artifactId']}, version: {dep['version']}\n")
-            if 'requirements' in repo_data:
-                file.write("Requirements:\n")
-                for req in repo_data['requirements']:
-                    file.write(f"  - {req}\n")
-            file.write("\n")
+            write_repo_to_txt(file, repo, repo_data)
+
+def write_streaming(results, output_path, txt_output_path=None, output_format='ndjson'):
+    """
+    Write scan results to a JSON Lines or snapshot file, and optionally a text file, as each repository finishes.
+    
+    :param results: Iterable of (repo, repo_data) tuples.
+    :param output_path: Path to the output JSON Lines or snapshot file.
+    :param txt_output_path: Path to the output text file, or None to skip it.
+    :param output_format: 'ndjson' or 'snapshot'.
+    """
+    logging.info(f"Streaming data to {output_path}" + (f" and {txt_output_path}" if txt_output_path else ""))
+    with ExitStack() as stack:
+        if output_format == 'snapshot':
+            snapshot = stack.enter_context(SnapshotWriter(output_path))
+            write_record = snapshot.add
+        else:
+            ndjson_file = stack.enter_context(open(output_path, 'w'))
+            write_record = partial(write_ndjson_record, ndjson_file)
+        txt_file = stack.enter_context(open(txt_output_path, 'w')) if txt_output_path else None
+        for repo, repo_data in results:
+            write_record(repo, repo_data)
+            if txt_file is not None:
+                write_repo_to_txt(txt_file, repo, repo_data)
+
+def scan_file(file_path, relpath, kind, stat, parser, previous_files, files, stats, reuse=True):
+    """
+    Parse a manifest file, reusing the previous result when the file has not changed.
+    
+    A file is considered unchanged when its mtime and size match the cached ones, or
+    failing that, when its content hash matches.
+    
+    :param file_path: Path to the manifest file.
+    :param relpath: Repo-relative path of the file, used as cache key.
+    :param kind: Kind of manifest file.
+    :param stat: Result of os.stat for the file.
+    :param parser: Function used to parse the file.
+    :param previous_files: Cached file entries of the repository, keyed by relative path.
+    :param files: Dictionary where the new file entry is stored.
+    :param stats: Dictionary with 'parsed' and 'reused' counters.
+    :param reuse: Whether the previous result may be reused at all.
+    :return: Parsed result of the file.
+    """
+    cached = previous_files.get(relpath) if reuse else None
+    if cached and cached['mtime_ns'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+        entry = cached
+        stats['reused'] += 1
+    else:
+        digest = file_digest(file_path)
+        if cached and cached['sha1'] == digest:
+            entry = dict(cached, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            stats['reused'] += 1
+        else:
+            entry = {
+                'kind': kind,
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'sha1': digest,
+                'result': parser(file_path)
+            }
+            stats['parsed'] += 1
+    files[relpath] = entry
+    return entry['result']
+
+# Parsers for each kind of manifest file matched by the discovery patterns
+MANIFEST_PARSERS = {
+    'yaml': scan_yaml,
+    'pom': scan_pom,
+    'requirements': scan_requirements,
+    'setup_cfg': scan_setup_cfg,
+    'pyproject': scan_pyproject
+}
+
+# Kinds whose results are merged into the requirements of a repository
+REQUIREMENT_KINDS = {'requirements', 'setup_cfg', 'pyproject'}
+# Kinds always parsed again, because their result depends on files the scan cache does not
+# track (requirements files included with '-r'). They are small and cheap to parse.
+UNCACHED_KINDS = {'requirements'}
+
+# Kinds whose parsed result depends on other files of the same kind (POM parents),
+# so all of them are parsed again when any of them changes
+CONTEXT_DEPENDENT_KINDS = {'pom'}
+
+def changed_kinds(discovered, previous_files):
+    """
+    Find the context-dependent kinds with at least one added, removed or modified file.
+    
+    :param discovered: List of (kind, relpath, path, stat) tuples found in the repository.
+    :param previous_files: Cached file entries of the repository, keyed by relative path.
+    :return: Set of kinds that must be parsed again from scratch.
+    """
+    changed = set()
+    current = set()
+    for kind, relpath, _, stat in discovered:
+        if kind not in CONTEXT_DEPENDENT_KINDS:
+            continue
+        current.add(relpath)
+        cached = previous_files.get(relpath)
+        if not cached or cached['mtime_ns'] != stat.st_mtime_ns or cached['size'] != stat.st_size:
+            changed.add(kind)
+    for relpath, cached in previous_files.items():
+        if cached.get('kind') in CONTEXT_DEPENDENT_KINDS and relpath not in current:
+            changed.add(cached['kind'])
+    return changed
+
+def current_state(previous, scan_config):
+    """
+    Discard a previous scan state written by another version of the scanner or with other settings.
+    
+    :param previous: Previous scan state of the repository, {} or None.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :return: The previous state if it can be reused, {} if it cannot, or None if state is not tracked.
+    """
+    if previous is None:
+        return None
+    if previous.get('version') != SCAN_STATE_VERSION or previous.get('config') != scan_config:
+        return {}
+    return previous
+
+def scan_repository(repo_path, previous=None, scan_config=None, head=None):
+    """
+    Scan a single repository for YAML configs, POM dependencies and requirements.
+    
+    Files are found with discover_files and dispatched to MANIFEST_PARSERS by kind.
+    YAML configs are keyed by their repo-relative path.
+    
+    When a previous scan state is given, the repository is skipped entirely if its
+    HEAD commit has not moved, and otherwise only changed files are parsed again.
+    
+    :param repo_path: Path to the repository.
+    :param previous: Previous scan state of the repository, {} for a first incremental
+                     scan, or None to scan without tracking state.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :param head: Commit the files were read from, or None to read the HEAD of the repository.
+    :return: Tuple of (repository data or None if nothing was found, new scan state or None).
+    """
+    scan_config = scan_config or DEFAULT_SCAN_CONFIG
+    files = {}
+    stats = {'parsed': 0, 'reused': 0}
+    previous = current_state(previous, scan_config)
+    if previous is not None:
+        head = head or read_git_head(repo_path)
+        if head is not None and previous.get('head') == head:
+            logging.info(f"Repository unchanged at {head}, reusing previous results")
+            stats['reused'] = len(previous['files'])
+            return ScanResult.from_json(previous['repo_data']), dict(previous, stats=stats)
+        previous_files = previous.get('files', {})
+
+    with METRICS.timer('discover'):
+        discovered = list(discover_files(repo_path, scan_config))
+    dirty_kinds = changed_kinds(discovered, previous_files) if previous is not None else set()
+    repo_poms = [file_path for kind, _, file_path, _ in discovered if kind == 'pom']
+
+    yaml_configs = {}
+    dependencies = []
+    requirements = None
+    for kind, relpath, file_path, stat in discovered:
+        parser = MANIFEST_PARSERS.get(kind)
+        if parser is None:
+            logging.warning(f"No parser registered for {kind} files, skipping {file_path}")
+            continue
+        options = dict(scan_config.get('parser_options', {}).get(kind) or {})
+        if kind == 'pom':
+            options['repo_poms'] = repo_poms
+        if options:
+            parser = partial(parser, **options)
+        # Only actual parses are timed, files reused from the cache are just counted
+        parser = timed(parser, f'parse.{kind}', f'slowest_{kind}_files')
+        METRICS.count(f'files.{kind}')
+        METRICS.count(f'bytes.{kind}', stat.st_size)
+        if previous is None:
+            result = parser(file_path)
+        else:
+            result = scan_file(file_path, relpath, kind, stat, parser, previous_files, files, stats,
+                               reuse=kind not in dirty_kinds and kind not in UNCACHED_KINDS)
+
+        if kind == 'yaml':
+            yaml_configs[relpath] = result
+        elif kind == 'pom':
+            # Results reused from the cache are in their JSON form
+            dependencies.extend(Dependency.from_json(dep) for dep in result)
+        elif kind in REQUIREMENT_KINDS:
+            requirements = (requirements or []) + result
+
+    # Modules of the same build usually share dependencies, keep each one once
+    repo_data = ScanResult(yaml_configs, dict.fromkeys(dependencies), requirements)
+    if repo_data.is_empty():
+        repo_data = None
+
+    if previous is None:
+        return repo_data, None
+    METRICS.count('files.parsed', stats['parsed'])
+    METRICS.count('files.reused', stats['reused'])
+    return repo_data, {
+        'version': SCAN_STATE_VERSION,
+        'config': scan_config,
+        'head': head,
+        'files': files,
+        'repo_data': repo_data,
+        'stats': stats
+    }
+
+def scan_repository_task(repo, repo_path, previous=None, scan_config=None, ref=None, collect_metrics=False):
+    """
+    Scan a repository inside a worker process and report how long it took.
+    
+    :param repo: Name of the repository.
+    :param repo_path: Path to the repository.
+    :param previous: Previous scan state of the repository (see scan_repository).
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :param ref: Git ref to scan from the object store instead of the working tree, or None.
+    :param collect_metrics: Whether to return the metrics recorded by the task and clear them,
+                            when running in a worker process whose parent merges them.
+    :return: Tuple of (repo, repo_data, new scan state, worker pid, elapsed seconds, metrics snapshot or None).
+    """
+    logging.info(f"Scanning repository: {repo}")
+    start = time.perf_counter()
+    if ref is None:
+        repo_data, state = scan_repository(repo_path, previous, scan_config)
+    else:
+        # GitPython is only needed when scanning refs
+        from git_source import scan_git_ref
+        repo_data, state = scan_git_ref(repo_path, ref, scan_repository,
+                                        current_state(previous, scan_config or DEFAULT_SCAN_CONFIG), scan_config)
+    elapsed = time.perf_counter() - start
+    METRICS.add_time('scan.repository', elapsed, 'slowest_repositories', repo)
+    METRICS.count('repositories.scanned')
+    return repo, repo_data, state, os.getpid(), elapsed, METRICS.snapshot(reset=True) if collect_metrics else None
+
+def list_repositories(base_path, only=None):
+    """
+    List the repositories under the base path in a stable order.
+    
+    :param base_path: Base path to the repositories.
+    :param only: Optional collection of repository names to restrict the list to.
+    :return: Sorted list of (repo, repo_path) tuples.
+    """
+    repos = []
+    for repo in sorted(os.listdir(base_path)):
+        repo_path = os.path.join(base_path, repo)
+        if os.path.isdir(repo_path) and (only is None or repo in only):
+            repos.append((repo, repo_path))
+    return repos
+
+def list_ref_jobs(repos, refs=None):
+    """
+    Expand the repositories to scan into one job per repository and ref.
+    
+    :param repos: List of (repo, repo_path) tuples.
+    :param refs: List of git refs to scan from the object store, or None to scan the working trees.
+    :return: List of (name, repo_path, ref) tuples. With several refs the name is 'repo@ref',
+             and the '.git' suffix of bare clones is dropped.
+    """
+    if not refs:
+        return [(repo, repo_path, None) for repo, repo_path in repos]
+    jobs = []
+    for repo, repo_path in repos:
+        if repo.endswith('.git'):
+            repo = repo[:-len('.git')]
+        for ref in refs:
+            jobs.append((repo if len(refs) == 1 else f"{repo}@{ref}", repo_path, ref))
+    return jobs
+
+def read_changed_repositories(heads_path):
+    """
+    Read the HEAD report written by clone_repos.py and return the repositories that moved.
+    
+    :param heads_path: Path to the HEAD report JSON file.
+    :return: Set of repository names whose HEAD changed.
+    """
+    logging.info(f"Reading HEAD report: {heads_path}")
+    with open(heads_path, 'r') as file:
+        report = json.load(file)
+    changed = {repo for repo, result in report.items() if result.get('changed')}
+    logging.info(f"{len(changed)} of {len(report)} repositories changed")
+    return changed
+
+def log_worker_throughput(worker_stats, wall_time):
+    """
+    Log the number of repositories and throughput of each worker.
+    
+    :param worker_stats: Dictionary mapping worker pid to [repos scanned, busy seconds].
+    :param wall_time: Total wall-clock time of the scan in seconds.
+    """
+    for index, (pid, (count, busy)) in enumerate(sorted(worker_stats.items()), start=1):
+        rate = count / busy if busy else 0.0
+        logging.info(f"Worker {index} (pid {pid}): {count} repositories in {busy:.2f}s ({rate:.2f} repos/s)")
+    total = sum(count for count, _ in worker_stats.values())
+    rate = total / wall_time if wall_time else 0.0
+    logging.info(f"Scanned {total} repositories in {wall_time:.2f}s ({rate:.2f} repos/s)")
+
+def iter_scan_repositories(base_path, workers=1, cache_path=None, only=None, scan_config=None, refs=None):
+    """
+    Scan every repository under the base path, optionally across a pool of worker processes,
+    yielding each result as soon as it is available.
+    
+    Results are yielded in repository-name order. With several workers only a bounded
+    number of repositories is in flight, so memory does not grow with the number of repositories.
+    
+    :param base_path: Base path to the repositories.
+    :param workers: Number of worker processes. 1 scans in the current process.
+    :param cache_path: Path to the scan cache used for incremental scans, or None to scan everything.
+    :param only: Optional collection of repository names to restrict the scan to.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :param refs: List of git refs to scan from the object store of each clone instead of its
+                 working tree, or None (see list_ref_jobs for the resulting names).
+    :return: Generator of (repo, repo_data) tuples for the repositories where something was found.
+    """
+    jobs = list_ref_jobs(list_repositories(base_path, only), refs)
+    cache = ScanCache(cache_path) if cache_path else None
+    worker_stats = {}
+    cache_stats = {'parsed': 0, 'reused': 0}
+    start = time.perf_counter()
+
+    def collect(repo, repo_data, state, pid, elapsed, worker_metrics):
+        METRICS.merge(worker_metrics)
+        worker = worker_stats.setdefault(pid, [0, 0.0])
+        worker[0] += 1
+        worker[1] += elapsed
+        if cache is not None and state is not None:
+            file_stats = state.pop('stats')
+            for key in cache_stats:
+                cache_stats[key] += file_stats[key]
+            cache.put(repo, state)
+        return repo, repo_data
+
+    def previous_state(repo):
+        if cache is None:
+            return None
+        return cache.get(repo) or {}
+
+    try:
+        if workers > 1:
+            logging.info(f"Scanning {len(jobs)} repositories with {workers} workers")
+            with ProcessPoolExecutor(max_workers=workers, initializer=reset_metrics) as executor:
+                pending = iter(jobs)
+                in_flight = deque()
+                while True:
+                    while len(in_flight) < workers * 4:
+                        next_job = next(pending, None)
+                        if next_job is None:
+                            break
+                        repo, repo_path, ref = next_job
+                        in_flight.append(executor.submit(scan_repository_task, repo, repo_path, previous_state(repo),
+                                                         scan_config, ref, True))
+                    if not in_flight:
+                        break
+                    try:
+                        repo, repo_data = collect(*in_flight.popleft().result())
+                    except Exception as e:
+                        logging.error(f"Error scanning repository: {e}")
+                        continue
+                    if repo_data is not None:
+                        yield repo, repo_data
+        else:
+            for repo, repo_path, ref in jobs:
+                repo, repo_data = collect(*scan_repository_task(repo, repo_path, previous_state(repo), scan_config, ref))
+                if repo_data is not None:
+                    yield repo, repo_data
+
+        if cache is not None:
+            if only is None:
+                cache.prune(repo for repo, _, _ in jobs)
+            logging.info(f"Scan cache: {cache_stats['parsed']} files parsed, {cache_stats['reused']} files reused")
+    finally:
+        if cache is not None:
+            cache.close()
+
+    log_worker_throughput(worker_stats, time.perf_counter() - start)
+
+def scan_repositories(base_path, workers=1, cache_path=None, only=None, scan_config=None, refs=None):
+    """
+    Scan every repository under the base path, optionally across a pool of worker processes.
+    
+    :param base_path: Base path to the repositories.
+    :param workers: Number of worker processes. 1 scans in the current process.
+    :param cache_path: Path to the scan cache used for incremental scans, or None to scan everything.
+    :param only: Optional collection of repository names to restrict the scan to.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :param refs: List of git refs to scan from the object store instead of the working trees, or None.
+    :return: Dictionary mapping repository names to their data, ordered by repository name.
+    """
+    return dict(iter_scan_repositories(base_path, workers, cache_path, only, scan_config, refs))
 
 def main():
     """
@@ -100,38 +545,34 @@ def main():
     
     parser = argparse.ArgumentParser(description='Scan repositories for configuration files and dependencies.')
     parser.add_argument('--base_path', type=str, required=True, help='Base path to the repositories.')
-    parser.add_argument('--json_output_path', type=str, required=True, help='Path to the output JSON file.')
-    parser.add_argument('--txt_output_path', type=str, required=True, help='Path to the output text file.')
+    parser.add_argument('--json_output_path', type=str, required=True, help='Path to the output JSON file (a .ndjson/.jsonl extension selects the JSON Lines format and .snap a snapshot).')
+    parser.add_argument('--txt_output_path', type=str, help='Path to the output text file. Not written when omitted.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes used to scan repositories in parallel.')
+    parser.add_argument('--cache_path', type=str, help='Path to the SQLite scan cache. Enables incremental scans when given.')
+    parser.add_argument('--output_format', type=str, choices=['json', 'ndjson', 'snapshot'], help='Output format, which must match the extension of --json_output_path: ndjson for .ndjson/.jsonl paths, snapshot for .snap paths and json otherwise.')
+    parser.add_argument('--config_path', type=str, help="Path to the configuration file with the 'scanner' settings.")
+    parser.add_argument('--heads_path', type=str, help='Path to the HEAD report of clone_repos.py. Only repositories whose HEAD changed are scanned.')
+    parser.add_argument('--git_refs', type=str, help="Comma-separated git refs (e.g. 'HEAD' or 'main,release') to scan from the object store of each clone, without a checkout.")
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
-    data = {}
-
-    for repo in os.listdir(args.base_path):
-        repo_path = os.path.join(args.base_path, repo)
-        logging.info(f"Scanning repository: {repo}")
-        yaml_configs = {}
-        for root, _, files in os.walk(repo_path):
-            for file in files:
-                if file.endswith('.yaml'):
-                    yaml_path = os.path.join(root, file)
-                    yaml_configs[file] = scan_yaml(yaml_path)
-        
-        xml_path = os.path.join(repo_path, 'pom.xml')
-        req_path = os.path.join(repo_path, 'requirements.txt')
-
-        repo_data = {
-            'yaml_configs': yaml_configs,
-            'dependencies': scan_pom(xml_path) if os.path.exists(xml_path) else []
-        }
-
-        if os.path.exists(req_path):
-            repo_data['requirements'] = scan_requirements(req_path)
-
-        if yaml_configs or repo_data['dependencies'] or 'requirements' in repo_data:
-            data[repo] = repo_data
-
-    write_to_json(data, args.json_output_path)
-    write_to_txt(data, args.txt_output_path)
+    only = read_changed_repositories(args.heads_path) if args.heads_path else None
+    # Readers recognize the format by the extension, so an explicit format must match it
+    output_format = scan_results_format(args.json_output_path)
+    if args.output_format and args.output_format != output_format:
+        parser.error(f"--output_format {args.output_format} does not match the extension of {args.json_output_path}; "
+                     "use .ndjson/.jsonl for ndjson, .snap for snapshot and any other extension for json")
+    scan_config = load_scan_config(args.config_path)
+    refs = [ref.strip() for ref in args.git_refs.split(',') if ref.strip()] if args.git_refs else None
+    with profile_run(args.profile, args.metrics_path):
+        results = iter_scan_repositories(args.base_path, args.workers, args.cache_path, only, scan_config, refs)
+        if output_format in ('ndjson', 'snapshot'):
+            write_streaming(results, args.json_output_path, args.txt_output_path, output_format)
+        else:
+            data = dict(results)
+            write_to_json(data, args.json_output_path)
+            if args.txt_output_path:
+                write_to_txt(data, args.txt_output_path)
 
 if __name__ == "__main__":
     main()
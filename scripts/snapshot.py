@@ -0,0 +1,390 @@
+import os
+import sys
+import json
+import zlib
+import struct
+import logging
+import argparse
+from array import array
+from datetime import datetime
+from records import ScanResult, content_hash
+from requirements_parser import parse_requirement
+
+# Snapshot files start and end with this marker; the end marker follows the offset of the index
+MAGIC = b'RSNAP\x01'
+FOOTER = struct.Struct('<Q')
+SNAPSHOT_EXTENSIONS = ('.snap',)
+SNAPSHOT_FORMAT = 1
+
+# Columnar tables of a snapshot and their columns. Every column but 'repo' holds strings.
+TABLES = {
+    'dependencies': ('repo', 'group_id', 'artifact_id', 'version'),
+    'requirements': ('repo', 'requirement', 'name', 'specifier'),
+    'yaml_files': ('repo', 'file', 'content_hash')
+}
+
+def is_snapshot(path):
+    """
+    Check whether a scan results file is a snapshot.
+    
+    :param path: Path to the scan results file.
+    :return: True if the file is a snapshot.
+    """
+    return path.lower().endswith(SNAPSHOT_EXTENSIONS)
+
+def table_rows(repo_data):
+    """
+    Build the rows of the columnar tables for the scan results of a repository.
+    
+    :param repo_data: ScanResult of the repository.
+    :return: Dictionary mapping table names to lists of rows without the repo column.
+    """
+    requirements = []
+    for requirement in repo_data.requirements or ():
+        parsed = parse_requirement(requirement)
+        requirements.append((requirement, *(parsed[:2] if parsed else (None, None))))
+    return {
+        'dependencies': [dep.key() for dep in repo_data.dependencies],
+        'requirements': requirements,
+        'yaml_files': [(yaml_file, content_hash(yaml_content))
+                       for yaml_file, yaml_content in repo_data.yaml_configs.items()]
+    }
+
+def pack_ids(ids):
+    """
+    Compress a column of integer IDs.
+    
+    :param ids: array('I') of IDs.
+    :return: Compressed little-endian bytes.
+    """
+    if sys.byteorder == 'big':
+        ids = array('I', ids)
+        ids.byteswap()
+    return zlib.compress(ids.tobytes())
+
+def unpack_ids(data):
+    """
+    Decode a column of integer IDs (see pack_ids).
+    
+    :param data: Decompressed little-endian bytes.
+    :return: array('I') of IDs.
+    """
+    ids = array('I')
+    ids.frombytes(data)
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+class SnapshotWriter:
+    """
+    Writer of snapshot files: a compact binary format for scan results.
+    
+    Each repository is stored as a separately compressed JSON record, so a single repository
+    can be read without loading the rest. Dependencies, requirements and YAML files are also
+    stored as columnar tables of dictionary-encoded strings, which load into pandas without
+    parsing the records. A footer index holds the offset and content hash of every repository
+    and the location of every column. The file is written to '<path>.tmp' and only renamed
+    when complete.
+    """
+
+    def __init__(self, path, compression_level=6):
+        """
+        Create a snapshot file.
+        
+        :param path: Path to the snapshot file.
+        :param compression_level: zlib compression level, from 1 (fastest) to 9 (smallest).
+        """
+        logging.info(f"Writing snapshot: {path}")
+        self.path = path
+        self.compression_level = compression_level
+        self.file = open(f"{path}.tmp", 'wb')
+        self.file.write(MAGIC)
+        self.repos = {'names': [], 'offsets': [], 'lengths': [], 'hashes': []}
+        # String table shared by all the columns; ID 0 stands for None
+        self.strings = {None: 0}
+        self.columns = {table: {column: array('I') for column in columns} for table, columns in TABLES.items()}
+
+    def write_block(self, data):
+        """
+        Append a block to the file.
+        
+        :param data: Bytes to write.
+        :return: Tuple of (offset, length) of the block.
+        """
+        offset = self.file.tell()
+        self.file.write(data)
+        return offset, len(data)
+
+    def string_id(self, value):
+        """
+        Get the ID of a string in the string table, adding it the first time it is seen.
+        
+        :param value: String or None.
+        :return: Integer ID.
+        """
+        string_id = self.strings.get(value)
+        if string_id is None:
+            string_id = self.strings[value] = len(self.strings)
+        return string_id
+
+    def add(self, repo, repo_data):
+        """
+        Add the scan results of a repository.
+        
+        :param repo: Name of the repository.
+        :param repo_data: ScanResult of the repository.
+        """
+        value = repo_data.to_json()
+        record = json.dumps(value, separators=(',', ':'), default=str).encode('utf-8')
+        offset, length = self.write_block(zlib.compress(record, self.compression_level))
+        repo_index = len(self.repos['names'])
+        self.repos['names'].append(repo)
+        self.repos['offsets'].append(offset)
+        self.repos['lengths'].append(length)
+        self.repos['hashes'].append(content_hash(value))
+
+        for table, rows in table_rows(repo_data).items():
+            columns = self.columns[table]
+            names = TABLES[table][1:]
+            for row in rows:
+                columns['repo'].append(repo_index)
+                for column, value in zip(names, row):
+                    columns[column].append(self.string_id(value))
+
+    def close(self):
+        """
+        Write the columnar tables and the index, and move the snapshot into place.
+        """
+        strings = [None] * len(self.strings)
+        for value, string_id in self.strings.items():
+            strings[string_id] = value
+        index = {
+            'format': SNAPSHOT_FORMAT,
+            'created_at': datetime.now().isoformat(),
+            'repos': self.repos,
+            'strings': self.write_block(zlib.compress(json.dumps(strings).encode('utf-8'), self.compression_level)),
+            'tables': {
+                table: {column: self.write_block(pack_ids(ids)) for column, ids in columns.items()}
+                for table, columns in self.columns.items()
+            }
+        }
+        index_offset, _ = self.write_block(zlib.compress(json.dumps(index).encode('utf-8'), self.compression_level))
+        self.file.write(FOOTER.pack(index_offset) + MAGIC)
+        self.file.close()
+        os.replace(f"{self.path}.tmp", self.path)
+        logging.info(f"Wrote {len(self.repos['names'])} repositories to snapshot {self.path}")
+
+    def abort(self):
+        """
+        Discard a snapshot that could not be completed.
+        """
+        self.file.close()
+        os.remove(f"{self.path}.tmp")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class Snapshot:
+    """
+    Reader of snapshot files (see SnapshotWriter).
+    
+    Opening a snapshot only reads its index; repositories and tables are read when requested.
+    """
+
+    def __init__(self, path):
+        """
+        Open a snapshot file and read its index.
+        
+        :param path: Path to the snapshot file.
+        """
+        self.path = path
+        self.file = open(path, 'rb')
+        self.file.seek(-(FOOTER.size + len(MAGIC)), os.SEEK_END)
+        footer = self.file.read(FOOTER.size + len(MAGIC))
+        self.file.seek(0)
+        if self.file.read(len(MAGIC)) != MAGIC or footer[FOOTER.size:] != MAGIC:
+            self.file.close()
+            raise ValueError(f"{path} is not a snapshot file")
+        index_offset, = FOOTER.unpack(footer[:FOOTER.size])
+        self.file.seek(index_offset)
+        self.index = json.loads(zlib.decompress(self.file.read()[:-(FOOTER.size + len(MAGIC))]))
+        if self.index['format'] != SNAPSHOT_FORMAT:
+            self.file.close()
+            raise ValueError(f"Unsupported snapshot format {self.index['format']} in {path}")
+        self.repos = self.index['repos']['names']
+        self.positions = {repo: position for position, repo in enumerate(self.repos)}
+        self._strings = None
+
+    def read_block(self, offset, length):
+        """
+        Read and decompress a block of the file.
+        
+        :param offset: Offset of the block.
+        :param length: Length of the block.
+        :return: Decompressed bytes.
+        """
+        self.file.seek(offset)
+        return zlib.decompress(self.file.read(length))
+
+    def get(self, repo):
+        """
+        Read the scan results of a single repository.
+        
+        :param repo: Name of the repository.
+        :return: ScanResult, or None if the repository is not in the snapshot.
+        """
+        position = self.positions.get(repo)
+        if position is None:
+            return None
+        repos = self.index['repos']
+        return ScanResult.from_json(json.loads(self.read_block(repos['offsets'][position], repos['lengths'][position])))
+
+    def hashes(self):
+        """
+        Get the content hash of every repository (see records.content_hash), without reading any record.
+        
+        :return: Dictionary mapping repository names to content hashes.
+        """
+        return dict(zip(self.repos, self.index['repos']['hashes']))
+
+    def strings(self):
+        """
+        Read the string table of the columnar tables, once.
+        
+        :return: String table of the columnar tables, where index 0 is None.
+        """
+        if self._strings is None:
+            self._strings = json.loads(self.read_block(*self.index['strings']))
+        return self._strings
+
+    def columns(self, table):
+        """
+        Read the raw columns of a table.
+        
+        :param table: Name of the table (see TABLES).
+        :return: Dictionary mapping column names to arrays of repository positions (for 'repo')
+                 or string table IDs (for the other columns).
+        """
+        return {column: unpack_ids(self.read_block(*block)) for column, block in self.index['tables'][table].items()}
+
+    def rows(self, table):
+        """
+        Read the rows of a table.
+        
+        :param table: Name of the table (see TABLES).
+        :return: List of row tuples, starting with the repository name.
+        """
+        columns = self.columns(table)
+        strings = self.strings()
+        values = [[self.repos[position] for position in columns['repo']]]
+        values += [[strings[string_id] for string_id in columns[column]] for column in TABLES[table][1:]]
+        return list(zip(*values))
+
+    def dataframe(self, table):
+        """
+        Load a table into a pandas DataFrame with categorical columns, built directly from the
+        dictionary-encoded columns.
+        
+        :param table: Name of the table (see TABLES).
+        :return: DataFrame with the columns of the table.
+        """
+        # Imported here so reading single repositories does not pay for importing pandas
+        import numpy as np
+        import pandas as pd
+        columns = self.columns(table)
+        strings = self.strings()
+        categories = pd.Index(strings[1:], dtype=object)
+        data = {'repo': pd.Categorical.from_codes(np.asarray(columns['repo'], dtype=np.int64),
+                                                  categories=pd.Index(self.repos, dtype=object))}
+        for column in TABLES[table][1:]:
+            # ID 0 (None) becomes code -1, a missing value
+            codes = np.asarray(columns[column], dtype=np.int64) - 1
+            data[column] = pd.Categorical.from_codes(codes, categories=categories)
+        return pd.DataFrame(data)
+
+    def __len__(self):
+        return len(self.repos)
+
+    def __contains__(self, repo):
+        return repo in self.positions
+
+    def __iter__(self):
+        """
+        Iterate over the repositories in the order they were written, reading the file sequentially.
+        
+        :return: Generator of (repo, ScanResult) tuples.
+        """
+        repos = self.index['repos']
+        for repo, offset, length in zip(self.repos, repos['offsets'], repos['lengths']):
+            yield repo, ScanResult.from_json(json.loads(self.read_block(offset, length)))
+
+    def close(self):
+        """
+        Close the snapshot file.
+        """
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def write_snapshot(results, path):
+    """
+    Write scan results to a snapshot file as each repository finishes.
+    
+    :param results: Iterable of (repo, repo_data) tuples.
+    :param path: Path to the snapshot file.
+    """
+    with SnapshotWriter(path) as writer:
+        for repo, repo_data in results:
+            writer.add(repo, repo_data)
+
+def main():
+    """
+    Main function to convert scan results between formats, or print a repository or a table of a snapshot.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Convert scan results to and from snapshots, and read snapshots.')
+    parser.add_argument('--input_path', type=str, required=True, help='Path to the scan results (JSON, JSON Lines or .snap snapshot).')
+    parser.add_argument('--output_path', type=str, help='Path of the converted results; the extension selects the format (.snap, .ndjson/.jsonl or .json).')
+    parser.add_argument('--repo', type=str, help='Print the scan results of a repository of a snapshot as JSON.')
+    parser.add_argument('--table', type=str, choices=list(TABLES), help='Write a table of a snapshot as CSV.')
+    parser.add_argument('--csv_output_path', type=str, help='Path to the CSV file written with --table. Printed when not given.')
+    args = parser.parse_args()
+
+    # Imported here, as scan_results reads snapshots through this module
+    from scan_results import read_scan_results, write_ndjson_record, is_ndjson
+    from scanner import write_to_json
+
+    if args.output_path:
+        results = read_scan_results(args.input_path)
+        if is_snapshot(args.output_path):
+            write_snapshot(results, args.output_path)
+        elif is_ndjson(args.output_path):
+            with open(args.output_path, 'w') as file:
+                for repo, repo_data in results:
+                    write_ndjson_record(file, repo, repo_data)
+        else:
+            write_to_json(dict(results), args.output_path)
+    if args.repo or args.table:
+        with Snapshot(args.input_path) as snapshot:
+            if args.repo:
+                repo_data = snapshot.get(args.repo)
+                if repo_data is None:
+                    logging.error(f"Repository {args.repo} not found in {args.input_path}")
+                else:
+                    print(json.dumps(repo_data.to_json(), indent=4, default=str))
+            if args.table:
+                snapshot.dataframe(args.table).to_csv(args.csv_output_path or sys.stdout, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import os
+import re
+import difflib
+import logging
+from discovery import discover_files, DEFAULT_SCAN_CONFIG
+from versions import specifier_set, version_matches
+
+SPARK_GROUP_ID = 'org.apache.spark'
+# Spark artifacts whose Scala suffix is replaced (e.g. spark-core_2.12 -> spark-core_2.13)
+SCALA_SUFFIXED_ARTIFACTS = ('spark-core', 'spark-sql')
+
+# Comments and CDATA sections, masked out before searching a POM so commented-out XML is never edited
+XML_IGNORED = re.compile(r'<!--.*?-->|<!\[CDATA\[.*?\]\]>', re.S)
+DEPENDENCY_BLOCK = re.compile(r'<dependency\s*>(.*?)</dependency\s*>', re.S)
+PROPERTIES_BLOCK = re.compile(r'<properties\s*>(.*?)</properties\s*>', re.S)
+PROPERTY_REFERENCE = re.compile(r'^\$\{([^}]+)\}$')
+
+REQUIREMENT_LINE = re.compile(r'^(?P<name>\s*pyspark(?![\w.-])\s*(?:\[[^\]]*\]\s*)?)'
+                              r'(?P<spec>(?:===|==|~=|!=|<=|>=|<|>)[^;#]*?)?(?P<rest>\s*(?:[;#].*)?)$', re.I)
+
+def element_span(text, masked, name, start=0, end=None):
+    """
+    Find the text of the first <name> element within a region of a POM.
+    
+    :param text: Original POM content.
+    :param masked: POM content with comments and CDATA blanked out, aligned with text.
+    :param name: Element name.
+    :param start: Start offset of the region.
+    :param end: End offset of the region, or None for the end of the text.
+    :return: Tuple of (start, end) offsets of the stripped element text, or None if not found.
+    """
+    pattern = re.compile(rf'<{re.escape(name)}\s*>([^<]*)</{re.escape(name)}\s*>')
+    match = pattern.search(masked, start, len(masked) if end is None else end)
+    if match is None:
+        return None
+    value_start, value_end = match.span(1)
+    value = text[value_start:value_end]
+    value_start += len(value) - len(value.lstrip())
+    value_end -= len(value) - len(value.rstrip())
+    return value_start, value_end
+
+def mask_xml(text):
+    """
+    Blank out comments and CDATA sections, keeping every offset unchanged.
+    
+    :param text: POM content.
+    :return: Masked content of the same length.
+    """
+    return XML_IGNORED.sub(lambda match: re.sub(r'\S', ' ', match.group(0)), text)
+
+def spark_dependencies(text):
+    """
+    Find the Spark dependencies of a POM.
+    
+    :param text: POM content.
+    :return: List of dictionaries with the offsets and values of the artifactId and version
+             of each Spark dependency ('version' is None when it is managed elsewhere).
+    """
+    masked = mask_xml(text)
+    dependencies = []
+    for match in DEPENDENCY_BLOCK.finditer(masked):
+        start, end = match.span(1)
+        group = element_span(text, masked, 'groupId', start, end)
+        artifact = element_span(text, masked, 'artifactId', start, end)
+        if group is None or artifact is None or text[group[0]:group[1]] != SPARK_GROUP_ID:
+            continue
+        version = element_span(text, masked, 'version', start, end)
+        dependencies.append({
+            'artifact': artifact,
+            'artifactId': text[artifact[0]:artifact[1]],
+            'version': version,
+            'versionText': text[version[0]:version[1]] if version else None
+        })
+    return dependencies
+
+def spark_version_properties(texts):
+    """
+    Collect the properties Spark dependencies take their version from (e.g. ${spark.version}).
+    
+    :param texts: Contents of the POMs of a repository.
+    :return: Set of property names.
+    """
+    names = set()
+    for text in texts:
+        for dependency in spark_dependencies(text):
+            match = PROPERTY_REFERENCE.match(dependency['versionText'] or '')
+            if match:
+                names.add(match.group(1))
+    return names
+
+def rewrite_pom_text(text, new_version, artifact_suffix, version_properties=()):
+    """
+    Update the Spark dependencies of a POM, editing only the affected element texts so
+    formatting, comments and namespaces are preserved.
+    
+    Literal versions of Spark dependencies are replaced, and so are the values of the
+    given properties wherever this POM defines them.
+    
+    :param text: POM content.
+    :param new_version: The new Spark version.
+    :param artifact_suffix: The new Scala suffix of spark-core and spark-sql artifactIds (e.g. '_2.13').
+    :param version_properties: Names of the properties holding the Spark version (see spark_version_properties).
+    :return: Updated POM content.
+    """
+    edits = []
+    for dependency in spark_dependencies(text):
+        version_text = dependency['versionText']
+        if version_text is not None and not PROPERTY_REFERENCE.match(version_text) and version_text != new_version:
+            edits.append((*dependency['version'], new_version))
+        artifact_id = dependency['artifactId']
+        if artifact_id.startswith(SCALA_SUFFIXED_ARTIFACTS):
+            new_artifact_id = artifact_id.split('_')[0] + artifact_suffix
+            if new_artifact_id != artifact_id:
+                edits.append((*dependency['artifact'], new_artifact_id))
+
+    masked = mask_xml(text)
+    for block in PROPERTIES_BLOCK.finditer(masked):
+        for name in version_properties:
+            span = element_span(text, masked, name, *block.span(1))
+            if span is not None and text[span[0]:span[1]] != new_version:
+                edits.append((*span, new_version))
+
+    for start, end, replacement in sorted(edits, reverse=True):
+        text = text[:start] + replacement + text[end:]
+    return text
+
+def rewrite_specifier(spec, new_version):
+    """
+    Rewrite a pyspark version specifier so it admits the new version.
+    
+    Pins (==, ===) keep their operator, compatible releases (~=) and wildcards keep their
+    precision, and any other specifier set that excludes the new version is replaced by a pin.
+    
+    :param spec: Specifier set, e.g. '==3.3.0', '~=3.3' or '>=3.0,<3.4'.
+    :param new_version: The new Spark version.
+    :return: The new specifier set, or None if it already admits the new version.
+    """
+    clauses = list(specifier_set(spec.strip()) or ())
+    if len(clauses) == 1:
+        operator, version = clauses[0].operator, clauses[0].version
+        if version.endswith('.*') and operator == '==':
+            length = len(version[:-2].split('.'))
+            new_spec_version = f"{'.'.join(new_version.split('.')[:length])}.*"
+        elif operator in ('==', '==='):
+            new_spec_version = new_version
+        elif operator == '~=':
+            length = len(version.split('.'))
+            new_spec_version = '.'.join(new_version.split('.')[:length])
+        else:
+            new_spec_version = None
+        if new_spec_version is not None:
+            # Only the version is replaced, so the spacing around the operator is kept
+            return spec.replace(version, new_spec_version, 1) if new_spec_version != version else None
+    if version_matches(new_version, spec.strip()):
+        return None
+    return f"=={new_version}"
+
+def rewrite_requirements_text(text, new_version):
+    """
+    Update the pyspark requirement of a requirements file, keeping extras, environment
+    markers, comments, whitespace and line endings.
+    
+    :param text: Requirements file content.
+    :param new_version: The new Spark version.
+    :return: Updated content.
+    """
+    lines = []
+    for line in text.splitlines(keepends=True):
+        body = line.rstrip('\r\n')
+        match = REQUIREMENT_LINE.match(body)
+        if match and match.group('spec'):
+            new_spec = rewrite_specifier(match.group('spec'), new_version)
+            if new_spec is not None:
+                line = match.group('name') + new_spec + match.group('rest') + line[len(body):]
+        lines.append(line)
+    return ''.join(lines)
+
+def read_text(file_path):
+    """
+    Read a file exactly as it is, keeping its line endings and any undecodable bytes.
+    
+    :param file_path: Path to the file.
+    :return: File content.
+    """
+    with open(file_path, 'r', encoding='utf-8', errors='surrogateescape', newline='') as file:
+        return file.read()
+
+def write_text(file_path, text):
+    """
+    Atomically replace a file with new content written by read_text's conventions.
+    
+    :param file_path: Path to the file.
+    :param text: New content.
+    """
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8', errors='surrogateescape', newline='') as file:
+        file.write(text)
+    os.replace(tmp_path, file_path)
+
+def plan_rewrites(repo_path, new_version, artifact_suffix, scan_config=None):
+    """
+    Compute the Spark upgrade of every POM, requirements and setup.cfg file of a repository, without writing anything.
+    
+    Files are found with discovery.discover_files, so the same directories are skipped as when scanning.
+    
+    :param repo_path: Path to the repository.
+    :param new_version: The new Spark version.
+    :param artifact_suffix: The new Scala suffix of spark-core and spark-sql artifactIds.
+    :param scan_config: Scanner settings (see discovery.DEFAULT_SCAN_CONFIG).
+    :return: List of (relpath, old content, new content) tuples for the files that change.
+    """
+    files = [(kind, relpath, read_text(file_path))
+             for kind, relpath, file_path, _ in discover_files(repo_path, scan_config or DEFAULT_SCAN_CONFIG)
+             if kind in ('pom', 'requirements', 'setup_cfg')]
+    version_properties = spark_version_properties(text for kind, _, text in files if kind == 'pom')
+
+    rewrites = []
+    for kind, relpath, text in files:
+        if kind == 'pom':
+            new_text = rewrite_pom_text(text, new_version, artifact_suffix, version_properties)
+        else:
+            new_text = rewrite_requirements_text(text, new_version)
+        if new_text != text:
+            logging.info(f"Updating Spark in {relpath} of {repo_path}")
+            rewrites.append((relpath, text, new_text))
+    return rewrites
+
+def unified_diff(repo, rewrites):
+    """
+    Render planned rewrites as a unified diff.
+    
+    :param repo: Name of the repository, used as the first component of the file names.
+    :param rewrites: List of (relpath, old content, new content) tuples (see plan_rewrites).
+    :return: Diff text.
+    """
+    return ''.join(
+        line if line.endswith('\n') else line + '\n'
+        for relpath, old_text, new_text in rewrites
+        for line in difflib.unified_diff(old_text.splitlines(keepends=True), new_text.splitlines(keepends=True),
+                                         f"a/{repo}/{relpath}", f"b/{repo}/{relpath}")
+    )
@@ -0,0 +1,248 @@
+import os
+import random
+import argparse
+import logging
+import subprocess
+
+# Settings of a generated corpus, overridden by the command line or by the caller
+DEFAULT_CORPUS_CONFIG = {
+    'repos': 20,
+    # Maven modules below the root POM of each repository, nested up to module_depth levels
+    'modules': 4,
+    'module_depth': 2,
+    'dependencies': 20,
+    'yaml_files': 5,
+    # Top-level keys of each YAML file, each holding a mapping of yaml_width entries
+    'yaml_keys': 20,
+    'yaml_width': 10,
+    'requirements': 15,
+    # Extra directories per level holding source files that are not manifests
+    'fanout': 3,
+    'fanout_depth': 2,
+    'noise_files': 5,
+    'seed': 0
+}
+
+SPARK_VERSIONS = ['2.4.8', '3.1.3', '3.3.2', '3.5.1']
+PYTHON_PACKAGES = ['pyspark', 'pandas', 'numpy', 'requests', 'pyyaml', 'boto3', 'sqlalchemy', 'pytest',
+                   'flask', 'scipy', 'pyarrow', 'click', 'jinja2', 'psycopg2', 'delta-spark']
+
+def render_pom(artifact_id, dependencies, modules=(), parent=None, spark_version=None):
+    """
+    Render a POM with the given dependencies and modules.
+    
+    :param artifact_id: artifactId of the project.
+    :param dependencies: List of (groupId, artifactId, version) tuples; a None version is left
+                         for the parent's dependencyManagement.
+    :param modules: Names of the child modules.
+    :param parent: artifactId of the parent POM, or None for a root POM.
+    :param spark_version: Value of the spark.version property, defined in root POMs.
+    :return: POM content.
+    """
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<project xmlns="http://maven.apache.org/POM/4.0.0">',
+             '  <modelVersion>4.0.0</modelVersion>']
+    if parent:
+        lines += ['  <parent>', '    <groupId>com.example</groupId>', f'    <artifactId>{parent}</artifactId>',
+                  '    <version>1.0.0</version>', '    <relativePath>../pom.xml</relativePath>', '  </parent>']
+    lines += ['  <groupId>com.example</groupId>', f'  <artifactId>{artifact_id}</artifactId>',
+              '  <version>1.0.0</version>']
+    if spark_version:
+        lines += ['  <properties>', f'    <spark.version>{spark_version}</spark.version>', '  </properties>']
+    if modules:
+        lines += ['  <modules>'] + [f'    <module>{module}</module>' for module in modules] + ['  </modules>']
+    lines.append('  <dependencies>')
+    for group_id, dependency_id, version in dependencies:
+        lines += ['    <dependency>', f'      <groupId>{group_id}</groupId>',
+                  f'      <artifactId>{dependency_id}</artifactId>']
+        if version:
+            lines.append(f'      <version>{version}</version>')
+        lines.append('    </dependency>')
+    lines += ['  </dependencies>', '</project>', '']
+    return '\n'.join(lines)
+
+def render_yaml(rng, keys, width):
+    """
+    Render a YAML configuration file with nested mappings and lists.
+    
+    :param rng: random.Random instance.
+    :param keys: Number of top-level keys.
+    :param width: Number of entries under each top-level key.
+    :return: YAML content.
+    """
+    lines = []
+    for key in range(keys):
+        lines.append(f'section_{key}:')
+        for entry in range(width):
+            choice = rng.random()
+            if choice < 0.2:
+                lines.append(f'  items_{entry}:')
+                lines += [f'    - value_{rng.randrange(1000)}' for _ in range(3)]
+            elif choice < 0.4:
+                lines.append(f'  spark_{entry}:')
+                lines.append(f'    version: "{rng.choice(SPARK_VERSIONS)}"')
+                lines.append(f'    enabled: {str(rng.random() < 0.5).lower()}')
+            else:
+                lines.append(f'  key_{entry}: value_{rng.randrange(100000)}')
+    return '\n'.join(lines) + '\n'
+
+def random_dependencies(rng, count):
+    """
+    Pick a list of dependencies, including Spark artifacts versioned through the
+    spark.version property of the root POM.
+    
+    :param rng: random.Random instance.
+    :param count: Number of dependencies.
+    :return: List of (groupId, artifactId, version) tuples.
+    """
+    dependencies = [('org.apache.spark', 'spark-core_2.12', '${spark.version}'),
+                    ('org.apache.spark', 'spark-sql_2.12', '${spark.version}')]
+    while len(dependencies) < count:
+        index = rng.randrange(500)
+        dependencies.append((f'com.library{index % 50}', f'artifact-{index}', f'{index % 7}.{index % 13}.{index % 3}'))
+    return dependencies[:count]
+
+def write_file(path, content):
+    """
+    Write a text file, creating its directory.
+    
+    :param path: Path to the file.
+    :param content: File content.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(content)
+
+def generate_modules(rng, base_path, parent, names, depth, config):
+    """
+    Write the POMs of a level of Maven modules and, recursively, of their submodules.
+    
+    :param rng: random.Random instance.
+    :param base_path: Directory containing the modules.
+    :param parent: artifactId of the parent POM.
+    :param names: Names of the modules of this level.
+    :param depth: Number of levels left below this one.
+    :param config: Corpus settings (see DEFAULT_CORPUS_CONFIG).
+    :return: Number of POMs written.
+    """
+    count = 0
+    for name in names:
+        children = [f'{name}-sub{index}' for index in range(2)] if depth > 1 else []
+        content = render_pom(name, random_dependencies(rng, config['dependencies']), children, parent)
+        write_file(os.path.join(base_path, name, 'pom.xml'), content)
+        count += 1 + generate_modules(rng, os.path.join(base_path, name), name, children, depth - 1, config)
+    return count
+
+def generate_noise(rng, base_path, depth, config):
+    """
+    Write directories of source files that are not manifests, to exercise directory traversal.
+    
+    :param rng: random.Random instance.
+    :param base_path: Directory where the tree is written.
+    :param depth: Number of levels left.
+    :param config: Corpus settings (see DEFAULT_CORPUS_CONFIG).
+    """
+    if depth <= 0:
+        return
+    for index in range(config['fanout']):
+        dir_path = os.path.join(base_path, f'pkg{index}')
+        for file_index in range(config['noise_files']):
+            write_file(os.path.join(dir_path, f'Source{file_index}.java'),
+                       f'class Source{file_index} {{ int value = {rng.randrange(1000)}; }}\n')
+        generate_noise(rng, dir_path, depth - 1, config)
+
+def generate_repository(repo_path, config, seed):
+    """
+    Write a synthetic repository: a multi-module Maven build, YAML configs, a requirements
+    file and directories of other source files.
+    
+    :param repo_path: Path to the new repository.
+    :param config: Corpus settings (see DEFAULT_CORPUS_CONFIG).
+    :param seed: Seed of the repository's random generator.
+    :return: Number of manifest files written.
+    """
+    rng = random.Random(seed)
+    modules = [f'module{index}' for index in range(config['modules'])]
+    name = os.path.basename(repo_path)
+    write_file(os.path.join(repo_path, 'pom.xml'),
+               render_pom(name, random_dependencies(rng, config['dependencies']), modules,
+                          spark_version=rng.choice(SPARK_VERSIONS)))
+    count = 1 + generate_modules(rng, repo_path, name, modules, config['module_depth'], config)
+    for index in range(config['yaml_files']):
+        write_file(os.path.join(repo_path, 'conf', f'config{index}.yaml'),
+                   render_yaml(rng, config['yaml_keys'], config['yaml_width']))
+        count += 1
+    if config['requirements']:
+        packages = rng.sample(PYTHON_PACKAGES, min(config['requirements'], len(PYTHON_PACKAGES)))
+        packages += [f'package-{index}' for index in range(config['requirements'] - len(packages))]
+        write_file(os.path.join(repo_path, 'requirements.txt'),
+                   ''.join(f'{package}=={rng.randrange(1, 5)}.{rng.randrange(10)}.0\n' for package in packages))
+        count += 1
+    generate_noise(rng, os.path.join(repo_path, 'src'), config['fanout_depth'], config)
+    return count
+
+def commit_repository(repo_path):
+    """
+    Turn a generated repository into a git repository with a single commit.
+    
+    :param repo_path: Path to the repository.
+    """
+    environment = dict(os.environ, GIT_AUTHOR_NAME='corpus', GIT_AUTHOR_EMAIL='corpus@example.com',
+                       GIT_COMMITTER_NAME='corpus', GIT_COMMITTER_EMAIL='corpus@example.com')
+    for args in (['init', '-q'], ['add', '-A'], ['commit', '-q', '-m', 'Synthetic corpus']):
+        subprocess.run(['git', *args], cwd=repo_path, env=environment, check=True)
+
+def generate_corpus(target_path, config=None, git=False):
+    """
+    Write a synthetic corpus of repositories. The same settings always produce the same corpus.
+    
+    :param target_path: Directory where the repositories are written, which must not exist.
+    :param config: Corpus settings (see DEFAULT_CORPUS_CONFIG).
+    :param git: Whether to commit each repository, for scans with --git_refs or clones.
+    :return: Dictionary with the number of repositories and manifest files written.
+    """
+    config = dict(DEFAULT_CORPUS_CONFIG, **(config or {}))
+    os.makedirs(target_path)
+    manifests = 0
+    for index in range(config['repos']):
+        repo_path = os.path.join(target_path, f'repo{index:05d}')
+        manifests += generate_repository(repo_path, config, config['seed'] * 1000003 + index)
+        if git:
+            commit_repository(repo_path)
+    logging.info(f"Generated {config['repos']} repositories with {manifests} manifest files in {target_path}")
+    return {'repos': config['repos'], 'manifests': manifests}
+
+def add_corpus_arguments(parser):
+    """
+    Add the corpus settings to an argument parser, as --<setting> options.
+    
+    :param parser: argparse.ArgumentParser to extend.
+    """
+    for name, default in DEFAULT_CORPUS_CONFIG.items():
+        parser.add_argument(f'--{name}', type=int, default=default, help=f'Corpus setting {name} (default {default}).')
+
+def corpus_config(args):
+    """
+    Read the corpus settings from parsed arguments (see add_corpus_arguments).
+    
+    :param args: Parsed arguments.
+    :return: Dictionary with the corpus settings.
+    """
+    return {name: getattr(args, name) for name in DEFAULT_CORPUS_CONFIG}
+
+def main():
+    """
+    Main function to generate a synthetic corpus of repositories.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic corpus of repositories for benchmarks.')
+    parser.add_argument('--target_path', type=str, required=True, help='Directory where the repositories are written.')
+    parser.add_argument('--git', action='store_true', help='Commit each repository with git.')
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    generate_corpus(args.target_path, corpus_config(args), args.git)
+
+if __name__ == "__main__":
+    main()
@@ -1,101 +1,134 @@
 import os
-import json
+import sys
 import shutil
 import logging
 import argparse
-import yaml
-import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from repo_copy import COPY_MODES, copy_tree, materialize
+from spark_rewriter import plan_rewrites, unified_diff, write_text
+from discovery import load_scan_config
+from scan_results import read_scan_results
+from yaml_backend import load_config
 
-def update_requirements(requirements, new_version):
+def apply_rewrites(repo_path, rewrites):
     """
-    Update the Spark version in the requirements list.
+    Write planned rewrites to a repository, materializing hardlinked files first.
     
-    :param requirements: List of requirements as strings.
-    :param new_version: The new version to update to.
-    :return: Updated list of requirements.
+    :param repo_path: Path to the repository.
+    :param rewrites: List of (relpath, old content, new content) tuples (see spark_rewriter.plan_rewrites).
     """
-    logging.info("Updating Spark version in requirements.txt")
-    updated_requirements = []
-    try:
-        for req in requirements:
-            if req.startswith("pyspark=="):
-                logging.info(f"Updating {req} to pyspark=={new_version}")
-                updated_requirements.append(f"pyspark=={new_version}")
-            else:
-                updated_requirements.append(req)
-    except Exception as e:
-        logging.error(f"Error updating requirements: {e}")
-    return updated_requirements
+    for relpath, _, new_text in rewrites:
+        file_path = os.path.join(repo_path, *relpath.split('/'))
+        materialize(file_path)
+        write_text(file_path, new_text)
 
-def update_pom_file(xml_path, new_version, artifact_suffix):
+def copy_and_update_repo(repo, base_path, new_base_path, new_version, artifact_suffix, copy_mode='copy',
+                         scan_config=None, dry_run=False):
     """
-    Update the pom.xml file with the new dependencies.
+    Copy a repository to a new location and update its Spark dependencies.
+    
+    Rewrites are planned from the original repository. The copy is built in a '.partial'
+    directory that is only renamed to its final name once every file has been updated,
+    and is removed if anything fails.
     
-    :param xml_path: Path to the pom.xml file.
+    :param repo: Name of the repository.
+    :param base_path: Original base path to the repositories.
+    :param new_base_path: New base path for the copied repositories.
     :param new_version: The new version to update to.
     :param artifact_suffix: The new artifactId suffix to update to.
+    :param copy_mode: How untouched files are duplicated: 'copy', 'hardlink' or 'reflink' (see repo_copy.copy_tree).
+    :param scan_config: Scanner settings used to find the POM and requirements files.
+    :param dry_run: Whether to only compute the changes, without copying anything.
+    :return: Tuple of (repo, unified diff of the changes, number of files changed).
     """
-    logging.info(f"Updating pom.xml file at {xml_path}")
+    original_repo_path = os.path.join(base_path, repo)
+    if not os.path.isdir(original_repo_path):
+        raise FileNotFoundError(f"{original_repo_path} does not exist")
+    rewrites = plan_rewrites(original_repo_path, new_version, artifact_suffix, scan_config)
+    diff = unified_diff(repo, rewrites)
+    if dry_run:
+        return repo, diff, len(rewrites)
+
+    new_repo_path = os.path.join(new_base_path, repo)
+    if os.path.exists(new_repo_path):
+        raise FileExistsError(f"{new_repo_path} already exists")
+    partial_path = f"{new_repo_path}.partial"
+    if os.path.exists(partial_path):
+        shutil.rmtree(partial_path)
     try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        namespaces = {'mvn': 'http://maven.apache.org/POM/4.0.0'}
-        
-        for dependency in root.findall('.//mvn:dependency', namespaces):
-            group_id = dependency.find('mvn:groupId', namespaces).text
-            artifact_id = dependency.find('mvn:artifactId', namespaces).text
-            if group_id == 'org.apache.spark':
-                version_element = dependency.find('mvn:version', namespaces)
-                logging.info(f"Updating {artifact_id} from version {version_element.text} to {new_version}")
-                version_element.text = new_version
-                if artifact_id.startswith("spark-core") or artifact_id.startswith("spark-sql"):
-                    new_artifact_id = artifact_id.split('_')[0] + artifact_suffix
-                    logging.info(f"Updating artifactId from {artifact_id} to {new_artifact_id}")
-                    dependency.find('mvn:artifactId', namespaces).text = new_artifact_id
-        
-        tree.write(xml_path)
-    except Exception as e:
-        logging.error(f"Error updating pom.xml: {e}")
+        counts = copy_tree(original_repo_path, partial_path, copy_mode)
+        apply_rewrites(partial_path, rewrites)
+        os.rename(partial_path, new_repo_path)
+    except Exception:
+        shutil.rmtree(partial_path, ignore_errors=True)
+        raise
+    logging.info(f"Copied repository {repo} to {new_repo_path} and updated {len(rewrites)} files "
+                 f"({counts['reflink']} reflinked, {counts['hardlink']} hardlinked, {counts['copy']} copied files)")
+    return repo, diff, len(rewrites)
 
-def copy_and_update_repos(base_path, new_base_path, scan_results_path, new_version, artifact_suffix):
+def copy_and_update_repos(base_path, new_base_path, scan_results_path, new_version, artifact_suffix,
+                          copy_mode='copy', workers=1, scan_config=None, dry_run=False, diff_output_path=None):
     """
     Copy repositories to a new location and update Spark dependencies to the specified version if necessary.
     
+    Repositories are processed across a pool of worker processes, with a bounded number in flight,
+    and the diff report is written in the order of the scan results.
+    
     :param base_path: Original base path to the repositories.
-    :param new_base_path: New base path for the copied repositories.
-    :param scan_results_path: Path to the scan results JSON file.
+    :param new_base_path: New base path for the copied repositories (unused in dry-run mode).
+    :param scan_results_path: Path to the scan results JSON or JSON Lines file.
     :param new_version: The new version to update to.
     :param artifact_suffix: The new artifactId suffix to update to.
+    :param copy_mode: How untouched files are duplicated: 'copy', 'hardlink' or 'reflink' (see repo_copy.copy_tree).
+    :param workers: Number of worker processes.
+    :param scan_config: Scanner settings used to find the POM and requirements files.
+    :param dry_run: Whether to only report the changes, without copying anything.
+    :param diff_output_path: Path to the unified diff report, or None to print it in dry-run mode only.
     """
-    logging.info(f"Copying repositories from {base_path} to {new_base_path}")
+    logging.info(f"{'Planning' if dry_run else 'Copying'} Spark upgrade of repositories from {base_path}")
     try:
-        if not os.path.exists(new_base_path):
+        if not dry_run and not os.path.exists(new_base_path):
             os.makedirs(new_base_path)
-        
-        with open(scan_results_path, 'r') as file:
-            scan_results = json.load(file)
-        
-        for repo, repo_data in scan_results.items():
-            original_repo_path = os.path.join(base_path, repo)
-            new_repo_path = os.path.join(new_base_path, repo)
-            shutil.copytree(original_repo_path, new_repo_path)
-            logging.info(f"Copied repository {repo} to {new_repo_path}")
 
-            # Update dependencies in the copied repository
-            if 'dependencies' in repo_data:
-                xml_path = os.path.join(new_repo_path, 'pom.xml')
-                if os.path.exists(xml_path):
-                    logging.info(f"Updating pom.xml at {xml_path}")
-                    update_pom_file(xml_path, new_version, artifact_suffix)
-            
-            # Update requirements.txt in the copied repository
-            if 'requirements' in repo_data:
-                updated_requirements = update_requirements(repo_data['requirements'], new_version)
-                req_path = os.path.join(new_repo_path, 'requirements.txt')
-                if os.path.exists(req_path):
-                    logging.info(f"Updating requirements.txt at {req_path}")
-                    with open(req_path, 'w') as req_file:
-                        req_file.write("\n".join(updated_requirements))
+        if diff_output_path:
+            report_file = open(diff_output_path, 'w')
+        else:
+            report_file = sys.stdout if dry_run else None
+        totals = {'repos': 0, 'changed': 0, 'files': 0, 'failed': 0}
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = iter(read_scan_results(scan_results_path))
+                in_flight = deque()
+                while True:
+                    while len(in_flight) < workers * 4:
+                        next_repo = next(pending, None)
+                        if next_repo is None:
+                            break
+                        repo = next_repo[0]
+                        in_flight.append((repo, executor.submit(copy_and_update_repo, repo, base_path, new_base_path,
+                                                                new_version, artifact_suffix, copy_mode, scan_config,
+                                                                dry_run)))
+                    if not in_flight:
+                        break
+                    repo, future = in_flight.popleft()
+                    totals['repos'] += 1
+                    try:
+                        _, diff, changed = future.result()
+                    except Exception as e:
+                        logging.error(f"Error copying and updating repository {repo}: {e}")
+                        totals['failed'] += 1
+                        continue
+                    if changed:
+                        totals['changed'] += 1
+                        totals['files'] += changed
+                    if report_file is not None:
+                        report_file.write(diff)
+        finally:
+            if diff_output_path:
+                report_file.close()
+        logging.info(f"{totals['changed']} of {totals['repos']} repositories need changes in {totals['files']} files, "
+                     f"{totals['failed']} failed")
     except Exception as e:
         logging.error(f"Error copying and updating repositories: {e}")
 
@@ -107,19 +140,27 @@ def main():
     
     parser = argparse.ArgumentParser(description='Copy repositories and update Spark dependencies to a specified version.')
     parser.add_argument('--base_path', type=str, required=True, help='Base path to the repositories.')
-    parser.add_argument('--new_base_path', type=str, required=True, help='New base path for the copied repositories.')
-    parser.add_argument('--scan_results_path', type=str, required=True, help='Path to the scan results JSON file.')
+    parser.add_argument('--new_base_path', type=str, help='New base path for the copied repositories. Required unless --dry_run is given.')
+    parser.add_argument('--scan_results_path', type=str, required=True, help='Path to the scan results JSON or JSON Lines (.ndjson/.jsonl) file.')
     parser.add_argument('--config_path', type=str, required=True, help='Path to the configuration file.')
+    parser.add_argument('--copy_mode', type=str, choices=COPY_MODES, default='copy',
+                        help="How untouched files are duplicated: 'copy', 'hardlink', or 'reflink' (copy-on-write clones, falling back to hardlinks).")
+    parser.add_argument('--workers', type=int, default=4, help='Number of worker processes copying and updating repositories.')
+    parser.add_argument('--dry_run', action='store_true', help='Only report the changes as a unified diff, without copying anything.')
+    parser.add_argument('--diff_output_path', type=str, help='Path to the unified diff report. In dry-run mode it is printed when not given.')
     args = parser.parse_args()
+    if not args.dry_run and not args.new_base_path:
+        parser.error('--new_base_path is required unless --dry_run is given')
 
     try:
-        with open(args.config_path, 'r') as file:
-            config = yaml.safe_load(file)
+        config = load_config(args.config_path)
         
         new_version = config.get('spark_version', '3.5.0')
         artifact_suffix = config.get('artifact_suffix', '_2.13')
 
-        copy_and_update_repos(args.base_path, args.new_base_path, args.scan_results_path, new_version, artifact_suffix)
+        copy_and_update_repos(args.base_path, args.new_base_path, args.scan_results_path, new_version, artifact_suffix,
+                              args.copy_mode, args.workers, load_scan_config(args.config_path), args.dry_run,
+                              args.diff_output_path)
     except Exception as e:
         logging.error(f"Error in main function: {e}")
 
@@ -0,0 +1,116 @@
+import re
+from functools import lru_cache
+from packaging.specifiers import SpecifierSet, InvalidSpecifier
+from packaging.version import Version, InvalidVersion
+
+# Number of distinct specifiers and versions whose parsed form is kept. The same few
+# thousand values repeat across repositories, so most lookups are hits.
+PARSE_CACHE_SIZE = 65536
+
+# Leading release part of versions that are not valid PEP 440 versions, e.g. Maven's '2.4.0-cdh6.3.2'
+RELEASE_PREFIX = re.compile(r'\d+(?:\.\d+)*')
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def specifier_set(spec):
+    """
+    Parse a version specifier set.
+    
+    :param spec: Specifier set, e.g. '>=2.4,<3.0'.
+    :return: packaging SpecifierSet, or None if it is not valid.
+    """
+    try:
+        return SpecifierSet(spec or '')
+    except InvalidSpecifier:
+        return None
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_version(version):
+    """
+    Parse a Python (PEP 440) or Maven version. Versions that are not valid PEP 440 versions
+    are compared by their leading release part, e.g. '2.4.0-cdh6.3.2' as '2.4.0'.
+    
+    :param version: Version string.
+    :return: packaging Version, or None if it has no numeric release part (e.g. '${spark.version}').
+    """
+    try:
+        return Version(version)
+    except (InvalidVersion, TypeError):
+        pass
+    release = RELEASE_PREFIX.match(version or '')
+    return Version(release.group(0)) if release else None
+
+def pinned_version(spec):
+    """
+    Get the version a specifier set pins, if it pins exactly one.
+    
+    :param spec: Specifier set, e.g. '==3.3.0'.
+    :return: The pinned version, or None for ranges, wildcards and empty specifiers.
+    """
+    specifiers = specifier_set(spec)
+    if specifiers is None or len(specifiers) != 1:
+        return None
+    clause = next(iter(specifiers))
+    if clause.operator in ('==', '===') and not clause.version.endswith('.*'):
+        return clause.version
+    return None
+
+def version_matches(version, spec):
+    """
+    Check whether a version satisfies a specifier set. Pre-releases are compared like
+    any other version, since the version is one a repository already uses.
+    
+    :param version: Version to check, or None.
+    :param spec: Specifier set, e.g. '<3.0' or '>=2.4,<3.0'. An empty specifier matches every version.
+    :return: True if the version satisfies the specifier set; False if either is not valid.
+    """
+    specifiers = specifier_set(spec)
+    if specifiers is None:
+        return False
+    if not spec:
+        return True
+    parsed = parse_version(version)
+    return parsed is not None and specifiers.contains(parsed, prereleases=True)
+
+def boundary_candidates(version):
+    """
+    List the versions at and right around a specifier boundary, e.g. '3.0' -> '3.0', '2.999',
+    '3.0.1' and '3.1'.
+    
+    :param version: Version of a specifier clause, possibly ending in '.*'.
+    :return: List of version strings.
+    """
+    wildcard = version.endswith('.*')
+    parsed = parse_version(version[:-2] if wildcard else version)
+    if parsed is None:
+        return [version]
+    release = parsed.release
+    candidates = [str(parsed), '.'.join(map(str, release + (1,))),
+                  '.'.join(map(str, release[:-1] + (release[-1] + 1,)))]
+    # The closest release below: decrement the last non-zero part and pad with a large one
+    nonzero = [index for index, part in enumerate(release) if part]
+    if nonzero:
+        index = nonzero[-1]
+        below = release[:index] + (release[index] - 1,) + (999,) * (len(release) - index)
+        candidates.append('.'.join(map(str, below)))
+    return candidates
+
+def specifiers_overlap(spec, version_spec):
+    """
+    Check whether some version satisfies two specifier sets at once, e.g. whether the range of
+    a requirement such as '>=2.4,<3' admits a version of the queried range '<3.0'.
+    
+    The versions at and right around the boundaries of both sets are checked, which is exact
+    for the pins, wildcards and ranges written in requirements.
+    
+    :param spec: Specifier set of a requirement. An empty specifier admits every version.
+    :param version_spec: Queried specifier set.
+    :return: True if a version satisfies both; False if either is not valid.
+    """
+    specifiers, query = specifier_set(spec), specifier_set(version_spec)
+    if specifiers is None or query is None:
+        return False
+    combined = specifiers & query
+    if not len(combined):
+        return True
+    return any(combined.contains(candidate, prereleases=True)
+               for clause in combined for candidate in boundary_candidates(clause.version))
@@ -0,0 +1,270 @@
+import os
+import re
+import socket
+import logging
+import argparse
+import threading
+from db import add_db_arguments, load_db_config, cursor
+
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_HEARTBEAT_INTERVAL = 60
+DEFAULT_MAX_ATTEMPTS = 3
+
+ENQUEUE = """
+    UPDATE {schema}.repositories r
+    SET queued_at = COALESCE(r.queued_at, now()), attempts = 0, last_error = NULL
+    FROM {schema}.organizations o
+    WHERE o.id = r.organization_id AND o.scan = TRUE AND r.scan = TRUE
+      AND (r.lease_expires_at IS NULL OR r.lease_expires_at < now())
+"""
+# Rows locked by another node's claim are skipped rather than waited for, so nodes never
+# block each other. Expired leases (crashed nodes) can be claimed again.
+CLAIM = """
+    UPDATE {schema}.repositories r
+    SET lease_owner = %(node_id)s, lease_expires_at = now() + %(lease_seconds)s * interval '1 second',
+        heartbeat_at = now(), attempts = r.attempts + 1
+    WHERE r.id IN (
+        SELECT r.id FROM {schema}.repositories r
+        JOIN {schema}.organizations o ON o.id = r.organization_id
+        WHERE r.queued_at IS NOT NULL AND o.scan = TRUE AND r.scan = TRUE
+          AND (r.lease_expires_at IS NULL OR r.lease_expires_at < now())
+          AND r.attempts < %(max_attempts)s
+        ORDER BY r.queued_at, r.id
+        LIMIT %(limit)s
+        FOR UPDATE OF r SKIP LOCKED
+    )
+    RETURNING r.id, r.link
+"""
+# Rows locked by another transaction (e.g. an export updating last_scan_date) are skipped
+# rather than waited for; their lease is extended by the next heartbeat
+HEARTBEAT = """
+    UPDATE {schema}.repositories
+    SET lease_expires_at = now() + %(lease_seconds)s * interval '1 second', heartbeat_at = now()
+    WHERE id IN (
+        SELECT id FROM {schema}.repositories
+        WHERE id = ANY(%(ids)s) AND lease_owner = %(node_id)s
+        FOR UPDATE SKIP LOCKED
+    )
+"""
+RELEASE = """
+    UPDATE {schema}.repositories
+    SET lease_owner = NULL, lease_expires_at = NULL, last_error = %(error)s,
+        queued_at = CASE WHEN %(done)s THEN NULL ELSE queued_at END
+    WHERE id = ANY(%(ids)s) AND lease_owner = %(node_id)s
+"""
+# Same filter as CLAIM: repositories no longer marked to scan stay queued but are never claimed
+STATUS = """
+    SELECT CASE
+               WHEN r.lease_expires_at >= now() THEN 'leased'
+               WHEN r.attempts >= %s THEN 'exhausted'
+               ELSE 'waiting'
+           END AS state,
+           CASE WHEN r.lease_expires_at >= now() THEN r.lease_owner END AS owner,
+           count(*)
+    FROM {schema}.repositories r
+    JOIN {schema}.organizations o ON o.id = r.organization_id
+    WHERE r.queued_at IS NOT NULL AND o.scan = TRUE AND r.scan = TRUE
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+
+def default_node_id():
+    """
+    Build an identifier of the current process, unique across the nodes sharing a work queue.
+    
+    :return: '<hostname>-<pid>'.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class WorkQueue:
+    """
+    Work queue of repositories to scan, stored in the my_schema.repositories table so several
+    nodes can clone, scan and export repositories at the same time.
+    
+    Queued repositories have a queued_at date. A node claims repositories with
+    SELECT ... FOR UPDATE SKIP LOCKED, which gives it a lease until lease_expires_at, and a
+    heartbeat thread extends the leases of the repositories it holds. Repositories are removed
+    from the queue when completed; if the node fails to process them, or crashes and its
+    leases expire, they are claimed again, up to max_attempts times.
+    """
+
+    def __init__(self, db_config, node_id=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL, max_attempts=DEFAULT_MAX_ATTEMPTS, schema='my_schema'):
+        """
+        Create a work queue client. The heartbeat thread is started with start().
+        
+        :param db_config: Dictionary of psycopg2 connection keywords.
+        :param node_id: Identifier of the node stored as lease owner, or None to use default_node_id().
+        :param lease_seconds: Seconds a claimed repository stays leased without a heartbeat.
+        :param heartbeat_interval: Seconds between two lease extensions. Must be well below lease_seconds.
+        :param max_attempts: Number of claims of a repository before it is left in the queue as exhausted.
+        :param schema: Schema of the organizations and repositories tables, e.g. a throwaway one in checks.
+        """
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', schema):
+            raise ValueError(f"Invalid schema name: {schema}")
+        self.schema = schema
+        self.db_config = db_config
+        self.node_id = node_id or default_node_id()
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        # IDs of the repositories leased by this node
+        self.held = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def enqueue(self):
+        """
+        Queue every repository to scan (see repositories.get_repositories_to_clone) and reset
+        its attempts. Repositories already queued keep their position; leased ones are left alone.
+        
+        :return: Number of repositories queued or reset.
+        """
+        with cursor(self.db_config) as cur:
+            cur.execute(ENQUEUE.format(schema=self.schema))
+            count = cur.rowcount
+        logging.info(f"Queued {count} repositories")
+        return count
+
+    def claim(self, limit):
+        """
+        Lease up to limit queued repositories that no other node holds.
+        
+        :param limit: Maximum number of repositories to claim.
+        :return: List of (repository ID, URL) tuples.
+        """
+        with cursor(self.db_config) as cur:
+            cur.execute(CLAIM.format(schema=self.schema),
+                        {'node_id': self.node_id, 'lease_seconds': self.lease_seconds,
+                         'max_attempts': self.max_attempts, 'limit': limit})
+            rows = cur.fetchall()
+        with self.lock:
+            self.held.update(repo_id for repo_id, _ in rows)
+        if rows:
+            logging.info(f"Node {self.node_id} claimed {len(rows)} repositories")
+        return rows
+
+    def heartbeat(self):
+        """
+        Extend the leases of the repositories held by this node.
+        """
+        with self.lock:
+            ids = list(self.held)
+        if not ids:
+            return
+        with cursor(self.db_config) as cur:
+            cur.execute(HEARTBEAT.format(schema=self.schema),
+                        {'node_id': self.node_id, 'lease_seconds': self.lease_seconds, 'ids': ids})
+
+    def release(self, repo_ids, error=None, done=False):
+        """
+        Give up the leases of repositories, removing them from the queue if they are done.
+        
+        :param repo_ids: IDs of repositories held by this node.
+        :param error: Error stored as last_error of the repositories, or None.
+        :param done: Whether the repositories were processed and leave the queue.
+        :return: Number of repositories whose lease was still held by this node.
+        """
+        with self.lock:
+            ids = [repo_id for repo_id in repo_ids if repo_id in self.held]
+            self.held.difference_update(ids)
+        if not ids:
+            return 0
+        with cursor(self.db_config) as cur:
+            cur.execute(RELEASE.format(schema=self.schema),
+                        {'node_id': self.node_id, 'ids': ids, 'error': error, 'done': done})
+            released = cur.rowcount
+        if released < len(ids):
+            logging.warning(f"Node {self.node_id} lost the lease of {len(ids) - released} repositories")
+        return released
+
+    def complete(self, repo_ids):
+        """
+        Remove processed repositories from the queue (see release).
+        
+        :param repo_ids: IDs of repositories held by this node.
+        """
+        self.release(repo_ids, done=True)
+
+    def fail(self, repo_id, error):
+        """
+        Give up a repository that could not be processed, so it can be claimed again.
+        
+        :param repo_id: ID of a repository held by this node.
+        :param error: Exception or message stored as last_error.
+        """
+        self.release([repo_id], error=str(error))
+
+    def pending(self):
+        """
+        Count the queued repositories that are waiting or leased, i.e. that may still be processed.
+        
+        :return: Number of repositories.
+        """
+        return sum(count for state, _, count in self.status() if state != 'exhausted')
+
+    def status(self):
+        """
+        Count the queued repositories to scan by state and lease owner.
+        
+        :return: List of (state, owner, count) tuples; state is 'waiting', 'leased' or 'exhausted'
+                 and owner is None unless the repositories are leased.
+        """
+        with cursor(self.db_config) as cur:
+            cur.execute(STATUS.format(schema=self.schema), (self.max_attempts,))
+            return cur.fetchall()
+
+    def run_heartbeat(self):
+        """
+        Extend the leases of this node every heartbeat_interval seconds until stop() is called.
+        """
+        while not self.stopped.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logging.error(f"Error extending the leases of node {self.node_id}: {e}")
+
+    def start(self):
+        """
+        Start the heartbeat thread.
+        """
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run_heartbeat, name='heartbeat', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the heartbeat thread and release the repositories still held, so other nodes
+        can claim them without waiting for the leases to expire.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            repo_ids = list(self.held)
+        if repo_ids:
+            logging.warning(f"Node {self.node_id} releasing {len(repo_ids)} unfinished repositories")
+            self.release(repo_ids, error='released unfinished')
+
+def main():
+    """
+    Main function to queue the repositories to scan and show the state of the work queue.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Manage the work queue of repositories scanned by pipeline.py --work_queue.')
+    add_db_arguments(parser)
+    parser.add_argument('--enqueue', action='store_true', help='Queue every repository to scan.')
+    parser.add_argument('--max_attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Number of claims after which a repository counts as exhausted.')
+    args = parser.parse_args()
+
+    work_queue = WorkQueue(load_db_config(args), max_attempts=args.max_attempts)
+    if args.enqueue:
+        work_queue.enqueue()
+    for state, owner, count in work_queue.status():
+        logging.info(f"{state}{f' by {owner}' if owner else ''}: {count}")
+
+if __name__ == "__main__":
+    main()
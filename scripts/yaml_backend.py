@@ -0,0 +1,68 @@
+import os
+import yaml
+import logging
+
+# libyaml-based loader when PyYAML was built with it, pure-Python loader otherwise
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def load_config(config_path):
+    """
+    Load a single-document YAML configuration file.
+    
+    :param config_path: Path to the configuration file.
+    :return: Parsed configuration.
+    """
+    with open(config_path, 'rb') as file:
+        return yaml.load(file, Loader=SafeLoader)
+
+def load_yaml_text(content):
+    """
+    Parse every document of a YAML string or byte string.
+    
+    :param content: YAML content.
+    :return: The document if there is exactly one, a list of documents if there are several,
+             or None if there are none.
+    """
+    documents = [document for document in yaml.load_all(content, Loader=SafeLoader) if document is not None]
+    if not documents:
+        return None
+    if len(documents) == 1:
+        return documents[0]
+    return documents
+
+def truncate_documents(content):
+    """
+    Cut YAML content after its last complete document.
+    
+    :param content: Start of the YAML content as bytes.
+    :return: The content up to the last document separator, or None if there is none.
+    """
+    end = content.rfind(b'\n---')
+    if end <= 0:
+        return None
+    return content[:end + 1]
+
+def load_yaml_file(yaml_path, max_size=None, oversize='skip'):
+    """
+    Load a YAML file, supporting multi-document files (e.g. Kubernetes or Helm manifests).
+    
+    :param yaml_path: Path to the YAML file.
+    :param max_size: Maximum size in bytes of the files that are fully parsed, or None for no limit.
+    :param oversize: What to do with larger files: 'skip' ignores them and 'truncate' parses
+                     the complete documents found within the first max_size bytes.
+    :return: Parsed content (see load_yaml_text), or None if the file was skipped.
+    """
+    if max_size and os.path.getsize(yaml_path) > max_size:
+        if oversize != 'truncate':
+            logging.warning(f"Skipping YAML file larger than {max_size} bytes: {yaml_path}")
+            return None
+        with open(yaml_path, 'rb') as file:
+            content = truncate_documents(file.read(max_size))
+        if content is None:
+            logging.warning(f"Skipping YAML file larger than {max_size} bytes without document separators: {yaml_path}")
+            return None
+        logging.warning(f"Truncating YAML file larger than {max_size} bytes: {yaml_path}")
+        return load_yaml_text(content)
+
+    with open(yaml_path, 'rb') as file:
+        return load_yaml_text(file)
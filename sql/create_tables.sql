@@ -1,3 +1,12 @@
+-- Requires PostgreSQL 15 or later: the unique indexes below treat NULLs as equal (NULLS NOT DISTINCT)
+DO $$
+BEGIN
+    IF current_setting('server_version_num')::int < 150000 THEN
+        RAISE EXCEPTION 'create_tables.sql requires PostgreSQL 15 or later, the server runs %', current_setting('server_version');
+    END IF;
+END
+$$;
+
 -- Schema: my_schema
 CREATE SCHEMA IF NOT EXISTS my_schema;
 
@@ -28,6 +37,7 @@ CREATE TABLE IF NOT EXISTS my_schema.repositories (
     link VARCHAR(255) NOT NULL,
     scan BOOLEAN DEFAULT FALSE,
     last_scan_date DATE,
+    content_hash CHAR(40),
     FOREIGN KEY (organization_id) REFERENCES organizations(id)
 );
 
@@ -43,8 +53,9 @@ CREATE TABLE IF NOT EXISTS my_schema.requirements (
 CREATE TABLE IF NOT EXISTS my_schema.yaml_files (
     id SERIAL PRIMARY KEY,
     repository_id INT NOT NULL,
-    yaml_file_name VARCHAR(255),
+    yaml_file_name TEXT,
     yaml_content JSONB,
+    content_hash CHAR(40),
     FOREIGN KEY (repository_id) REFERENCES repositories(id)
 );
 
@@ -57,3 +68,73 @@ CREATE TABLE IF NOT EXISTS my_schema.dependencies (
     version VARCHAR(255),
     FOREIGN KEY (repository_id) REFERENCES repositories(id)
 );
+
+-- Columns added after the first release
+ALTER TABLE my_schema.repositories ADD COLUMN IF NOT EXISTS content_hash CHAR(40);
+ALTER TABLE my_schema.yaml_files ADD COLUMN IF NOT EXISTS content_hash CHAR(40);
+-- YAML files are stored by their path relative to the repository, which can exceed 255 characters
+ALTER TABLE my_schema.yaml_files ALTER COLUMN yaml_file_name TYPE TEXT;
+-- Normalized package name (PEP 503) and version specifier of each requirement, NULL when it cannot be parsed
+ALTER TABLE my_schema.requirements ADD COLUMN IF NOT EXISTS name VARCHAR(255);
+ALTER TABLE my_schema.requirements ADD COLUMN IF NOT EXISTS specifier VARCHAR(255);
+
+-- Unique indexes used by the diff-based export (ON CONFLICT upserts)
+CREATE UNIQUE INDEX IF NOT EXISTS yaml_files_repository_file_key
+    ON my_schema.yaml_files (repository_id, yaml_file_name);
+CREATE UNIQUE INDEX IF NOT EXISTS dependencies_repository_coordinates_key
+    ON my_schema.dependencies (repository_id, group_id, artifact_id, version) NULLS NOT DISTINCT;
+CREATE UNIQUE INDEX IF NOT EXISTS requirements_repository_requirement_key
+    ON my_schema.requirements (repository_id, requirement) NULLS NOT DISTINCT;
+
+-- Unique indexes used by import_excel_to_db.py, so re-importing the Excel file updates rows instead of duplicating them
+CREATE UNIQUE INDEX IF NOT EXISTS organizations_name_key
+    ON my_schema.organizations (name);
+CREATE UNIQUE INDEX IF NOT EXISTS repositories_organization_name_key
+    ON my_schema.repositories (organization_id, name);
+CREATE UNIQUE INDEX IF NOT EXISTS meetings_organization_date_description_key
+    ON my_schema.meetings (organization_id, date, description) NULLS NOT DISTINCT;
+
+-- Query indexes used by dependency_index.py. Lookups by repository_id are served by the
+-- unique indexes above, which all start with repository_id.
+CREATE INDEX IF NOT EXISTS dependencies_coordinates_idx
+    ON my_schema.dependencies (group_id, artifact_id, version);
+CREATE INDEX IF NOT EXISTS requirements_name_idx
+    ON my_schema.requirements (name);
+CREATE INDEX IF NOT EXISTS yaml_files_content_idx
+    ON my_schema.yaml_files USING GIN (yaml_content jsonb_path_ops);
+
+-- Scan history recorded by scan_diff.py. Each recorded scan is a generation; the scan results
+-- of a repository are stored once per distinct content hash and shared by every generation
+-- in which the repository had them.
+CREATE TABLE IF NOT EXISTS my_schema.scan_generations (
+    id SERIAL PRIMARY KEY,
+    created_at TIMESTAMP NOT NULL DEFAULT now(),
+    source VARCHAR(255),
+    repository_count INT
+);
+
+CREATE TABLE IF NOT EXISTS my_schema.scan_contents (
+    content_hash CHAR(40) PRIMARY KEY,
+    repo_data JSONB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS my_schema.scan_history (
+    generation_id INT NOT NULL,
+    repository_id INT NOT NULL,
+    content_hash CHAR(40) NOT NULL,
+    PRIMARY KEY (generation_id, repository_id),
+    FOREIGN KEY (generation_id) REFERENCES scan_generations(id) ON DELETE CASCADE,
+    FOREIGN KEY (repository_id) REFERENCES repositories(id),
+    FOREIGN KEY (content_hash) REFERENCES scan_contents(content_hash)
+);
+
+-- Work queue of pipeline.py --work_queue (see work_queue.py): repositories waiting to be
+-- scanned and the lease of the node processing them
+ALTER TABLE my_schema.repositories ADD COLUMN IF NOT EXISTS queued_at TIMESTAMP;
+ALTER TABLE my_schema.repositories ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(255);
+ALTER TABLE my_schema.repositories ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP;
+ALTER TABLE my_schema.repositories ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP;
+ALTER TABLE my_schema.repositories ADD COLUMN IF NOT EXISTS attempts INT NOT NULL DEFAULT 0;
+ALTER TABLE my_schema.repositories ADD COLUMN IF NOT EXISTS last_error TEXT;
+CREATE INDEX IF NOT EXISTS repositories_queue_idx
+    ON my_schema.repositories (queued_at, id) WHERE queued_at IS NOT NULL;